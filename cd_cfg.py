@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#
+# Software License Agreement (MIT License)
+#
+# Author: Duke Fong <d@d-l.io>
+#
+
+# Parsed configs of configs/*.json, shared by the cfgs service and plugins:
+#   parsed once per file version (mtime and size), with the msgpack payload pre-packed,
+#   and the register layout compiled by tools/cdg_helper.py
+
+import os, sys, struct
+import asyncio
+import ctypes, ctypes.util
+import logging
+import json5
+import umsgpack
+from cd_ws import Packed
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'tools'))
+from cdg_helper import reg_layout
+
+CFG_DIR = 'configs'
+CFG_POLL = 1.0      # polling period (sec) if inotify is not available
+CFG_SETTLE = 0.2    # wait for more events (sec), editors may write a file in several steps
+
+IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_DELETE = 0x8, 0x40, 0x80, 0x200
+
+cfg_cache = {}  # name: {'mtime', 'size', 'cfg', 'packed', 'layout', 'layout_packed'}
+logger = logging.getLogger(f'cdgui.cfg')
+
+
+def cfg_get(name):
+    # return cache entry of a config, reload if the file changed
+    name = os.path.basename(name)
+    path = os.path.join(CFG_DIR, name)
+    st = os.stat(path)
+    c = cfg_cache.get(name)
+    if c and c['mtime'] == st.st_mtime_ns and c['size'] == st.st_size:
+        return c
+    with open(path) as c_file:
+        cfg = json5.load(c_file)
+    layout = reg_layout(cfg['reg']) if 'reg' in cfg else None
+    c = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'cfg': cfg, 'packed': Packed(umsgpack.packb(cfg)),
+         'layout': layout, 'layout_packed': Packed(umsgpack.packb(layout))}
+    cfg_cache[name] = c
+    return c
+
+
+def load_cfg(name):
+    # parsed config, shared, don't modify
+    return cfg_get(name)['cfg']
+
+
+def cfg_list():
+    return sorted([n for n in os.listdir(CFG_DIR) if n.endswith('.json')])
+
+
+def _inotify_open():
+    # return inotify fd of CFG_DIR, None if not supported
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+        if libc.inotify_add_watch(fd, CFG_DIR.encode(), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError, TypeError):
+        return None
+
+
+def _inotify_names(fd):
+    names = set()
+    while True:
+        try:
+            buf = os.read(fd, 4096)
+        except BlockingIOError:
+            return names
+        ofs = 0
+        while ofs + 16 <= len(buf):
+            _, _, _, len_ = struct.unpack_from('iIII', buf, ofs)
+            names.add(buf[ofs+16:ofs+16+len_].rstrip(b'\x00').decode(errors='ignore'))
+            ofs += 16 + len_
+
+
+def _scan():
+    ret = {}
+    for e in os.scandir(CFG_DIR):
+        if e.name.endswith('.json'):
+            st = e.stat()
+            ret[e.name] = (st.st_mtime_ns, st.st_size)
+    return ret
+
+
+async def cfg_watch(cb):
+    # await cb(names) with created, modified or removed config names,
+    # the cache is updated before cb, so pages re-fetch a parsed config
+    loop = asyncio.get_running_loop()
+    fd = _inotify_open()
+    evt = asyncio.Event()
+    changed = set()
+
+    def on_read():
+        # drain the fd here, the reader is level-triggered
+        changed.update(_inotify_names(fd))
+        evt.set()
+
+    if fd != None:
+        loop.add_reader(fd, on_read)
+    logger.info(f'watch {CFG_DIR}: {"inotify" if fd != None else "polling"}')
+    files = _scan()
+    while True:
+        if fd != None:
+            await evt.wait()
+            await asyncio.sleep(CFG_SETTLE)
+            evt.clear()
+            names = set([n for n in changed if n.endswith('.json')])
+            changed.clear()
+            files = _scan()
+        else:
+            await asyncio.sleep(CFG_POLL)
+            cur = _scan()
+            names = set([n for n in set(files) | set(cur) if files.get(n) != cur.get(n)])
+            files = cur
+        if not names:
+            continue
+        for name in names:
+            if name not in files:
+                cfg_cache.pop(name, None)
+                continue
+            try:
+                cfg_get(name)
+            except Exception as err:
+                logger.warning(f'cfg {name}: {err}')
+        logger.info(f'cfg changed: {sorted(names)}')
+        await cb(sorted(names))
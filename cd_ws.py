@@ -13,9 +13,32 @@
 #
 # The addr and port format: any string (or number)
 # The dat format: dict for convention
+#
+# Coalesced packet format (opt-in per destination, see set_coalesce):
+#   {
+#       src: (addr, port), dst: (addr, port),
+#       dats: [dat, dat, ...]
+#   }
 
 import umsgpack
 import asyncio
+import collections
+from websockets.exceptions import ConnectionClosed
+
+WS_Q_MAX = 256      # max droppable messages queued per connection, drop the oldest when full
+WS_Q_KEEP_MAX = 1024 # max never-drop messages queued per connection, sendto waits when full
+
+
+class Packed(bytes):
+    # dat already packed by umsgpack.packb, e.g. cached large replies, sendto skips packing it again
+    pass
+
+
+def _packb(src, dst, dat):
+    if isinstance(dat, Packed): # same bytes as umsgpack.packb of the dict
+        return b'\x83' + umsgpack.packb('src') + umsgpack.packb(src) + umsgpack.packb('dst') + \
+               umsgpack.packb(dst) + umsgpack.packb('dat') + dat
+    return umsgpack.packb({'src': src, 'dst': dst, 'dat': dat})
 
 
 class CDWebSocket():
@@ -23,6 +46,7 @@ class CDWebSocket():
         self.ns = ns
         self.port = port
         self.recv_q = asyncio.Queue()
+        self.aggs = {}  # s_addr: {'window': sec, 'size': max dats, 'dats': [], 'task': flush task}
         assert self.port not in self.ns.sockets
         self.ns.sockets[self.port] = self
     
@@ -30,29 +54,158 @@ class CDWebSocket():
         #await self.recv_q.join()
         del self.ns.sockets[self.port]
     
-    async def sendto(self, dat, s_addr):
-        msg = umsgpack.packb({'src': (self.ns.addr, self.port), 'dst': s_addr, 'dat': dat})
+    def _route(self, s_addr):
         if s_addr[0] in self.ns.connections:
-            await self.ns.connections[s_addr[0]].send(msg)
-            return None
+            return self.ns.connections[s_addr[0]]
         elif self.ns.def_route and (self.ns.def_route in self.ns.connections):
-            await self.ns.connections[self.ns.def_route].send(msg)
-            return None
-        else:
+            return self.ns.connections[self.ns.def_route]
+        return None
+    
+    def set_coalesce(self, s_addr, window=0.02, size=256):
+        # pack all dats to s_addr within window (sec), or up to size dats, into one message
+        # window 0: disable
+        s_addr = tuple(s_addr)
+        agg = self.aggs.pop(s_addr, None)
+        if agg and agg['task']:
+            agg['task'].cancel()
+        if window:
+            self.aggs[s_addr] = {'window': window, 'size': max(size, 1), 'dats': [], 'task': None}
+    
+    def clr_coalesce(self, addr):
+        for s_addr in [a for a in self.aggs if a[0] == addr]:
+            self.set_coalesce(s_addr, 0)
+    
+    async def _flush(self, s_addr):
+        agg = self.aggs.get(s_addr)
+        if not agg or not agg['dats']:
+            return
+        if agg['task']:
+            agg['task'].cancel()
+            agg['task'] = None
+        dats, agg['dats'] = agg['dats'], []
+        conn = self._route(s_addr)
+        if conn:
+            await conn.send(umsgpack.packb({'src': (self.ns.addr, self.port), 'dst': s_addr, 'dats': dats}),
+                            self.ns.is_drop(s_addr))
+    
+    async def _flush_later(self, s_addr, window):
+        await asyncio.sleep(window)
+        self.aggs[s_addr]['task'] = None # avoid self cancel
+        try:
+            await self._flush(s_addr)
+        except Exception:
+            pass
+    
+    async def sendto(self, dat, s_addr):
+        # queue to the connection, only waits if never-drop messages pile up
+        conn = self._route(s_addr)
+        if not conn:
             return 'no route'
+        agg = self.aggs.get(tuple(s_addr))
+        if agg:
+            s_addr = tuple(s_addr)
+            agg['dats'].append(umsgpack.unpackb(dat) if isinstance(dat, Packed) else dat)
+            if len(agg['dats']) >= agg['size']:
+                await self._flush(s_addr)
+            elif not agg['task']:
+                agg['task'] = asyncio.create_task(self._flush_later(s_addr, agg['window']))
+            return None
+        msg = _packb((self.ns.addr, self.port), s_addr, dat)
+        await conn.send(msg, self.ns.is_drop(s_addr))
+        return None
     
     async def recvfrom(self, timeout=None):
         # throw asyncio.TimeoutError if timeout
         return await asyncio.wait_for(self.recv_q.get(), timeout=timeout)
 
 
+class CDWebSocketConn():
+    # outbound queue of a websocket connection, sent by its own writer task,
+    # so a slow page never blocks senders to other pages
+    # droppable messages (e.g. plot and log streams) keep the newest WS_Q_MAX, others are never dropped
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.q = collections.deque() # (msg, drop)
+        self.q_drop = 0     # droppable messages in q
+        self.drops = 0
+        self.sent = 0
+        self.closed = False
+        self.pend = asyncio.Event()
+        self.room = asyncio.Event()
+        self.task = asyncio.create_task(self._writer())
+
+    async def send(self, msg, drop=False):
+        if self.closed:
+            return
+        if drop:
+            if self.q_drop >= WS_Q_MAX:
+                for i, m in enumerate(self.q):
+                    if m[1]:
+                        del self.q[i]
+                        break
+                self.q_drop -= 1
+                self.drops += 1
+            self.q_drop += 1
+        else:
+            while len(self.q) - self.q_drop >= WS_Q_KEEP_MAX and not self.closed:
+                self.room.clear()
+                await self.room.wait()
+        self.q.append((msg, drop))
+        self.pend.set()
+
+    async def _writer(self):
+        try:
+            while True:
+                while not self.q:
+                    self.pend.clear()
+                    await self.pend.wait()
+                msg, drop = self.q.popleft()
+                if drop:
+                    self.q_drop -= 1
+                else:
+                    self.room.set()
+                await self.ws.send(msg)
+                self.sent += 1
+        except ConnectionClosed:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        self.closed = True
+        self.q.clear()
+        self.q_drop = 0
+        self.room.set()
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    def stat(self):
+        return {'depth': len(self.q), 'depth_drop': self.q_drop, 'drops': self.drops, 'sent': self.sent}
+
+
 class CDWebSocketNS():
     def __init__(self, addr, def_route=None):
         self.addr = addr
         self.def_route = def_route
-        self.connections = {} # id: ws
+        self.connections = {} # id: CDWebSocketConn
         self.sockets = {}     # port: CDWebSocket
+        self.drops = {}       # send policy of destinations, (addr, port): drop, addr None for any page
 
+    def set_drop(self, s_addr, drop=True):
+        # send policy of destination, drop-oldest if drop, else never drop
+        self.drops[tuple(s_addr)] = drop
 
-# cd_ws_def_ns = CDWebSocketNS('server')
+    def clr_drop(self, addr):
+        self.drops = {a: d for a, d in self.drops.items() if a[0] != addr}
 
+    def is_drop(self, s_addr):
+        # the policy of the page overrides the one for any page
+        return self.drops.get((s_addr[0], s_addr[1]), self.drops.get((None, s_addr[1]), False))
+
+    def stat(self):
+        # queue depth and drop counters of all connections
+        return {addr: conn.stat() for addr, conn in self.connections.items()}
+
+
+# cd_ws_def_ns = CDWebSocketNS('server')
@@ -30,5 +30,13 @@ async function alloc_port(port=null) {
     }
 }
 
-export { csa, alloc_port };
+// pack frames to port within window (ms) or up to size frames into one ws msg, window 0: disable
+async function set_coalesce(port, window=20, size=256) {
+    csa.cmd_sock.flush();
+    await csa.cmd_sock.sendto({'action': 'coalesce', 'port': port, 'window': window, 'size': size}, ['server', 'port']);
+    let ret = await csa.cmd_sock.recvfrom(1000);
+    console.log(`coalesce port ${port} ret: ${ret ? ret[0] : ret}`);
+}
+
+export { csa, alloc_port, set_coalesce };
 
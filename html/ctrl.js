@@ -18,6 +18,29 @@ import { init_iap } from './plugins/iap.js';
 import { init_export } from './plugins/export.js';
 
 
+async function watch_cfg() {
+    // server pushes {'cfgs': list, 'changed': [names]} after configs/ changed
+    let sock = new CDWebSocket(csa.ws_ns, 'cfgs');
+    await sock.sendto({'action': 'subscribe', 'port': 'cfgs'}, ['server', 'cfgs']);
+    await sock.recvfrom(2000);
+    while (true) {
+        let msg = await sock.recvfrom();
+        if (!msg || !msg[0].changed || !msg[0].changed.includes(csa.arg.cfg))
+            continue;
+        await sock.sendto({'action': 'get_cfg', 'cfg': csa.arg.cfg}, ['server', 'cfgs']);
+        let dat = await sock.recvfrom(2000);
+        while (dat && dat[0].changed) // skip later pushes
+            dat = await sock.recvfrom(2000);
+        if (!dat || JSON.stringify(dat[0]) == JSON.stringify(csa.cfg))
+            continue;
+        console.log('cfg changed', dat[0]);
+        document.getElementById('tgt_name').insertAdjacentHTML('beforeend',
+                ` <a href="javascript:location.reload()">(${L('Config changed, reload to apply')})</a>`);
+        break;
+    }
+}
+
+
 function init_ws() {
     let ws_url = `ws://${window.location.hostname}:${window.location.port}/${csa.arg.tgt}`;
     let ws = new WebSocket(ws_url);
@@ -43,17 +66,14 @@ function init_ws() {
         let port = await alloc_port();
         csa.proxy_sock_info = new CDWebSocket(csa.ws_ns, port);
         document.getElementById('dev_read_info').click();
+        watch_cfg();
     }
     ws.onmessage = async function(evt) {
         let dat = await blob2dat(evt.data);
         var msg = msgpack.deserialize(dat);
         //console.log("Received dat", msg);
-        if (msg['dst'][1] in csa.ws_ns.sockets) {
-            let sock = csa.ws_ns.sockets[msg['dst'][1]];
-            sock.recv_q.put([msg['dat'], msg['src']]);
-        } else {
+        if (!csa.ws_ns.dispatch(msg))
             console.log("ws drop msg:", msg);
-        }
     }
     ws.onerror = function(evt) {
         console.log("ws onerror: ", evt);
@@ -108,6 +108,34 @@ async function init_cfg_list() {
 }
 
 
+function update_cfg_list() {
+    let sel_ops = '<option value="">--</option>';
+    for (let op of cfgs)
+        sel_ops += `<option value="${op}">${op}</option>`;
+    for (let i = 0; i < dev_max; i++) {
+        let sel = document.getElementById(`cfg${i}.cfg`);
+        let val = sel.value;
+        sel.innerHTML = sel_ops;
+        sel.value = val;
+    }
+}
+
+async function watch_cfgs() {
+    // server pushes {'cfgs': list, 'changed': [names]} after configs/ changed
+    let sock = new CDWebSocket(csa.ws_ns, 'cfgs');
+    await sock.sendto({'action': 'subscribe', 'port': 'cfgs'}, ['server', 'cfgs']);
+    await sock.recvfrom(2000);
+    while (true) {
+        let msg = await sock.recvfrom();
+        if (!msg || !msg[0].cfgs)
+            continue;
+        console.log('cfgs changed:', msg[0].changed);
+        cfgs = msg[0].cfgs;
+        update_cfg_list();
+    }
+}
+
+
 function init_ws() {
     let ws_url = `ws://${window.location.hostname}:${window.location.port}`;
     let ws = new WebSocket(ws_url);
@@ -128,13 +156,14 @@ function init_ws() {
         await init_cfg_list();
         await init_serial_cfg();
         await document.getElementById('btn_dev_get').onclick();
+        watch_cfgs();
     }
     ws.onmessage = async function(evt) {
         let dat = await blob2dat(evt.data);
         var msg = msgpack.deserialize(dat);
         //console.log("Received dat", msg);
-        var sock = csa.ws_ns.sockets[msg['dst'][1]];
-        sock.recv_q.put([msg['dat'], msg['src']]);
+        if (!csa.ws_ns.dispatch(msg))
+            console.log("ws drop msg:", msg);
     }
     ws.onerror = function(evt) {
         console.log("ws onerror: ", evt);
@@ -24,6 +24,14 @@ let html = `
             <button class="button is-small" id="dbg_search_prev">${L('Prev')}</button>
             <button class="button is-small" id="dbg_search_next">${L('Next')}</button>
         </div>
+        <div class="is-inline-flex" style="align-items: center; gap: 0.3rem; margin: 5px 0;">
+            <span>${L('History')}:</span>
+            <input type="datetime-local" step="1" id="dbg_his_t0"> -
+            <input type="datetime-local" step="1" id="dbg_his_t1">
+            <input type="text" size="32" placeholder="regex" id="dbg_his_re">
+            <button class="button is-small" id="dbg_his_query">${L('Query')}</button>
+            <button class="button is-small" id="dbg_his_stop" disabled>${L('Stop')}</button>
+        </div>
         <div id="dbg_log" class="resizable"></div>
     </div>
     <br>`;
@@ -47,6 +55,49 @@ function update_max_len() {
     }
 }
 
+function his_time(t) {
+    let date = new Date(t * 1000);
+    return date.toLocaleString('en-GB') + '.' + String(date.getMilliseconds()).padStart(3, '0');
+}
+
+async function his_query() {
+    // search the server log store, lines are streamed to his_sock
+    let t0 = document.getElementById('dbg_his_t0').value;
+    let t1 = document.getElementById('dbg_his_t1').value;
+    let re = document.getElementById('dbg_his_re').value;
+    let qid = ++csa.dbg.his_id;
+    csa.dbg.his_sock.flush();
+    csa.cmd_sock.flush();
+    await csa.cmd_sock.sendto({'action': 'query', 'id': qid, 'port': csa.dbg.his_sock.port,
+                               'devs': csa.arg && csa.arg.tgt ? [csa.arg.tgt] : null,
+                               't0': t0 ? new Date(t0).getTime() / 1000 : null,
+                               't1': t1 ? new Date(t1).getTime() / 1000 : null, 're': re}, ['server', 'log']);
+    let ret = await csa.cmd_sock.recvfrom(2000);
+    if (!ret || ret[0] != 'successed') {
+        alert(ret ? ret[0] : 'log query timeout');
+        return;
+    }
+    document.getElementById('dbg_his_query').disabled = true;
+    document.getElementById('dbg_his_stop').disabled = false;
+    write_log(`\n--- history: ${t0 || '*'} - ${t1 || '*'}, regex: ${re} ---\n`);
+    let cnt = 0;
+    while (true) {
+        let msg = await csa.dbg.his_sock.recvfrom();
+        if (msg[0].id != qid)
+            continue;
+        for (let l of msg[0].lines) {
+            let dev = csa.arg && csa.arg.tgt ? '' : ` [${l[1]}]`;
+            write_log(`${his_time(l[0])}${dev}: ${l[3]}\n`);
+        }
+        cnt += msg[0].lines.length;
+        if (msg[0].done)
+            break;
+    }
+    write_log(`--- history: ${cnt} lines ---\n`);
+    document.getElementById('dbg_his_query').disabled = false;
+    document.getElementById('dbg_his_stop').disabled = true;
+}
+
 async function dbg_service() {
     term = new Terminal({
         convertEol: true, // using '\n' instead of '\r\n'
@@ -108,6 +159,11 @@ async function dbg_service() {
         search_addon.findNext(val, {caseSensitive: true});
     };
     
+    document.getElementById('dbg_his_query').onclick = his_query;
+    document.getElementById('dbg_his_stop').onclick = async () => {
+        await csa.cmd_sock.sendto({'action': 'stop', 'id': csa.dbg.his_id}, ['server', 'log']);
+    };
+    
     while (true) {
         let dat = await csa.dbg.sock.recvfrom();
         console.log('dbg get:', dat2str(dat[0].dat));
@@ -124,6 +180,8 @@ async function init_dbg() {
     let port = await alloc_port(9);
     console.log(`init_dbg, alloc port: ${port}`);
     csa.dbg.sock = new CDWebSocket(csa.ws_ns, port);
+    csa.dbg.his_sock = new CDWebSocket(csa.ws_ns, 'log');
+    csa.dbg.his_id = 0;
     
     document.head.insertAdjacentHTML('beforeend', '<link rel="stylesheet" href="./libs/xterm-5.6.0-beta.129.css">');
     document.getElementsByTagName('section')[0].insertAdjacentHTML('beforeend', html);
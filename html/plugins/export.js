@@ -21,7 +21,7 @@ let html = `
     <br>`;
 
 
-function export_data() {
+async function export_data() {
     let exp_dat = {
         version: 'cdgui v1'
     };
@@ -29,7 +29,7 @@ function export_data() {
     for (let p of csa.plugins) {
         console.log(`export: p: ${p}`);
         if ('dat_export' in csa[p]) {
-            exp_dat[p] = csa[p].dat_export();
+            exp_dat[p] = await csa[p].dat_export();
         }
     }
     
@@ -5,8 +5,6 @@
  */
 
 import { L } from '../utils/lang.js'
-import { sleep, escape_html, date2num, val2hex, dat2str, dat2hex, hex2dat, read_file, download,
-         readable_size, blob2dat, compare_dat, dat_append, crc16 } from '../utils/helper.js';
 import { CDWebSocket } from '../utils/cd_ws.js';
 import { Idb } from '../utils/idb.js';
 import { csa, alloc_port } from '../common.js';
@@ -16,7 +14,7 @@ let html = `
     <div class="container">
         <h2 class="title is-size-4">IAP</h2>
         <div class="is-inline-flex" style="align-items: center; gap: 0.3rem; margin: 5px 0;">
-            <input type="text" size="80" placeholder="Full path of intel hex file on system" id="iap_path">
+            <input type="text" size="80" placeholder="Full path of .hex or .elf file on system, or .bin file with address: fw.bin@0x0800c000" id="iap_path">
             <select id="iap_action" value="bl_full">
                 <option value="bl_full">${L('Reboot')} -> BL -> ${L('Flash')} -> ${L('Reboot')}</option>
                 <option value="bl_flash">${L('Reboot')} -> BL -> ${L('Flash')}</option>
@@ -37,173 +35,19 @@ let html = `
     <br>`;
 
 
-async function flash_erase(addr, len) {
-    let d = new Uint8Array(9);
-    let dv = new DataView(d.buffer);
-    d[0] = 0x2f;
-    dv.setUint32(1, addr, true);
-    dv.setUint32(5, len, true);
-    
-    csa.iap.proxy_sock.flush();
-    await csa.iap.proxy_sock.sendto({'dst': [csa.arg.tgt, 0x8], 'dat': d}, ['server', 'proxy']);
-    console.log(`flash_erase wait ret, addr: ${val2hex(addr)}, len: ${(val2hex(len))}`);
-    let ret = await csa.iap.proxy_sock.recvfrom(60000);
-    console.log('flash_erase ret', ret);
-    if (ret && ret[0].dat.length == 1 && (ret[0].dat[0] & 0xf) == 0) {
-        return 0
-    } else {
-        console.log('flash_erase err');
-        return -1;
-    }
-}
+// the flashing runs on the server (plugins/iap.py), the page only sends start / stop,
+// and receives progress at its proxy port: {'epoch', 'progress', 'state': 'run' | 'ok' | 'err' | 'stop'}
 
-async function flash_write_blk(addr, dat, not_reply) {
-    let d = new Uint8Array(5 + dat.length);
-    let dv = new DataView(d.buffer);
-    d[0] = not_reply ? 0xa0 : 0x20;
-    dv.setUint32(1, addr, true);
-    d.set(dat, 5);
-    await csa.iap.proxy_sock.sendto({'dst': [csa.arg.tgt, 0x8], 'dat': d}, ['server', 'proxy']);
-}
-
-async function flash_write(addr, dat, blk_size=128, group_size=0) {
-    let cur = addr;
-    let iap_progress_elm = document.getElementById('iap_progress');
-    let pend_ret_max = group_size ? 2 : 1;
-    let pend_ret = 0;
-    group_size = Math.max(group_size, 1);
-    csa.iap.proxy_sock.flush();
-    
-    while (!csa.iap.stop) {
-        let has_more = cur - addr < dat.length;
-        if (pend_ret < pend_ret_max && has_more) {
-            for (let i = 0; i < group_size; i++) {
-                if (cur - addr >= dat.length)
-                    break;
-                let not_reply = i + 1 < group_size && cur - addr + blk_size < dat.length;
-                let size = Math.min(blk_size, dat.length - (cur - addr));
-                let wdat = dat.slice(cur-addr, cur-addr+size);
-                console.log(`flash_write_blk i: ${i}, reply: ${!not_reply}, pend: ${pend_ret}, cur: ${val2hex(cur)}, size: ${size}`);
-                await flash_write_blk(cur, wdat, not_reply);
-                cur += size;
-                iap_progress_elm.innerText = `Write ${Math.round((cur - addr) / dat.length * 100)}%`;
-            }
-            pend_ret++;
-        } else if (pend_ret) {
-            let ret = await csa.iap.proxy_sock.recvfrom(1000);
-            if (ret && ret[0].dat.length == 1 && (ret[0].dat[0] & 0xf) == 0) {
-                pend_ret--;
-                console.log(`flash_write_blk ret ok, pend: ${pend_ret}`, ret);
-            } else {
-                console.log(`flash_write_blk ret err, pend: ${pend_ret}`, ret);
-                return -1;
-            }
-        } else {
-            console.log("flash_write completed");
-            return 0;
-        }
-    }
-    return -2;
-}
-
-async function flash_read_blk(addr, len) {
-    let d = new Uint8Array(6);
-    let dv = new DataView(d.buffer);
-    d[0] = 0x00;
-    dv.setUint32(1, addr, true);
-    d[5] = len;
-    
-    csa.iap.proxy_sock.flush();
-    await csa.iap.proxy_sock.sendto({'dst': [csa.arg.tgt, 0x8], 'dat': d}, ['server', 'proxy']);
-    console.log(`flash_read_blk wait ret, addr: ${val2hex(addr)}, len: ${len}`);
-    let ret = await csa.iap.proxy_sock.recvfrom(1000);
-    console.log('flash_read_blk ret', ret);
-    if (ret && (ret[0].dat[0] & 0xf) == 0 && ret[0].dat.length == len + 1) {
-        return ret[0].dat.slice(1);
-    } else {
-        console.log('flash_read_blk err');
-        return null;
-    }
-}
-
-async function flash_read(addr, len, blk_size=128) {
-    let cur = addr;
-    let buf = new Uint8Array(0);
-    let iap_progress_elm = document.getElementById('iap_progress');
-    while (!csa.iap.stop) {
-        let size = Math.min(blk_size, len - (cur - addr));
-        if (size == 0)
-            return buf;
-        let ret = await flash_read_blk(cur, size);
-        if (ret == null)
-            return null;
-        buf = dat_append(buf, ret);
-        cur += size;
-        iap_progress_elm.innerText = `Read ${Math.round((cur - addr) / len * 100)}%`;
-    }
-    return null;
-}
-
-async function flash_read_crc(addr, len) {
-    let d = new Uint8Array(9);
-    let dv = new DataView(d.buffer);
-    d[0] = 0x10;
-    dv.setUint32(1, addr, true);
-    dv.setUint32(5, len, true);
-    
-    csa.iap.proxy_sock.flush();
-    await csa.iap.proxy_sock.sendto({'dst': [csa.arg.tgt, 0x8], 'dat': d}, ['server', 'proxy']);
-    console.log(`flash_read_crc ret, addr: ${val2hex(addr)}, len: ${val2hex(len)}`);
-    let ret = await csa.iap.proxy_sock.recvfrom(3000);
-    console.log('flash_read_crc', ret);
-    if (ret && (ret[0].dat[0] & 0xf) == 0) {
-        let ret_dv = new DataView(ret[0].dat.slice(1).buffer);
-        return ret_dv.getUint16(0, true);
-    } else {
-        console.log('flash_read_crc err');
-        return null;
-    }
-}
-
-async function keep_in_bl() {
-    if (!('keep_bl' in csa.cfg.iap)) {
-        console.log('keep_in_bl skip');
-        return 0;
-    }
-    let d = new Uint8Array([0x20, 0, 0, 1]);
-    let dv = new DataView(d.buffer);
-    dv.setUint16(1, csa.cfg.iap.keep_bl, true);
-    
-    csa.iap.proxy_sock.flush();
-    await csa.iap.proxy_sock.sendto({'dst': [csa.arg.tgt, 0x5], 'dat': d}, ['server', 'proxy']);
-    console.log('keep_in_bl wait ret');
-    let ret = await csa.iap.proxy_sock.recvfrom(200);
-    console.log('keep_in_bl ret', ret);
-    if (ret && ret[0].dat.length == 1 && (ret[0].dat[0] & 0xf) == 0) {
-        console.log('keep_in_bl succeeded');
-        return 0;
-    } else {
-        console.log('keep_in_bl err');
-        return -1;
-    }
-}
-
-async function do_reboot(bl_args) {
-    let d = new Uint8Array([0x20, 0, 0, bl_args]);
-    let dv = new DataView(d.buffer);
-    dv.setUint16(1, csa.cfg.iap.reboot, true);
-    
-    csa.iap.proxy_sock.flush();
-    await csa.iap.proxy_sock.sendto({'dst': [csa.arg.tgt, 0x5], 'dat': d}, ['server', 'proxy']);
-    console.log('reboot wait ret');
-    let ret = await csa.iap.proxy_sock.recvfrom(200);
-    console.log('reboot ret', ret);
+function iap_idle() {
+    document.getElementById('iap_start').disabled = false;
+    document.getElementById('iap_stop').disabled = csa.iap.stop = true;
 }
 
-
 async function stop_iap() {
-    document.getElementById('iap_start').disabled = false;
-    document.getElementById('iap_stop').disabled = csa.iap.stop = true;
+    document.getElementById('iap_stop').disabled = true;
+    csa.cmd_sock.flush();
+    await csa.cmd_sock.sendto({'action': 'stop'}, ['server', 'iap']);
+    await csa.cmd_sock.recvfrom(1000);
 }
 
 async function do_iap() {
@@ -211,13 +55,6 @@ async function do_iap() {
     document.getElementById('iap_stop').disabled = csa.iap.stop = false;
     document.getElementById('iap_epoch').innerText = '';
     document.getElementById('iap_progress').innerText = '--';
-    let blk_size = 128;
-    let batch_pkts = 0;
-    if (csa.cfg.iap.batch_pkts)
-        batch_pkts = csa.cfg.iap.batch_pkts;
-    if (csa.cfg.iap.blk_size)
-        blk_size = csa.cfg.iap.blk_size;
-    console.log(`iap: blk_size: ${blk_size}, batch_pkts: ${batch_pkts}`);
     
     let path = document.getElementById('iap_path').value;
     let check = document.getElementById('iap_check').value;
@@ -225,145 +62,31 @@ async function do_iap() {
     
     if (!path && action != 'bl') {
         alert('path empty');
-        stop_iap();
+        iap_idle();
         return;
     }
     
-    let msg = null;
-    if (action != "bl") {
-        csa.cmd_sock.flush();
-        await csa.cmd_sock.sendto({'action': 'get_ihex', 'path': path}, ['server', 'iap']);
-        msg = await csa.cmd_sock.recvfrom(20000);
-        if (!msg || !msg[0].length) {
-            alert('invalid ihex file');
-            stop_iap();
-            return;
-        }
-        console.log(`get_ihex:`, msg[0]);
-    }
-    
-    let retry_cnt = 0;
-    let reboot_cnt = 0;
-    while (action.startsWith('bl') && !csa.iap.stop) {
-    
-        csa.iap.proxy_sock.flush();
-        await csa.iap.proxy_sock.sendto({'dst': [csa.arg.tgt, 0x1], 'dat': new Uint8Array([])}, ['server', 'proxy']);
-        console.log('read info wait ret');
-        let ret = await csa.iap.proxy_sock.recvfrom(100);
-        console.log('read info ret', ret);
-        if (ret && ret[0].src[1] == 0x0001) {
-            let s = dat2str(ret[0].dat);
-            if (s.includes('(bl)')) {
-                console.log(`found (bl): ${s}`);
-                if (await keep_in_bl()) {
-                    document.getElementById('iap_progress').innerText = `keep_in_bl failed`;
-                } else {
-                    document.getElementById('iap_progress').innerText = `keep_in_bl succeeded`;
-                    break;
-                }
-            } else {
-                console.log('not found (bl), reboot');
-                document.getElementById('iap_progress').innerText = `Not found string "(bl)", reboot...`;
-                await do_reboot(1);
-                reboot_cnt++;
-            }
-        } else {
-            let retry_str;
-            switch (retry_cnt) {
-            case 0: retry_str = '-'; break;
-            case 1: retry_str = '\\'; break;
-            case 2: retry_str = '|'; break;
-            case 3: retry_str = '/'; break;
-            }
-            console.log('read info time out');
-            document.getElementById('iap_progress').innerHTML =
-                `Try read info <span style="font-family: monospace;">(${retry_str})</span> | try reboot: ${reboot_cnt}`;
-        }
-        if (++retry_cnt >= 4)
-            retry_cnt = 0;
-    }
-    
-    if (action == "flash" && !csa.iap.stop) {
-        if (await keep_in_bl()) {
-            document.getElementById('iap_progress').innerText = `keep_in_bl failed`;
-            stop_iap();
-            return;
-        } else {
-            console.log(`keep_in_bl succeeded`);
-            document.getElementById('iap_progress').innerText = `keep_in_bl succeeded`;
-        }
-    }
-    
-    for (let idx = 0; action != "bl" && idx < msg[0].length; idx++) {
-        if (csa.iap.stop)
-            break;
-        let seg = msg[0][idx];
-        let addr = seg[0];
-        let dat = seg[1];
-        let len = dat.length;
-        document.getElementById('iap_epoch').innerText = `[${idx+1}/${msg[0].length}]`;
-        
-        document.getElementById('iap_progress').innerText = `Erasing...`;
-        if (await flash_erase(addr, len)) {
-            document.getElementById('iap_progress').innerText = `Erase failed`;
-            stop_iap();
-            return;
-        }
+    csa.iap.proxy_sock.flush();
+    csa.cmd_sock.flush();
+    await csa.cmd_sock.sendto({'action': 'start', 'port': csa.iap.proxy_sock.port, 'path': path,
+                               'mode': action, 'check': check, 'iap': csa.cfg.iap}, ['server', 'iap']);
+    let ret = await csa.cmd_sock.recvfrom(20000);
+    if (!ret || ret[0] != 'successed') {
+        alert(ret ? ret[0] : 'iap start timeout');
+        iap_idle();
+        return;
     }
     
-    for (let idx = 0; action != "bl" && idx < msg[0].length; idx++) {
-        if (csa.iap.stop)
+    while (true) {
+        let msg = await csa.iap.proxy_sock.recvfrom();
+        if (!msg || !msg[0].state)
+            continue;
+        document.getElementById('iap_epoch').innerText = msg[0].epoch;
+        document.getElementById('iap_progress').innerText = msg[0].progress;
+        if (msg[0].state != 'run')
             break;
-        let seg = msg[0][idx];
-        let addr = seg[0];
-        let dat = seg[1];
-        let len = dat.length;
-        let crc_ori = crc16(dat);
-        document.getElementById('iap_epoch').innerText = `[${idx+1}/${msg[0].length}]`;
-        
-        if (await flash_write(addr, dat, blk_size, batch_pkts)) {
-            document.getElementById('iap_progress').innerText = `Write failed`;
-            stop_iap();
-            return;
-        }
-        
-        if (check == "crc") {
-            let crc_back = await flash_read_crc(addr, len);
-            if (crc_back == null) {
-                document.getElementById('iap_progress').innerText = 'Read crc failed.';
-                stop_iap();
-                return;
-            } else if (crc_back != crc_ori) {
-                document.getElementById('iap_progress').innerText = `CRC err: ${val2hex(crc_back, 2)} != ${val2hex(crc_ori, 2)}`;
-                stop_iap();
-                return;
-            }
-            document.getElementById('iap_progress').innerText = 'Succeeded with crc check.';
-        
-        } else if (check == "read") {
-            let buf = await flash_read(addr, len, blk_size);
-            if (!buf) {
-                document.getElementById('iap_progress').innerText = 'Read back failed.';
-                stop_iap();
-                return;
-            }
-            let cmp_ret = compare_dat(dat, buf);
-            if (cmp_ret !== null) {
-                document.getElementById('iap_progress').innerText =
-                    `Compare err at: ${cmp_ret} (w: ${val2hex(dat[cmp_ret], 1)}, r: ${val2hex(buf[cmp_ret], 1)})`;
-                stop_iap();
-                return;
-            }
-            document.getElementById('iap_progress').innerText = 'Succeeded with read back check.';
-        } else {
-            document.getElementById('iap_progress').innerText = 'Succeeded without check.';
-        }
     }
-    
-    if (action == 'bl_full' && !csa.iap.stop)
-        await do_reboot(2);
-    
-    stop_iap();
+    iap_idle();
 };
 
 async function init_iap() {
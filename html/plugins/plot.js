@@ -8,10 +8,11 @@ import { L } from '../utils/lang.js'
 import { escape_html, date2num, val2hex, dat2str, dat2hex, hex2dat, readable_float,
          read_file, download, readable_size, blob2dat, compare_dat } from '../utils/helper.js';
 import { CDWebSocket } from '../utils/cd_ws.js';
-import { csa, alloc_port } from '../common.js';
+import { csa, alloc_port, set_coalesce } from '../common.js';
 import { wheelZoomPlugin, touchZoomPlugin } from './plot_zoom.js';
 import { plot_fft_init, plot_fft_deinit, plot_fft_cal } from './plot_fft.js';
 import { plot_reg_w_init, plot_reg_w } from './plot_reg_w.js';
+import { plot_rec_init, plot_rec_scale } from './plot_rec.js';
 import { reg_idx_by_name } from './reg.js';
 import { fmt_size, reg2str, read_reg_val, str2reg, write_reg_val,
          R_ADDR, R_LEN, R_FMT, R_SHOW, R_ID, R_DESC } from './reg_rw.js';
@@ -22,6 +23,8 @@ let color_dft = [ "black", "red", "green", "blue", "cyan", "magenta", "gold",
 
 
 async function plot_update(idx) {
+    if (csa.plot.cap[idx]) // reviewing a capture, live data keeps in csa.plot.dat
+        return;
     let max_len = csa.plot.plot_max_len[idx];
     let cur_len = csa.plot.dat[idx][0].length;
     let plot_dat = csa.plot.dat[idx];
@@ -40,19 +43,20 @@ async function plot_update(idx) {
         }
     }
     if (csa.plot.plot_fft_en[idx])
-        plot_dat = await plot_fft_cal(idx, plot_dat);
+        plot_dat = await plot_fft_cal(idx, plot_dat, csa.plot.srv_fft[idx]);
     csa.plot.plots[idx].setData(plot_dat);
 }
 
-function append_cal_val(idx, start) {
+function append_cal_val(idx, start, _d=null) {
     let fcals = csa.plot.cal_fn[idx];
     if (!Array.isArray(fcals))
         return;
-    let _d = csa.plot.dat[idx];
+    if (!_d)
+        _d = csa.plot.dat[idx];
     for (let i = 0; i < fcals.length; i++) {
         const cal_fn = fcals[i];
         let val = cal_fn(_d);
-        csa.plot.dat[idx][start+i].push(isNaN(val) ? null : val);
+        _d[start+i].push(isNaN(val) ? null : val);
     }
 }
 
@@ -108,11 +112,107 @@ function dv_fmt_read(dv, ofs, fmt) {
     return ret;
 }
 
+// server decoded columns: { idx, types: 'dff..', cols: [bytes, ...], cal: cal channel number }
+// d: append to, default: csa.plot.dat[idx], with_cal: calculate cal channels locally if server doesn't
+function push_cols(m, d=null, with_cal=true) {
+    let idx = m.idx;
+    let cols = [];
+    for (let i = 0; i < m.cols.length; i++) {
+        let c = m.cols[i].slice(); // aligned copy
+        cols.push(m.types[i] == 'f' ? new Float32Array(c.buffer) : new Float64Array(c.buffer));
+    }
+    if (!d)
+        d = csa.plot.dat[idx];
+    let fcals = csa.plot.cal_fn[idx];
+    let srv_cal = m.cal && Array.isArray(fcals) && m.cal == fcals.length;
+    let d_num = cols.length - (m.cal ? m.cal : 0);
+    for (let n = 0; n < cols[0].length; n++) {
+        for (let i = 0; i < d_num; i++)
+            d[i].push(cols[i][n]);
+        if (srv_cal) {
+            for (let i = d_num; i < cols.length; i++)
+                d[i].push(isNaN(cols[i][n]) ? null : cols[i][n]);
+        } else if (with_cal) {
+            append_cal_val(idx, d_num, d);
+        }
+    }
+    return idx;
+}
+
+
+// csa.plot.dat is min/max decimated if live rate is set, get full resolution data kept by server instead,
+// points older than the server history stay decimated, return csa.plot.dat[idx] if not available
+async function plot_raw_dat(idx, with_cal=true) {
+    let dat = csa.plot.dat[idx];
+    if (!csa.plot.lossy[idx] || !dat[0].length)
+        return dat;
+    csa.plot.proxy_sock.flush();
+    await csa.plot.proxy_sock.sendto({'action': 'get_raw', 'idx': idx, 'x0': dat[0][0], 'cal': with_cal},
+                                     ['server', 'plot']);
+    let ret = await csa.plot.proxy_sock.recvfrom(5000);
+    if (!ret || !ret[0] || !ret[0].cols) {
+        console.warn(`plot${idx} get_raw ret`, ret);
+        return dat;
+    }
+    let x0 = new Float64Array(ret[0].cols[0].slice(0, 8).buffer)[0];
+    let keep = dat[0].findIndex(x => x >= x0);
+    if (keep < 0)
+        keep = dat[0].length;
+    let d = dat.map(c => c.slice(0, keep));
+    push_cols(ret[0], d, with_cal);
+    console.log(`plot${idx} get_raw: ${d[0].length - keep} samples, keep ${keep} decimated`);
+    return d;
+}
+
+
+// calculate all cal channels by server at once, return false if not vectorizable
+async function plot_srv_cal(idx, f_num) {
+    if (!csa.plot.srv_dec)
+        return false;
+    let dat = csa.plot.dat[idx];
+    let cols = [];
+    for (let n = 0; n < f_num; n++)
+        cols.push(new Uint8Array(Float64Array.from(dat[n], v => v === null ? NaN : v).buffer));
+    csa.plot.proxy_sock.flush();
+    await csa.plot.proxy_sock.sendto({'action': 'cal', 'idx': idx, 'cols': cols}, ['server', 'plot']);
+    let ret = await csa.plot.proxy_sock.recvfrom(5000);
+    if (!ret || !ret[0] || !ret[0].cols || ret[0].cols.length != dat.length - f_num)
+        return false;
+    for (let i = 0; i < ret[0].cols.length; i++) {
+        let c = new Float64Array(ret[0].cols[i].slice().buffer);
+        dat[f_num + i] = Array.from(c, v => isNaN(v) ? null : v);
+    }
+    return true;
+}
+
 async function dbg_raw_service() {
     let timer_pending = false;
     
     while (true) {
         let msg = await csa.plot.dbg_raw_sock.recvfrom();
+        if (msg[0].fft) {
+            let idx = msg[0].idx;
+            csa.plot.srv_fft[idx] = msg[0].fft.map(m => new Float32Array(m.slice().buffer));
+            if (!timer_pending) {
+                timer_pending = true;
+                setTimeout(async () => {
+                    await plot_update(idx);
+                    timer_pending = false;
+                }, 100);
+            }
+            continue;
+        }
+        if (msg[0].cols) {
+            let idx = push_cols(msg[0]);
+            if (!timer_pending) {
+                timer_pending = true;
+                setTimeout(async () => {
+                    await plot_update(idx);
+                    timer_pending = false;
+                }, 100);
+            }
+            continue;
+        }
         let dat = msg[0].dat;
         let src_port = msg[0].src[1];
         let dv = new DataView(dat.buffer, dat.byteOffset, dat.byteLength);
@@ -237,6 +337,9 @@ function make_chart(idx, name, series) {
         hooks: {
             setSeries: [
                 async (u, seriesIdx, show) => { await plot_update(idx); }
+            ],
+            setScale: [
+                async (u, key) => { if (key == 'x') await plot_rec_scale(idx); }
             ]
         }
     };
@@ -281,6 +384,34 @@ async function plot_set_en() {
 }
 
 
+// let server decode dbg_raw frames, fallback to local decode if no reply
+async function plot_srv_decode() {
+    csa.plot.proxy_sock.flush();
+    await csa.plot.proxy_sock.sendto({'action': 'decode', 'cfg': csa.arg.cfg,
+                                      'port': csa.plot.dbg_raw_sock.port}, ['server', 'plot']);
+    let ret = await csa.plot.proxy_sock.recvfrom(1000);
+    console.log('plot_srv_decode ret', ret);
+    return Boolean(ret && Array.isArray(ret[0]));
+}
+
+
+// streaming fft by server, spectra pushed to dbg_raw port
+async function plot_srv_fft(idx) {
+    csa.plot.srv_fft[idx] = null;
+    if (!csa.plot.srv_dec)
+        return;
+    let fft = csa.cfg.plot.plots[idx].fft;
+    let dat = csa.plot.plot_fft_en[idx] ?
+            {'action': 'start', 'idx': idx, 'size': csa.plot.plot_fft[idx].size,
+             'avg': fft && fft.avg ? fft.avg : 1, 'port': csa.plot.dbg_raw_sock.port} :
+            {'action': 'stop', 'idx': idx};
+    csa.plot.proxy_sock.flush();
+    await csa.plot.proxy_sock.sendto(dat, ['server', 'fft']);
+    let ret = await csa.plot.proxy_sock.recvfrom(1000);
+    console.log(`plot${idx} srv fft ret`, ret);
+}
+
+
 function is_float(n) {
     return typeof n === 'number' && !Number.isInteger(n);
 }
@@ -334,15 +465,24 @@ async function plot_cal_update(idx) {
     }
     plot_fft_deinit(idx);
     await plot_fft_init(idx);
+    await plot_srv_fft(idx);
     
-    let dat_bk = csa.plot.dat[idx];
+    let dat_bk = await plot_raw_dat(idx, false);
+    if (dat_bk !== csa.plot.dat[idx])
+        csa.plot.lossy[idx] = csa.plot.pps[idx] > 0;
     let series = plot_init_series(idx);
     let f_fmt = csa.plot.fmt[idx];
     let f_num = f_fmt.split('.')[1].length + 1;
-    for (let i = 0; i < dat_bk[0].length; i++) {
+    for (let n = 0; n < f_num; n++)
+        csa.plot.dat[idx][n] = dat_bk[n];
+    if (!await plot_srv_cal(idx, f_num)) {
         for (let n = 0; n < f_num; n++)
-            csa.plot.dat[idx][n].push(dat_bk[n][i]);
-        append_cal_val(idx, f_num);
+            csa.plot.dat[idx][n] = [];
+        for (let i = 0; i < dat_bk[0].length; i++) {
+            for (let n = 0; n < f_num; n++)
+                csa.plot.dat[idx][n].push(dat_bk[n][i]);
+            append_cal_val(idx, f_num);
+        }
     }
     let cal_keys = csa.cfg.plot.plots[idx].cal;
     cal_keys = cal_keys ? Object.keys(cal_keys) : [];
@@ -367,6 +507,7 @@ async function init_plot() {
     let port = await alloc_port(0x0a);
     console.log(`init_plot, alloc dbg_raw port: ${port}`);
     csa.plot.dbg_raw_sock = new CDWebSocket(csa.ws_ns, port);
+    await set_coalesce(port);
     
     port = await alloc_port();
     console.log(`init_plot, alloc plot port: ${port}`);
@@ -391,7 +532,11 @@ async function init_plot() {
     csa.plot.plot_less_en = [];
     csa.plot.plot_fft_en = [];
     csa.plot.plot_fft = [];
+    csa.plot.srv_fft = [];
     csa.plot.x_ofs = [];
+    csa.plot.pps = [];
+    csa.plot.lossy = [];   // dat is min/max decimated
+    csa.plot.cap = [];     // capture in review
     csa.plot.fmt = [];
     csa.plot.label = [];
     csa.plot.reg_val = [];
@@ -402,7 +547,10 @@ async function init_plot() {
         csa.plot.plot_less_en.push(true);
         csa.plot.plot_fft_en.push(false);
         csa.plot.plot_fft.push({});
+        csa.plot.srv_fft.push(null);
         csa.plot.x_ofs.push(0);
+        csa.plot.pps.push(0);
+        csa.plot.lossy.push(false);
         csa.plot.fmt.push('');
         csa.plot.label.push([]);
         csa.plot.reg_val.push(null);
@@ -415,7 +563,11 @@ async function init_plot() {
                 | ${L('Depth')}: <input type="text" size="8" placeholder="${max_len}" id="plot${i}_len" value="${max_len}">
                 ${L('Realtime')} <input type="checkbox" id="plot${i}_less" checked>:
                 <input type="text" size="6" placeholder="${less_len}" id="plot${i}_less_len" value="${less_len}">
+                ${L('Live Rate')} <input type="text" size="6" placeholder="0" id="plot${i}_pps" value="0"
+                                         title="points/s, min/max decimated by server, 0: full rate">
                 FFT <input type="checkbox" id="plot${i}_fft">
+                ${L('Record')} <input type="checkbox" id="plot${i}_rec">
+                <select id="plot${i}_cap"><option value="">${L('Live')}</option></select>
                 <button class="button is-small" id="plot${i}_clear">${L('Clear')}</button>
                 <button class="button is-small" id="plot${i}_re_cal">${L('Re-Calc')}</button>
                 <button class="button is-small" id="plot${i}_w_reg">${L('Config Regs')}</button>
@@ -428,6 +580,7 @@ async function init_plot() {
         let series = plot_init_series(i);
         let u = make_chart(i, `Plot${i}`, series);
         csa.plot.plots.push(u);
+        await plot_rec_init(i);
         
         const observer = new ResizeObserver(() => {
             let elm = document.getElementById(`plot${i}`);
@@ -451,8 +604,25 @@ async function init_plot() {
             csa.plot.plot_less_en[i] = document.getElementById(`plot${i}_less`).checked;
             await plot_update(i);
         };
+        document.getElementById(`plot${i}_pps`).onchange = async () => {
+            let pps = Number(document.getElementById(`plot${i}_pps`).value);
+            if (!csa.plot.srv_dec) {
+                console.warn('live rate needs server decode');
+                return;
+            }
+            csa.plot.proxy_sock.flush();
+            await csa.plot.proxy_sock.sendto({'action': 'rate', 'idx': i, 'pps': pps}, ['server', 'plot']);
+            let ret = await csa.plot.proxy_sock.recvfrom(1000);
+            console.log(`plot${i} rate ret`, ret);
+            if (ret && ret[0] == 'successed') {
+                csa.plot.pps[i] = pps;
+                if (pps > 0)
+                    csa.plot.lossy[i] = true;
+            }
+        };
         document.getElementById(`plot${i}_fft`).onchange = async () => {
             csa.plot.plot_fft_en[i] = document.getElementById(`plot${i}_fft`).checked;
+            await plot_srv_fft(i);
             await plot_update(i);
         };
         document.getElementById(`plot${i}_clear`).onclick = async () => {
@@ -460,6 +630,9 @@ async function init_plot() {
                 csa.plot.dat[i][s] = [];
             csa.plot.plots[i].setData(csa.plot.dat[i]);
             csa.plot.x_ofs[i] = 0;
+            csa.plot.lossy[i] = csa.plot.pps[i] > 0;
+            if (csa.plot.srv_dec)
+                await csa.plot.proxy_sock.sendto({'action': 'clear', 'idx': i}, ['server', 'plot']);
         };
         document.getElementById(`plot${i}_re_cal`).onclick = async () => {
             document.getElementById(`plot${i}_re_cal`).disabled = true;
@@ -473,11 +646,18 @@ async function init_plot() {
         };
     }
     
+    csa.plot.srv_dec = await plot_srv_decode();
     dbg_raw_service();
     
-    csa.plot.dat_export = () => { return csa.plot.dat; };
+    csa.plot.dat_export = async () => {
+        let dat = [];
+        for (let i = 0; i < csa.plot.plots.length; i++)
+            dat.push(await plot_raw_dat(i));
+        return dat;
+    };
     csa.plot.dat_import = (dat) => {
         for (let i = 0; i < csa.plot.plots.length; i++) {
+            csa.plot.lossy[i] = false;
             let padding = Math.max(csa.plot.dat[i].length - dat[i].length, 0);
             csa.plot.dat[i] = dat[i].concat(Array(padding).fill([]));
             csa.plot.plots[i].setData(csa.plot.dat[i]);
@@ -70,7 +70,8 @@ async function plot_fft(idx, dat) {
 }
 
 
-async function plot_fft_cal(idx, plot_dat) {
+// srv_mags: spectra of decoded channels from server, others calculated locally
+async function plot_fft_cal(idx, plot_dat, srv_mags=null) {
     const uplot = csa.plot.plots[idx];
     let fft_obj = csa.plot.plot_fft[idx];
     const out_len = fft_obj.size / 2 + 1;
@@ -81,7 +82,9 @@ async function plot_fft_cal(idx, plot_dat) {
     
     let fft_dat = [freqs];
     for (let i = 1; i < plot_dat.length; i++) {
-        if (uplot.series[i].show) {
+        if (uplot.series[i].show && srv_mags && i - 1 < srv_mags.length) {
+            fft_dat.push(srv_mags[i - 1]);
+        } else if (uplot.series[i].show) {
             let mags = await plot_fft(idx, plot_dat[i]);
             fft_dat.push(mags);
         } else {
@@ -0,0 +1,129 @@
+/*
+ * Software License Agreement (MIT License)
+ *
+ * Author: Duke Fong <d@d-l.io>
+ */
+
+import { L } from '../utils/lang.js'
+import { escape_html } from '../utils/helper.js';
+import { CDWebSocket } from '../utils/cd_ws.js';
+import { csa, alloc_port } from '../common.js';
+
+
+// record plots on server, review captures by the min/max pyramid of server:
+// the chart shows about one point per pixel, the visible range is requested again after zoom and pan
+
+async function rec_req(dat) {
+    let sock = csa.plot.rec_sock;
+    sock.flush();
+    await sock.sendto(dat, ['server', 'rec']);
+    let ret = await sock.recvfrom(5000);
+    if (!ret || typeof ret[0] == 'string') {
+        console.warn('rec ret', dat, ret);
+        return null;
+    }
+    return ret[0];
+}
+
+async function plot_rec_list(idx) {
+    let elm = document.getElementById(`plot${idx}_cap`);
+    let ret = await rec_req({'action': 'list'});
+    if (!ret)
+        return;
+    let cur = elm.value;
+    let html = `<option value="">${L('Live')}</option>`;
+    for (let c of ret) {
+        if (c.idx != idx)
+            continue;
+        html += `<option value="${escape_html(c.name)}">${escape_html(c.name)}` +
+                `${c.recording ? ' (rec)' : ''}, ${c.cnt}</option>`;
+    }
+    elm.innerHTML = html;
+    elm.value = cur;
+    if (elm.value != cur)
+        elm.value = '';
+}
+
+// view of capture in x range [x0, x1], null for the whole capture
+async function plot_rec_view(idx, x0=null, x1=null) {
+    let cap = csa.plot.cap[idx];
+    let u = csa.plot.plots[idx];
+    cap.x = [x0, x1];
+    let ret = await rec_req({'action': 'view', 'name': cap.name, 'idx': idx,
+                             'x0': x0, 'x1': x1, 'width': Math.max(Math.round(u.bbox.width / devicePixelRatio), 100)});
+    if (!ret || csa.plot.cap[idx] !== cap)
+        return;
+    let dat = [];
+    for (let i = 0; i < ret.cols.length; i++) {
+        let c = ret.cols[i].slice(); // aligned copy
+        dat.push(Array.from(ret.types[i] == 'f' ? new Float32Array(c.buffer) : new Float64Array(c.buffer)));
+    }
+    while (dat.length < u.series.length) // no cal channels in captures
+        dat.push(Array(dat[0].length).fill(null));
+    console.log(`plot${idx} rec view: level ${ret.level}, ${dat[0].length} points of [${ret.i0}, ${ret.i1})`);
+    if (x0 == null) {
+        cap.x = [dat[0][0], dat[0].at(-1)];
+        u.setData(dat);
+    } else {
+        u.setData(dat, false);
+    }
+}
+
+// setScale hook of the chart
+async function plot_rec_scale(idx) {
+    let cap = csa.plot.cap[idx];
+    let u = csa.plot.plots[idx];
+    if (!cap || u.scales.x.min == null)
+        return;
+    if (cap.x && u.scales.x.min == cap.x[0] && u.scales.x.max == cap.x[1])
+        return;
+    clearTimeout(cap.timer);
+    cap.timer = setTimeout(async () => {
+        if (cap.busy) { // view again after the pending one
+            cap.again = true;
+            return;
+        }
+        cap.busy = true;
+        do {
+            cap.again = false;
+            await plot_rec_view(idx, u.scales.x.min, u.scales.x.max);
+        } while (cap.again && csa.plot.cap[idx] === cap);
+        cap.busy = false;
+    }, 100);
+}
+
+async function plot_rec_init(idx) {
+    if (!csa.plot.rec_sock) {
+        let port = await alloc_port();
+        console.log(`init_plot, alloc rec port: ${port}`);
+        csa.plot.rec_sock = new CDWebSocket(csa.ws_ns, port);
+    }
+    csa.plot.cap[idx] = null;
+
+    document.getElementById(`plot${idx}_rec`).onchange = async () => {
+        let en = document.getElementById(`plot${idx}_rec`).checked;
+        let ret = await rec_req(en ? {'action': 'start', 'cfg': csa.arg.cfg, 'idx': [idx]} :
+                                     {'action': 'stop', 'idx': [idx]});
+        if (en && (!ret || !ret.idx.includes(idx))) {
+            document.getElementById(`plot${idx}_rec`).checked = false;
+            alert(L('Record failed'));
+        }
+        await plot_rec_list(idx);
+    };
+    document.getElementById(`plot${idx}_cap`).onfocus = async () => await plot_rec_list(idx);
+    document.getElementById(`plot${idx}_cap`).onchange = async () => {
+        let name = document.getElementById(`plot${idx}_cap`).value;
+        if (csa.plot.cap[idx])
+            clearTimeout(csa.plot.cap[idx].timer);
+        csa.plot.cap[idx] = name ? {'name': name, 'x': null, 'timer': null, 'busy': false, 'again': false} : null;
+        if (name)
+            await plot_rec_view(idx);
+        else
+            csa.plot.plots[idx].setData(csa.plot.dat[idx]); // back to live, refreshed by plot_update
+    };
+}
+
+
+export {
+    plot_rec_init, plot_rec_scale
+};
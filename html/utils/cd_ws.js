@@ -11,6 +11,11 @@ import { Queue } from './helper.js'
 //       src: [addr, port], dst: [addr, port],
 //       dat: ...
 //   }
+// coalesced packet format (from server):
+//   {
+//       src: [addr, port], dst: [addr, port],
+//       dats: [dat, dat, ...]
+//   }
 
 
 class CDWebSocket {
@@ -51,6 +56,20 @@ class CDWebSocketNS {
         this.connections = {};
         this.sockets = {};
     }
+    
+    // deliver received msg to its socket, return false if no socket
+    dispatch(msg) {
+        let sock = this.sockets[msg['dst'][1]];
+        if (!sock)
+            return false;
+        if ('dats' in msg) {
+            for (let dat of msg['dats'])
+                sock.recv_q.put([dat, msg['src']]);
+        } else {
+            sock.recv_q.put([msg['dat'], msg['src']]);
+        }
+        return true;
+    }
 }
 
 export { CDWebSocket, CDWebSocketNS };
@@ -51,6 +51,7 @@ let trans_zh_cn = {
     'Device Info': '设备信息',
     'Depth': '深度',
     'Realtime': '实时',
+    'Live Rate': '实时速率',
     'Re-Calc': '更新计算',
     
     'Reboot': '重启',
@@ -73,7 +74,13 @@ let trans_zh_cn = {
     
     'Serial disconnected': '串口断开连接',
     'Insufficient registers!': '超出寄存器数量！',
-    'Config Regs': '配置寄存器'
+    'Config Regs': '配置寄存器',
+    'Config changed, reload to apply': '配置已更改，刷新页面生效',
+    'History': '历史',
+    'Query': '查询',
+    'Record': '录制',
+    'Live': '实时',
+    'Record failed': '录制失败'
 };
 
 export { trans_zh_cn };
@@ -50,6 +50,7 @@ let trans_zh_hk = {
     'Device Info': '設備信息',
     'Depth': '深度',
     'Realtime': '實時',
+    'Live Rate': '實時速率',
     'Re-Calc': '更新計算',
     
     'Reboot': '重啟',
@@ -72,7 +73,13 @@ let trans_zh_hk = {
     
     'Serial disconnected': '串口斷開連接',
     'Insufficient registers!': '超出寄存器數量！',
-    'Config Regs': '配置寄存器'
+    'Config Regs': '配置寄存器',
+    'Config changed, reload to apply': '配置已更改，重新載入頁面生效',
+    'History': '歷史',
+    'Query': '查詢',
+    'Record': '錄製',
+    'Live': '實時',
+    'Record failed': '錄製失敗'
 };
 
 export { trans_zh_hk };
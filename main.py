@@ -19,11 +19,13 @@ import os, sys, re
 import _thread
 import time, datetime
 import copy, json5
+import collections
 import asyncio, aiohttp
 import websockets
 from time import sleep
 from cd_ws import CDWebSocket, CDWebSocketNS
 from web_serve import ws_ns, start_web
+from cd_cfg import cfg_get, cfg_list, cfg_watch
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'pycdnet'))
 
@@ -40,10 +42,20 @@ csa = {
     'net': 0x00,    # local net
     'mac': 0x00,    # local mac
     'proxy': None,  # cdbus frame proxy socket
+    'proxy_tx': None, # send to dev for plugins: proxy_tx(src, dst, dat)
     'cfgs': [],     # config list
+    'cfgs_subs': {},    # pages notified of config changes, url_path: port
     'palloc': {},   # ports alloc, url_path: []
+    'rx_q': None,   # rx frame batches, proxy_rx thread -> async_loop
+    'rx_evt': None,   # set when rx_q not empty
+    'rx_hooks': [],   # rx frame hooks for plugins: hook(src, dst_port, dat), return True if consumed
+    'rx_drop': 0,   # dropped dbg and plot frames when rx_q full
 }
 
+RX_BATCH_MAX = 64   # max frames per batch
+RX_Q_MAX = 256      # max pending batches, only dbg and plot frames are dropped above it
+RX_BULK_PORTS = (0x9, 0xa) # dbg and dbg_raw ports
+
 args = CdArgs()
 if args.get("--help", "-h") != None:
     print(__doc__)
@@ -68,6 +80,9 @@ logger = logging.getLogger(f'cdgui')
 async def proxy_rx_rpt(rx):
     src, dst, dat = rx
     logger.debug(f'rx_rpt: src: {src}, dst: {dst}, dat: {dat}')
+    for hook in csa['rx_hooks']:
+        if hook(src, dst[1], dat):
+            return
     if dst[1] == 0x9 or src[1] == 0x1:
         time_str = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3].encode()
         # dbg and dev_info msg also send to index.html 
@@ -83,29 +98,84 @@ async def proxy_rx_rpt(rx):
     if ret:
         logger.warning(f'rx_rpt err: {ret}: /{src[0]}:{dst[1]}, {dat}')
 
+def proxy_rx_put(rxs):
+    # called in async_loop, never blocks the rx thread
+    # when full, drop dbg and plot frames of the oldest batch which has them,
+    # others, e.g. register and iap replies, are never dropped
+    q = csa['rx_q']
+    if len(q) >= RX_Q_MAX:
+        for i, b in enumerate(q):
+            kept = [rx for rx in b if rx[1][1] not in RX_BULK_PORTS]
+            if len(kept) != len(b):
+                csa['rx_drop'] += len(b) - len(kept)
+                if kept:
+                    q[i] = kept
+                else:
+                    del q[i]
+                logger.warning(f'proxy_rx: queue full, drop {len(b) - len(kept)} dbg / plot frames (total: {csa["rx_drop"]})')
+                break
+    q.append(rxs)
+    csa['rx_evt'].set()
+
 def proxy_rx():
     logger.info('start proxy_rx')
     while True:
         if not csa['dev']:
             sleep(0.5)
             continue
+        rxs = []
         frame = None
         try:
             frame = csa['dev'].recv(timeout=0.5)
-            if frame:
-                if frame[3] & 0x80:
-                    rx = cdnet_l1.from_frame(frame, csa['net'])
-                    logger.log(logging.VERBOSE, f'proxy_rx l1: {frame}')
-                else:
-                    rx = cdnet_l0.from_frame(frame, csa['net'])
-                    logger.log(logging.VERBOSE, f'proxy_rx l0: {frame}')
-                asyncio.run_coroutine_threadsafe(proxy_rx_rpt(rx), csa['async_loop']).result()
+            while frame:
+                try:
+                    if frame[3] & 0x80:
+                        rx = cdnet_l1.from_frame(frame, csa['net'])
+                        logger.log(logging.VERBOSE, f'proxy_rx l1: {frame}')
+                    else:
+                        rx = cdnet_l0.from_frame(frame, csa['net'])
+                        logger.log(logging.VERBOSE, f'proxy_rx l0: {frame}')
+                    rxs.append(rx)
+                except Exception as err:
+                    logger.warning(f'proxy_rx: err: {err}, frame: {frame}')
+                if len(rxs) >= RX_BATCH_MAX:
+                    break
+                frame = csa['dev'].recv(timeout=0) # drain pending frames
         except Exception as err:
-            logger.warning(f'proxy_rx: err: {err}', frame)
+            logger.warning(f'proxy_rx: err: {err}, frame: {frame}')
+        if rxs:
+            csa['async_loop'].call_soon_threadsafe(proxy_rx_put, rxs)
+
+async def proxy_rx_service():
+    while True:
+        if not csa['rx_q']:
+            csa['rx_evt'].clear()
+            await csa['rx_evt'].wait()
+            continue
+        rxs = csa['rx_q'].popleft()
+        for rx in rxs:
+            try:
+                await proxy_rx_rpt(rx)
+            except Exception as err:
+                logger.warning(f'proxy_rx_rpt: err: {err}')
 
 _thread.start_new_thread(proxy_rx, ())
 
 # proxy to dev, ('/x0:00:dev_mac', host_port) -> ('server', 'proxy'): { 'dst': dst, 'dat': payloads }
+def proxy_tx(src, dst, dat):
+    # src: (url_path, host_port), dst: (dev_addr, dev_port), also for plugins: csa['proxy_tx']
+    dst_mac = int(dst[0].split(':')[2], 16)
+    if src[0][1:3] != '00':
+        frame = cdnet_l1.to_frame((f'{src[0][1:3]}:{csa["net"]:02x}:{csa["mac"]:02x}', src[1]), \
+                                   dst, dat, csa['mac'], dst_mac)
+        logger.log(logging.VERBOSE, f'proxy_tx frame l1: {frame}')
+    else:
+        frame = cdnet_l0.to_frame((f'{src[0][1:3]}:{csa["net"]:02x}:{csa["mac"]:02x}', src[1]), \
+                                   dst, dat)
+        logger.log(logging.VERBOSE, f'proxy_tx frame l0: {frame}')
+    if csa['dev']:
+        csa['dev'].send(frame)
+
 async def cdbus_proxy_service():
     while True:
         try:
@@ -117,17 +187,7 @@ async def cdbus_proxy_service():
             if len(wc_src[0]) != 9:
                 logger.warning(f'proxy_tx: wc_src err: {wc_src}')
                 continue
-            dst_mac = int(wc_dat['dst'][0].split(':')[2], 16)
-            if wc_src[0][1:3] != '00':
-                frame = cdnet_l1.to_frame((f'{wc_src[0][1:3]}:{csa["net"]:02x}:{csa["mac"]:02x}', wc_src[1]), \
-                                           wc_dat['dst'], wc_dat['dat'], csa['mac'], dst_mac)
-                logger.log(logging.VERBOSE, f'proxy_tx frame l1: {frame}')
-            else:
-                frame = cdnet_l0.to_frame((f'{wc_src[0][1:3]}:{csa["net"]:02x}:{csa["mac"]:02x}', wc_src[1]), \
-                                           wc_dat['dst'], wc_dat['dat'])
-                logger.log(logging.VERBOSE, f'proxy_tx frame l0: {frame}')
-            if csa['dev']:
-                csa['dev'].send(frame)
+            proxy_tx(wc_src, wc_dat['dst'], wc_dat['dat'])
         except Exception as err:
             logger.warning(f'proxy_tx: fmt err: {err}')
 
@@ -161,10 +221,17 @@ async def dev_service(): # cdbus tty setup
             await sock.sendto('err: dev: unknown cmd', src)
 
 
+async def cfgs_notify(names): # push changed configs to subscribed pages
+    csa['cfgs'][:] = cfg_list()
+    for path, port in list(csa['cfgs_subs'].items()):
+        ret = await csa['proxy'].sendto({'cfgs': csa['cfgs'], 'changed': names}, (path, port))
+        if ret:
+            logger.debug(f'cfgs notify: {ret}, remove subscriber: {path}')
+            del csa['cfgs_subs'][path]
+
 async def cfgs_service(): # read configs
-    for cfg in os.listdir('configs'):
-        if cfg.endswith('.json'):
-            csa['cfgs'].append(cfg)
+    csa['cfgs'] += cfg_list()
+    csa['async_loop'].create_task(cfg_watch(cfgs_notify))
     
     sock = CDWebSocket(ws_ns, 'cfgs')
     while True:
@@ -174,10 +241,17 @@ async def cfgs_service(): # read configs
         if dat['action'] == 'get_cfgs':
             await sock.sendto(csa['cfgs'], src)
         
-        elif dat['action'] == 'get_cfg':
-            with open(os.path.join('configs', dat['cfg'])) as c_file:
-                c = json5.load(c_file)
-                await sock.sendto(c, src)
+        elif dat['action'] == 'subscribe': # {'port'}, push {'cfgs': list, 'changed': [names]} to port
+            csa['cfgs_subs'][src[0]] = dat['port']
+            await sock.sendto('successed', src)
+        
+        elif dat['action'] in ['get_cfg', 'get_layout']: # layout: see reg_layout of tools/cdg_helper.py
+            try:
+                c = cfg_get(dat['cfg'])
+                await sock.sendto(c['packed'] if dat['action'] == 'get_cfg' else c['layout_packed'], src)
+            except Exception as err:
+                logger.error(f'cfgs ser: {dat}, err: {err}')
+                await sock.sendto(f'err: cfgs: {err}', src)
         
         else:
             await sock.sendto('err: cfgs: unknown cmd', src)
@@ -196,6 +270,8 @@ async def port_service(): # alloc ports
         if dat['action'] == 'clr_all':
             logger.debug(f'port clr_all')
             csa['palloc'][path] = []
+            csa['proxy'].clr_coalesce(path)
+            ws_ns.clr_drop(path)
             await sock.sendto('successed', src)
         
         elif dat['action'] == 'get_port':
@@ -217,6 +293,12 @@ async def port_service(): # alloc ports
                 logger.debug(f'port alloc: {p}')
                 await sock.sendto(p, src)
         
+        elif dat['action'] == 'coalesce':
+            # window unit: ms, 0: disable
+            logger.debug(f'port coalesce {dat["port"]}: {dat["window"]} ms, size: {dat["size"]}')
+            csa['proxy'].set_coalesce((path, dat['port']), dat['window'] / 1000, dat['size'])
+            await sock.sendto('successed', src)
+        
         else:
             await sock.sendto('err: port: unknown cmd', src)
 
@@ -233,6 +315,11 @@ if __name__ == "__main__":
     csa['async_loop'] = asyncio.new_event_loop()
     asyncio.set_event_loop(csa['async_loop'])
     csa['proxy'] = CDWebSocket(ws_ns, 'proxy')
+    csa['proxy_tx'] = proxy_tx
+    ws_ns.set_drop((None, 0x9)) # dbg prints can be dropped for slow pages, see CDWebSocketConn
+    csa['rx_q'] = collections.deque()
+    csa['rx_evt'] = asyncio.Event()
+    csa['async_loop'].create_task(proxy_rx_service())
     csa['async_loop'].create_task(start_web(port=http_port))
     csa['async_loop'].create_task(cfgs_service())
     csa['async_loop'].create_task(dev_service())
@@ -241,6 +328,14 @@ if __name__ == "__main__":
     
     from plugins.iap import iap_init
     iap_init(csa)
+    from plugins.plot import plot_init
+    plot_init(csa)
+    from plugins.plot_rec import plot_rec_init
+    plot_rec_init(csa)
+    from plugins.plot_fft import plot_fft_init
+    plot_fft_init(csa)
+    from plugins.log import log_init
+    log_init(csa)
     
     #csa['async_loop'].create_task(open_brower())
     logger.info(f'Please open url: http://localhost:{http_port}')
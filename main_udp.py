@@ -22,10 +22,12 @@ import _thread
 import socket, select, ipaddress
 import time, datetime
 import copy, json5
+import collections
 import asyncio, aiohttp
 import websockets
 from cd_ws import CDWebSocket, CDWebSocketNS
 from web_serve import ws_ns, start_web
+from cd_cfg import cfg_get, cfg_list, cfg_watch
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'pycdnet'))
 
@@ -40,10 +42,20 @@ csa = {
     'net': 0x00,        # local net
     'mac': 0x00,        # local mac
     'proxy': None,      # cdbus frame proxy socket
+    'proxy_tx': None,   # send to dev for plugins: proxy_tx(src, dst, dat)
     'cfgs': [],         # config list
+    'cfgs_subs': {},    # pages notified of config changes, url_path: port
     'palloc': {},       # ports alloc, url_path: []
+    'rx_q': None,       # rx packet batches, proxy_rx thread -> async_loop
+    'rx_evt': None,       # set when rx_q not empty
+    'rx_hooks': [],       # rx frame hooks for plugins: hook(src, dst_port, dat), return True if consumed
+    'rx_drop': 0,       # dropped dbg and plot packets when rx_q full
 }
 
+RX_BATCH_MAX = 64   # max packets per batch
+RX_Q_MAX = 256      # max pending batches, only dbg and plot frames are dropped above it
+RX_BULK_PORTS = (0x9, 0xa) # dbg and dbg_raw ports
+
 args = CdArgs()
 if args.get("--help", "-h") != None:
     print(__doc__)
@@ -85,6 +97,9 @@ def addr_cdnet2ip(addr):
 async def proxy_rx_rpt(rx):
     src, dst_port, dat = rx
     logger.debug(f'rx_rpt: src: {src}, dst_port: {dst_port}, dat: {dat}')
+    for hook in csa['rx_hooks']:
+        if hook(src, dst_port, dat):
+            return
     if dst_port == 0x9 or src[1] == 0x1:
         time_str = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3].encode()
         # dbg and dev_info msg also send to index.html 
@@ -134,10 +149,30 @@ async def udp_socks_update(remove=False):
         await asyncio.sleep(0.1)
 
 
+def proxy_rx_put(rxs):
+    # called in async_loop, never blocks the rx thread
+    # when full, drop dbg and plot packets of the oldest batch which has them,
+    # others, e.g. register and iap replies, are never dropped
+    q = csa['rx_q']
+    if len(q) >= RX_Q_MAX:
+        for i, b in enumerate(q):
+            kept = [rx for rx in b if rx[1] not in RX_BULK_PORTS]
+            if len(kept) != len(b):
+                csa['rx_drop'] += len(b) - len(kept)
+                if kept:
+                    q[i] = kept
+                else:
+                    del q[i]
+                logger.warning(f'proxy_rx: queue full, drop {len(b) - len(kept)} dbg / plot packets (total: {csa["rx_drop"]})')
+                break
+    q.append(rxs)
+    csa['rx_evt'].set()
+
 def proxy_rx():
     global proxy_rx_paused
     logger.info('start proxy_rx')
     while True:
+        rxs = []
         try:
             if proxy_rx_pause:
                 proxy_rx_paused = True
@@ -145,22 +180,48 @@ def proxy_rx():
                 continue
             proxy_rx_paused = False
             socks = [x for v in csa['udp_socks'].values() for x in v]
-            readable, _, _ = select.select(socks, [], [], 0.2)
-            if not readable:
-                continue
-            for s in readable:
-                dat, src_addr = s.recvfrom(256)
-                dst_port = s.getsockname()[1] - udp_port_base
-                src_ip = addr_ip2cdnet(src_addr[0])
-                src_port = src_addr[1]
-                rx = (src_ip, src_port), dst_port, dat
-                asyncio.run_coroutine_threadsafe(proxy_rx_rpt(rx), csa['async_loop']).result()
+            timeout = 0.2
+            while len(rxs) < RX_BATCH_MAX:
+                readable, _, _ = select.select(socks, [], [], timeout)
+                if not readable:
+                    break
+                for s in readable:
+                    dat, src_addr = s.recvfrom(256)
+                    dst_port = s.getsockname()[1] - udp_port_base
+                    src_ip = addr_ip2cdnet(src_addr[0])
+                    src_port = src_addr[1]
+                    rxs.append(((src_ip, src_port), dst_port, dat))
+                timeout = 0 # drain pending packets
         except Exception as err:
             logger.warning(f'proxy_rx: err: {err}')
+        if rxs:
+            csa['async_loop'].call_soon_threadsafe(proxy_rx_put, rxs)
+
+async def proxy_rx_service():
+    while True:
+        if not csa['rx_q']:
+            csa['rx_evt'].clear()
+            await csa['rx_evt'].wait()
+            continue
+        rxs = csa['rx_q'].popleft()
+        for rx in rxs:
+            try:
+                await proxy_rx_rpt(rx)
+            except Exception as err:
+                logger.warning(f'proxy_rx_rpt: err: {err}')
 
 _thread.start_new_thread(proxy_rx, ())
 
 # proxy to dev, ('/x0:00:dev_mac', host_port) -> ('server', 'proxy'): { 'dst': dst, 'dat': payloads }
+def proxy_tx(src, dst, dat):
+    # src: (url_path, host_port), dst: (dev_addr, dev_port), also for plugins: csa['proxy_tx']
+    dst_ip = addr_cdnet2ip(dst[0])
+    if src[0][1:3] == '00':
+        s = csa['udp_socks'][src[1]][0]
+    else:
+        s = csa['udp_socks'][src[1]][1]
+    s.sendto(dat, (dst_ip, dst[1]))
+
 async def cdbus_proxy_service():
     while True:
         try:
@@ -172,14 +233,7 @@ async def cdbus_proxy_service():
             if len(wc_src[0]) != 9:
                 logger.warning(f'proxy_tx: wc_src err: {wc_src}')
                 continue
-            dst_ip = addr_cdnet2ip(wc_dat['dst'][0])
-            dst_port = wc_dat['dst'][1]
-            src_port = wc_src[1]
-            if wc_src[0][1:3] == '00':
-                s = csa['udp_socks'][src_port][0]
-            else:
-                s = csa['udp_socks'][src_port][1]
-            s.sendto(wc_dat['dat'], (dst_ip, dst_port))
+            proxy_tx(wc_src, wc_dat['dst'], wc_dat['dat'])
         except Exception as err:
             logger.warning(f'proxy_tx: err: {err}')
 
@@ -196,10 +250,17 @@ async def dev_service(): # cdbus tty setup
             await sock.sendto('err: dev: unknown cmd', src)
 
 
+async def cfgs_notify(names): # push changed configs to subscribed pages
+    csa['cfgs'][:] = cfg_list()
+    for path, port in list(csa['cfgs_subs'].items()):
+        ret = await csa['proxy'].sendto({'cfgs': csa['cfgs'], 'changed': names}, (path, port))
+        if ret:
+            logger.debug(f'cfgs notify: {ret}, remove subscriber: {path}')
+            del csa['cfgs_subs'][path]
+
 async def cfgs_service(): # read configs
-    for cfg in os.listdir('configs'):
-        if cfg.endswith('.json'):
-            csa['cfgs'].append(cfg)
+    csa['cfgs'] += cfg_list()
+    csa['async_loop'].create_task(cfg_watch(cfgs_notify))
     
     sock = CDWebSocket(ws_ns, 'cfgs')
     while True:
@@ -209,10 +270,17 @@ async def cfgs_service(): # read configs
         if dat['action'] == 'get_cfgs':
             await sock.sendto(csa['cfgs'], src)
         
-        elif dat['action'] == 'get_cfg':
-            with open(os.path.join('configs', dat['cfg'])) as c_file:
-                c = json5.load(c_file)
-                await sock.sendto(c, src)
+        elif dat['action'] == 'subscribe': # {'port'}, push {'cfgs': list, 'changed': [names]} to port
+            csa['cfgs_subs'][src[0]] = dat['port']
+            await sock.sendto('successed', src)
+        
+        elif dat['action'] in ['get_cfg', 'get_layout']: # layout: see reg_layout of tools/cdg_helper.py
+            try:
+                c = cfg_get(dat['cfg'])
+                await sock.sendto(c['packed'] if dat['action'] == 'get_cfg' else c['layout_packed'], src)
+            except Exception as err:
+                logger.error(f'cfgs ser: {dat}, err: {err}')
+                await sock.sendto(f'err: cfgs: {err}', src)
         
         else:
             await sock.sendto('err: cfgs: unknown cmd', src)
@@ -231,6 +299,8 @@ async def port_service(): # alloc ports
         if dat['action'] == 'clr_all':
             logger.debug(f'port clr_all')
             csa['palloc'][path] = []
+            csa['proxy'].clr_coalesce(path)
+            ws_ns.clr_drop(path)
             await udp_socks_update(True)
             await sock.sendto('successed', src)
         
@@ -255,6 +325,12 @@ async def port_service(): # alloc ports
                 await udp_socks_update()
                 await sock.sendto(p, src)
         
+        elif dat['action'] == 'coalesce':
+            # window unit: ms, 0: disable
+            logger.debug(f'port coalesce {dat["port"]}: {dat["window"]} ms, size: {dat["size"]}')
+            csa['proxy'].set_coalesce((path, dat['port']), dat['window'] / 1000, dat['size'])
+            await sock.sendto('successed', src)
+        
         else:
             await sock.sendto('err: port: unknown cmd', src)
 
@@ -271,6 +347,11 @@ if __name__ == "__main__":
     csa['async_loop'] = asyncio.new_event_loop()
     asyncio.set_event_loop(csa['async_loop'])
     csa['proxy'] = CDWebSocket(ws_ns, 'proxy')
+    csa['proxy_tx'] = proxy_tx
+    ws_ns.set_drop((None, 0x9)) # dbg prints can be dropped for slow pages, see CDWebSocketConn
+    csa['rx_q'] = collections.deque()
+    csa['rx_evt'] = asyncio.Event()
+    csa['async_loop'].create_task(proxy_rx_service())
     csa['async_loop'].create_task(start_web(port=http_port))
     csa['async_loop'].create_task(cfgs_service())
     csa['async_loop'].create_task(dev_service())
@@ -279,6 +360,14 @@ if __name__ == "__main__":
     
     from plugins.iap import iap_init
     iap_init(csa)
+    from plugins.plot import plot_init
+    plot_init(csa)
+    from plugins.plot_rec import plot_rec_init
+    plot_rec_init(csa)
+    from plugins.plot_fft import plot_fft_init
+    plot_fft_init(csa)
+    from plugins.log import log_init
+    log_init(csa)
     
     #csa['async_loop'].create_task(open_brower())
     logger.info(f'Please open url: http://localhost:{http_port}')
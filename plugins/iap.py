@@ -4,36 +4,344 @@
 #
 # Author: Duke Fong <d@d-l.io>
 
+import os, re, struct
+import asyncio
+import collections
 from intelhex import IntelHex
 from cd_ws import CDWebSocket
 from web_serve import ws_ns
 from cdnet.utils.log import *
+from cdnet.dev.cdbus_serial import modbus_crc
 
+IMG_CACHE_MAX = 4      # parsed images kept in memory
 
-async def iap_service(): # config r/w    
-    logger = logging.getLogger(f'cdgui.iap')
+csa = None
+logger = logging.getLogger(f'cdgui.iap')
+
+
+class IapStop(Exception):
+    pass
+
+
+def load_ihex(path):
+    # return [[addr, bytes], ...]
+    ih = IntelHex()
+    ih.loadhex(path)
+    segs = ih.segments()
+    logger.info(f'parse ihex file, segments: {[list(map(hex, l)) for l in segs]} (end addr inclusive)')
+    return [[seg[0], ih.tobinstr(seg[0], size=seg[1]-seg[0])] for seg in segs]
+
+
+def load_elf(path):
+    # PT_LOAD segments with data at load (physical) address, adjacent segments are merged
+    with open(path, 'rb') as f:
+        elf = f.read()
+    if elf[:4] != b'\x7fELF':
+        raise ValueError('not elf file')
+    bo = '<' if elf[5] == 1 else '>'
+    if elf[4] == 1:
+        phoff, = struct.unpack_from(f'{bo}I', elf, 0x1c)
+        phentsize, phnum = struct.unpack_from(f'{bo}HH', elf, 0x2a)
+        ph_fmt = f'{bo}IIIIII' # type, offset, vaddr, paddr, filesz, memsz
+    else:
+        phoff, = struct.unpack_from(f'{bo}Q', elf, 0x20)
+        phentsize, phnum = struct.unpack_from(f'{bo}HH', elf, 0x36)
+        ph_fmt = f'{bo}IIQQQQ' # type, flags, offset, vaddr, paddr, filesz
+    segs = []
+    for i in range(phnum):
+        ph = struct.unpack_from(ph_fmt, elf, phoff + i * phentsize)
+        type_, ofs, paddr, filesz = (ph[0], ph[1], ph[3], ph[4]) if elf[4] == 1 else (ph[0], ph[2], ph[4], ph[5])
+        if type_ == 1 and filesz:
+            segs.append([paddr, elf[ofs:ofs+filesz]])
+    segs.sort(key=lambda s: s[0])
+    ret = []
+    for addr, dat in segs:
+        if ret and ret[-1][0] + len(ret[-1][1]) == addr:
+            ret[-1][1] += dat
+        else:
+            ret.append([addr, bytes(dat)])
+    logger.info(f'parse elf file, segments: {[[hex(a), hex(a + len(d))] for a, d in ret]}')
+    return ret
+
+
+def load_image(path):
+    # .hex, .elf, or .bin with load address: fw.bin@0x0800c000
+    # parsed images are cached, keyed by path, mtime and size
+    m = re.fullmatch(r'(.+\.bin)@(\w+)', path, re.I)
+    fpath = m.group(1) if m else path
+    st = os.stat(fpath)
+    key = (path, st.st_mtime_ns, st.st_size)
+    cache = csa['iap_img']
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    if m:
+        with open(fpath, 'rb') as f:
+            segs = [[int(m.group(2), 0), f.read()]]
+    elif fpath.lower().endswith('.elf'):
+        segs = load_elf(fpath)
+    else:
+        segs = load_ihex(fpath)
+    for k in [k for k in cache if k[0] == path]:
+        del cache[k]
+    cache[key] = segs
+    while len(cache) > IMG_CACHE_MAX:
+        cache.popitem(last=False)
+    return segs
+
+
+class IapJob():
+    # flash state machine of one device, same steps as the old iap.js, driven by the server:
+    #   requests from (dev url path, port), the port is allocated by the page,
+    #   replies come back by rx hook, progress is pushed to the page at the same port
+    #   progress: {'epoch': str, 'progress': str, 'state': 'run' | 'ok' | 'err' | 'stop'}
+
+    def __init__(self, dev, port, iap_cfg, mode, check):
+        self.dev = dev
+        self.port = port
+        self.cfg = iap_cfg
+        self.mode = mode
+        self.check = check
+        self.blk_size = iap_cfg.get('blk_size', 128)
+        self.batch_pkts = iap_cfg.get('batch_pkts', 0)
+        self.rx_q = asyncio.Queue()
+        self.stop = False
+        self.epoch = ''
+        self.pct = None
+        self.task = None
+
+    def tx(self, dst_port, dat):
+        csa['proxy_tx']((f'/{self.dev}', self.port), (self.dev, dst_port), dat)
+
+    def flush(self):
+        while not self.rx_q.empty():
+            self.rx_q.get_nowait()
+
+    async def rx(self, timeout):
+        # return (src, dat), None if timeout, wait in slices to stop in time
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout
+        while not self.stop:
+            try:
+                return await asyncio.wait_for(self.rx_q.get(), max(min(0.1, end - loop.time()), 0))
+            except asyncio.TimeoutError:
+                if loop.time() >= end:
+                    return None
+        raise IapStop()
+
+    async def req(self, dst_port, dat, timeout):
+        self.flush()
+        self.tx(dst_port, dat)
+        ret = await self.rx(timeout)
+        return ret[1] if ret else None
+
+    async def report(self, progress, state='run'):
+        ret = await csa['proxy'].sendto({'epoch': self.epoch, 'progress': progress, 'state': state},
+                                        (f'/{self.dev}', self.port))
+        if ret:
+            logger.debug(f'iap: {self.dev}: report: {ret}')
+
+    async def report_pct(self, name, done, total):
+        pct = round(done / total * 100)
+        if pct != self.pct:
+            self.pct = pct
+            await self.report(f'{name} {pct}%')
+
+    async def erase(self, addr, len_):
+        ret = await self.req(0x8, struct.pack('<BII', 0x2f, addr, len_), 60)
+        logger.debug(f'iap: erase ret: {ret}, addr: {addr:08x}, len: {len_:08x}')
+        return ret != None and len(ret) == 1 and (ret[0] & 0xf) == 0
+
+    async def write(self, addr, dat):
+        # batch_pkts packets per group, only the last one needs reply, up to 2 groups pending
+        blk_size = self.blk_size
+        pend_max = 2 if self.batch_pkts else 1
+        grp_size = max(self.batch_pkts, 1)
+        cur, pend = 0, 0
+        self.pct = None
+        self.flush()
+        while True:
+            if pend < pend_max and cur < len(dat):
+                for i in range(grp_size):
+                    if cur >= len(dat):
+                        break
+                    not_reply = i + 1 < grp_size and cur + blk_size < len(dat)
+                    size = min(blk_size, len(dat) - cur)
+                    self.tx(0x8, struct.pack('<BI', 0xa0 if not_reply else 0x20, addr + cur) + dat[cur:cur+size])
+                    cur += size
+                pend += 1
+                await self.report_pct('Write', cur, len(dat))
+            elif pend:
+                ret = await self.rx(1)
+                if not ret or len(ret[1]) != 1 or (ret[1][0] & 0xf) != 0:
+                    logger.warning(f'iap: write ret err, pend: {pend}, ret: {ret}')
+                    return False
+                pend -= 1
+            else:
+                return True
+
+    async def read(self, addr, len_):
+        buf = bytearray()
+        self.pct = None
+        while len(buf) < len_:
+            size = min(self.blk_size, len_ - len(buf))
+            ret = await self.req(0x8, struct.pack('<BIB', 0x00, addr + len(buf), size), 1)
+            if not ret or (ret[0] & 0xf) != 0 or len(ret) != size + 1:
+                logger.warning(f'iap: read err: {ret}')
+                return None
+            buf += ret[1:]
+            await self.report_pct('Read', len(buf), len_)
+        return bytes(buf)
+
+    async def read_crc(self, addr, len_):
+        ret = await self.req(0x8, struct.pack('<BII', 0x10, addr, len_), 3)
+        if not ret or (ret[0] & 0xf) != 0 or len(ret) != 3:
+            logger.warning(f'iap: read crc err: {ret}')
+            return None
+        return struct.unpack('<H', ret[1:3])[0]
+
+    async def keep_in_bl(self):
+        if 'keep_bl' not in self.cfg:
+            return True
+        ret = await self.req(0x5, struct.pack('<BHB', 0x20, self.cfg['keep_bl'], 1), 0.2)
+        return ret != None and len(ret) == 1 and (ret[0] & 0xf) == 0
+
+    async def reboot(self, bl_args):
+        await self.req(0x5, struct.pack('<BHB', 0x20, self.cfg['reboot'], bl_args), 0.2)
+
+    async def enter_bl(self):
+        retry_cnt, reboot_cnt = 0, 0
+        spins = '-\\|/'
+        while True:
+            self.flush()
+            self.tx(0x1, b'')
+            ret = await self.rx(0.1)
+            if ret and ret[0][1] == 0x1:
+                if b'(bl)' in ret[1]:
+                    logger.info(f'iap: {self.dev}: found (bl): {ret[1]}')
+                    if await self.keep_in_bl():
+                        await self.report('keep_in_bl succeeded')
+                        return
+                    await self.report('keep_in_bl failed')
+                else:
+                    await self.report('Not found string "(bl)", reboot...')
+                    await self.reboot(1)
+                    reboot_cnt += 1
+            else:
+                await self.report(f'Try read info ({spins[retry_cnt]}) | try reboot: {reboot_cnt}')
+            retry_cnt = (retry_cnt + 1) % 4
+
+    async def run(self, segs):
+        if self.mode.startswith('bl'):
+            await self.enter_bl()
+        if self.mode == 'flash':
+            if not await self.keep_in_bl():
+                return 'err', 'keep_in_bl failed'
+            await self.report('keep_in_bl succeeded')
+        if self.mode == 'bl':
+            return 'ok', 'Succeeded'
+
+        for idx, (addr, dat) in enumerate(segs):
+            self.epoch = f'[{idx+1}/{len(segs)}]'
+            await self.report('Erasing...')
+            if not await self.erase(addr, len(dat)):
+                return 'err', 'Erase failed'
+
+        for idx, (addr, dat) in enumerate(segs):
+            self.epoch = f'[{idx+1}/{len(segs)}]'
+            if not await self.write(addr, dat):
+                return 'err', 'Write failed'
+            if self.check == 'crc':
+                crc_back, crc_ori = await self.read_crc(addr, len(dat)), modbus_crc(dat)
+                if crc_back == None:
+                    return 'err', 'Read crc failed.'
+                if crc_back != crc_ori:
+                    return 'err', f'CRC err: {crc_back:04x} != {crc_ori:04x}'
+                msg = 'Succeeded with crc check.'
+            elif self.check == 'read':
+                buf = await self.read(addr, len(dat))
+                if buf == None:
+                    return 'err', 'Read back failed.'
+                if buf != dat:
+                    i = next(i for i in range(len(dat)) if buf[i] != dat[i])
+                    return 'err', f'Compare err at: {i} (w: {dat[i]:02x}, r: {buf[i]:02x})'
+                msg = 'Succeeded with read back check.'
+            else:
+                msg = 'Succeeded without check.'
+            await self.report(msg)
+
+        if self.mode == 'bl_full':
+            await self.reboot(2)
+        return 'ok', msg
+
+    async def main(self, segs):
+        try:
+            state, msg = await self.run(segs)
+        except IapStop:
+            state, msg = 'stop', 'Stopped'
+        except Exception as err:
+            logger.error(f'iap: {self.dev}: err: {err}')
+            state, msg = 'err', f'Error: {err}'
+        logger.info(f'iap: {self.dev}: {state}: {msg}')
+        csa['iap'].pop(self.dev, None)
+        await self.report(msg, state)
+
+
+def iap_rx(src, dst_port, dat):
+    # rx hook, replies to the port of running job
+    job = csa['iap'].get(src[0])
+    if not job or dst_port != job.port:
+        return False
+    job.rx_q.put_nowait((src, dat))
+    return True
+
+
+async def iap_service(): # config r/w
     sock = CDWebSocket(ws_ns, 'iap')
     while True:
         dat, src = await sock.recvfrom()
         logger.debug(f'iap ser: {dat}')
-        
-        if dat['action'] == 'get_ihex':
+        dev = src[0][1:]
+
+        if dat['action'] == 'get_ihex': # {'path'}, return [[addr, bytes], ...], [] on error
             ret = []
-            ih = IntelHex()
             try:
-                ih.loadhex(dat['path'])
-                segs = ih.segments()
-                logger.info(f'parse ihex file, segments: {[list(map(hex, l)) for l in segs]} (end addr inclusive)')
-                for seg in segs:
-                    s = [seg[0], ih.tobinstr(seg[0], size=seg[1]-seg[0])]
-                    ret.append(s)
+                ret = load_image(dat['path'])
             except Exception as err:
-                logger.error(f'parse ihex file error: {err}')
+                logger.error(f'parse image file error: {err}')
             await sock.sendto(ret, src)
-        
+
+        elif dat['action'] == 'start': # {'port', 'path', 'mode', 'check', 'iap': iap cfg}, progress pushed to port
+            if dev in csa['iap']:
+                await sock.sendto('err: iap: busy', src)
+                continue
+            segs = []
+            if dat['mode'] != 'bl':
+                try:
+                    segs = load_image(dat['path'])
+                except Exception as err:
+                    logger.error(f'parse image file error: {err}')
+                if not segs:
+                    await sock.sendto('err: iap: invalid image file', src)
+                    continue
+            job = IapJob(dev, dat['port'], dat['iap'], dat['mode'], dat.get('check', 'none'))
+            csa['iap'][dev] = job
+            job.task = csa['async_loop'].create_task(job.main(segs))
+            await sock.sendto('successed', src)
+
+        elif dat['action'] == 'stop':
+            job = csa['iap'].get(dev)
+            if job:
+                job.stop = True
+            await sock.sendto('successed', src)
+
         else:
             await sock.sendto('err: iap: unknown cmd', src)
 
-def iap_init(csa):
+def iap_init(csa_):
+    global csa
+    csa = csa_
+    csa['iap'] = {}     # dev: IapJob, running jobs
+    csa['iap_img'] = collections.OrderedDict() # (path, mtime, size): segments, lru
+    csa['rx_hooks'].append(iap_rx)
     csa['async_loop'].create_task(iap_service())
-
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+#
+# Software License Agreement (MIT License)
+#
+# Author: Duke Fong <d@d-l.io>
+
+import os, re, time, struct
+import asyncio, heapq, bisect
+import datetime
+from cd_ws import CDWebSocket
+from web_serve import ws_ns
+from cdnet.utils.log import *
+
+LOG_DIR = 'logs'
+LOG_FILE_MAX = 16 * 1024 * 1024 # rotate size
+LOG_FILES_MAX = 64      # max files per device, remove the oldest
+LOG_IDX_STEP = 0x10000  # bytes per index entry
+LOG_BATCH = 500         # max lines per query message
+LOG_QUERY_MAX = 100000  # max lines per query
+LOG_FLUSH = 0.5         # write pending lines every 0.5 sec
+
+IDX_ST = struct.Struct('<dQ') # time, file offset
+
+csa = None
+logger = logging.getLogger(f'cdgui.log')
+
+
+class LogStore():
+    # append-only text log of one device: logs/<dev>/<start time>.log, rotated by size
+    # line: "<unix time> <port> <text>\n", the device port is 0x1 for dev_info, 0x9 for debug prints
+    # time index of each file: <start time>.idx, an entry for every LOG_IDX_STEP bytes
+
+    def __init__(self, dev):
+        self.dev = dev
+        self.path = log_dir(dev)
+        os.makedirs(self.path, exist_ok=True)
+        self.f = None
+        self.idx = None
+        self.idx_ofs = 0
+        self.pend = []  # [(time, port, dat), ...] by log_rx, written by log_write
+
+    def _open(self, t):
+        self.close()
+        name = datetime.datetime.fromtimestamp(t).strftime("%Y%m%d-%H%M%S")
+        n = 0
+        while os.path.exists(os.path.join(self.path, f'{name}.log')):
+            n += 1
+            name = datetime.datetime.fromtimestamp(t).strftime("%Y%m%d-%H%M%S") + f'.{n}'
+        self.f = open(os.path.join(self.path, f'{name}.log'), 'ab')
+        self.idx = open(os.path.join(self.path, f'{name}.idx'), 'ab')
+        self.idx_ofs = -LOG_IDX_STEP
+        for old in log_files(self.dev)[:-LOG_FILES_MAX]:
+            logger.info(f'log: {self.dev}: remove {old}')
+            for ext in ['.log', '.idx']:
+                os.remove(os.path.join(self.path, old + ext))
+
+    def append(self, t, port, dat):
+        lines = [l for l in dat.split(b'\n') if l]
+        if not lines:
+            return
+        if not self.f or self.f.tell() >= LOG_FILE_MAX:
+            self._open(t)
+        ofs = self.f.tell()
+        if ofs - self.idx_ofs >= LOG_IDX_STEP:
+            self.idx.write(IDX_ST.pack(t, ofs))
+            self.idx_ofs = ofs
+        head = f'{t:.3f} {port:x} '.encode()
+        self.f.write(b''.join([head + l.replace(b'\r', b'') + b'\n' for l in lines]))
+
+    def flush(self):
+        if self.f:
+            self.f.flush()
+            self.idx.flush()
+
+    def close(self):
+        if self.f:
+            self.f.close()
+            self.idx.close()
+        self.f = self.idx = None
+
+
+def log_dir(dev):
+    return os.path.join(LOG_DIR, dev.replace(':', '-'))
+
+
+def log_files(dev):
+    # file names without ext, old to new
+    path = log_dir(dev)
+    if not os.path.isdir(path):
+        return []
+    return sorted([n[:-4] for n in os.listdir(path) if n.endswith('.log')])
+
+
+def log_devs():
+    if not os.path.isdir(LOG_DIR):
+        return []
+    return sorted([d.replace('-', ':') for d in os.listdir(LOG_DIR) if os.path.isdir(os.path.join(LOG_DIR, d))])
+
+
+def _idx(path):
+    try:
+        with open(path + '.idx', 'rb') as f:
+            d = f.read()
+    except OSError:
+        return []
+    return list(IDX_ST.iter_unpack(d[:len(d) // IDX_ST.size * IDX_ST.size]))
+
+
+def log_lines(dev, t0=None, t1=None, rex=None):
+    # yield (time, dev, port, text) of a device in time range [t0, t1], text matches rex
+    # skip files and file parts out of range by the time index
+    names = log_files(dev)
+    idxs = [_idx(os.path.join(log_dir(dev), n)) for n in names]
+    for i, name in enumerate(names):
+        idx = idxs[i]
+        if not idx:
+            continue
+        if t1 != None and idx[0][0] > t1:
+            return
+        nxt = next((x[0][0] for x in idxs[i+1:] if x), None)
+        if t0 != None and nxt != None and nxt < t0:
+            continue
+        ofs = 0
+        if t0 != None:
+            j = bisect.bisect_right([x[0] for x in idx], t0) - 1
+            ofs = idx[j][1] if j >= 0 else 0
+        with open(os.path.join(log_dir(dev), name + '.log'), 'rb') as f:
+            f.seek(ofs)
+            for line in f:
+                if not line.endswith(b'\n'): # being written
+                    return
+                try:
+                    t_, port, text = line.rstrip(b'\n').split(b' ', 2)
+                    t = float(t_)
+                except ValueError:
+                    continue
+                if t0 != None and t < t0:
+                    continue
+                if t1 != None and t > t1:
+                    return
+                text = text.decode(errors='replace')
+                if rex and not rex.search(text):
+                    continue
+                yield t, dev, int(port, 16), text
+
+
+def log_batches(devs, t0, t1, rex, limit):
+    # lines of all devices merged by time, in batches
+    lines = heapq.merge(*[log_lines(d, t0, t1, rex) for d in devs], key=lambda l: l[0])
+    batch = []
+    cnt = 0
+    for l in lines:
+        batch.append(list(l))
+        cnt += 1
+        if len(batch) >= LOG_BATCH or cnt >= limit:
+            yield batch
+            batch = []
+            if cnt >= limit:
+                return
+    yield batch
+
+
+def log_rx(src, dst_port, dat):
+    # rx hook, never consumes frames, lines are written by log_flush_service
+    if dst_port == 0x9 or src[1] == 0x1:
+        s = csa['log'].get(src[0])
+        if not s:
+            s = csa['log'][src[0]] = LogStore(src[0])
+        s.pend.append((time.time(), dst_port if dst_port == 0x9 else src[1], dat))
+    return False
+
+
+def log_write(items):
+    # runs in executor, items: [(LogStore, pending lines), ...]
+    for s, pend in items:
+        try:
+            for t, port, dat in pend:
+                s.append(t, port, dat)
+            s.flush()
+        except Exception as err:
+            logger.warning(f'log: {s.dev}: {err}')
+
+
+async def log_flush_service():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(LOG_FLUSH)
+        items = [(s, s.pend) for s in csa['log'].values() if s.pend]
+        for s, _ in items:
+            s.pend = []
+        if items:
+            await loop.run_in_executor(None, log_write, items)
+
+
+async def log_query(qid, devs, t0, t1, rex, limit, dst):
+    # stream {'id', 'lines': [[time, dev, port, text], ...], 'done'} to dst, file scan runs in executor
+    loop = asyncio.get_running_loop()
+    batches = log_batches(devs, t0, t1, rex, limit)
+    cnt = 0
+    try:
+        while True:
+            batch = await loop.run_in_executor(None, next, batches, None)
+            done = batch == None or len(batch) < LOG_BATCH or cnt + len(batch) >= limit
+            cnt += len(batch or [])
+            ret = await csa['proxy'].sendto({'id': qid, 'lines': batch or [], 'done': done}, dst)
+            if ret or done:
+                break
+    except asyncio.CancelledError:
+        await csa['proxy'].sendto({'id': qid, 'lines': [], 'done': True}, dst)
+    finally:
+        if csa['log_query'].get((dst[0], qid)) is asyncio.current_task():
+            del csa['log_query'][(dst[0], qid)]
+        try:
+            batches.close()
+        except ValueError:
+            pass # still running in executor when cancelled
+    logger.debug(f'log query {qid}: {cnt} lines')
+
+
+async def log_service():
+    sock = CDWebSocket(ws_ns, 'log')
+    while True:
+        dat, src = await sock.recvfrom()
+        logger.debug(f'log ser: {dat}')
+
+        try:
+            if dat['action'] == 'list': # devices with logs and files
+                await sock.sendto({d: log_files(d) for d in log_devs()}, src)
+
+            elif dat['action'] == 'query': # {'id', 'port', 'devs', 't0', 't1', 're', 'limit'}, devs: None for all
+                rex = re.compile(dat['re']) if dat.get('re') else None
+                known = log_devs()
+                devs = dat.get('devs') or known
+                for d in devs:
+                    if d not in known:
+                        raise ValueError(f'unknown dev: {d}')
+                key = (src[0], dat['id'])
+                if key in csa['log_query']:
+                    csa['log_query'][key].cancel()
+                csa['log_query'][key] = csa['async_loop'].create_task(log_query(dat['id'], devs,
+                        dat.get('t0'), dat.get('t1'), rex, min(dat.get('limit', LOG_QUERY_MAX), LOG_QUERY_MAX),
+                        (src[0], dat['port'])))
+                await sock.sendto('successed', src)
+
+            elif dat['action'] == 'stop': # {'id'}
+                t = csa['log_query'].get((src[0], dat['id']))
+                if t:
+                    t.cancel()
+                await sock.sendto('successed', src)
+
+            else:
+                await sock.sendto('err: log: unknown cmd', src)
+
+        except Exception as err:
+            logger.error(f'log ser: {dat}, err: {err}')
+            await sock.sendto(f'err: log: {err}', src)
+
+
+def log_init(csa_):
+    global csa
+    csa = csa_
+    csa['log'] = {}         # dev: LogStore
+    csa['log_query'] = {}   # (url_path, query id): task
+    csa['rx_hooks'].insert(0, log_rx)
+    csa['async_loop'].create_task(log_service())
+    csa['async_loop'].create_task(log_flush_service())
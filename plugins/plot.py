@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+#
+# Software License Agreement (MIT License)
+#
+# Author: Duke Fong <d@d-l.io>
+
+import os, sys, re, math, time
+import asyncio
+import numpy as np
+from cd_ws import CDWebSocket
+from web_serve import ws_ns
+from cd_cfg import load_cfg
+from cdnet.utils.log import *
+from plugins.plot_cal import cal_engine
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'tools'))
+from cdg_helper import fmt_size
+
+R_ADDR = 0; R_LEN = 1; R_FMT = 2
+R_SHOW = 3; R_ID = 4; R_DESC = 5
+
+PLOT_PORT = 0x0a    # dbg_raw port
+PLOT_FLUSH = 0.05   # push decoded blocks every 50 ms
+PLOT_HIST = 200000  # full resolution samples kept per plot for get_raw
+
+PLOT_DTYPE = {
+    'c': 'i1', 'b': 'i1', 'B': 'u1', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4',
+    'q': '<i8', 'Q': '<u8', 'f': '<f4', 'd': '<f8'
+}
+
+csa = None
+logger = logging.getLogger(f'cdgui.plot')
+
+
+# port of plot_reg_w.js, get plot fmt and labels from config
+
+# e.g. "str[2][3]" -> [["str[2][3]"], ["str[2]", 3], ["str", 2, 3]]
+def split_indexes(s):
+    ret = [[s]]
+    indexes = []
+    while True:
+        m = re.search(r'\[(\d+)\]$', s)
+        if not m:
+            break
+        indexes.insert(0, int(m.group(1)))
+        s = s[:m.start()]
+        ret.append([s, *indexes])
+    return ret[:3]
+
+
+def item_val(cfg, item, type_):
+    if len(item) == 5: # overlay
+        if type_ == R_ADDR:
+            if isinstance(item[0], int):
+                return item[0] + item[1]
+            for name_a in split_indexes(item[0]):
+                ret = _get_reg_ofs_len(cfg, name_a, True)
+                if ret != None:
+                    return ret[0] + item[1]
+            return None
+        elif type_ == R_LEN:
+            return item[2]
+        elif type_ == R_FMT:
+            return item[3]
+        return None
+    return item[type_]
+
+
+# e.g. name_a: ["str[2][3]"] or ["str[2]", 3]
+def _get_reg_ofs_len(cfg, name_a, skip_overlay=False):
+    match_item = None
+    if not skip_overlay:
+        for o in cfg['plot'].get('reg_overlay', []):
+            if o[4] == name_a[0]:
+                match_item = o
+                break
+    if not match_item:
+        for r in cfg['reg']['list']:
+            if r[R_ID] == name_a[0]:
+                match_item = r
+                break
+    if not match_item:
+        return None
+    val = lambda t: item_val(cfg, match_item, t)
+
+    if len(name_a) == 1:
+        f = re.sub(r'\W', '', val(R_FMT))
+        f_size = fmt_size(f)
+        len_ = val(R_LEN)
+        if len_ / f_size == 1 and f[-1].isdigit():
+            return [val(R_ADDR), fmt_size(f[:-1]), f[:-1]]
+        return [val(R_ADDR), len_, f * (len_ // f_size)]
+
+    fmt_s = fmt_size(val(R_FMT))
+    if len(name_a) == 2:
+        if val(R_FMT)[0] == '[' or val(R_FMT)[0] == '{':
+            ofs = val(R_ADDR) + fmt_s * name_a[1]
+            fmt = val(R_FMT)[1:-1]
+            f = re.sub(r'\W', '', fmt)
+            if f[-1].isdigit():
+                return [ofs, fmt_size(f[:-1]), f[:-1]]
+            return [ofs, fmt_s, fmt]
+        else:
+            fmt_list = val(R_FMT).split(',')
+            if name_a[1] + 1 > len(fmt_list):
+                return None
+            sub_size = fmt_size(fmt_list[name_a[1]])
+            ofs = sum([fmt_size(x) for x in fmt_list[:name_a[1]]])
+            f = re.sub(r'\W', '', fmt_list[name_a[1]])
+            if f[-1].isdigit():
+                return [val(R_ADDR) + ofs, fmt_size(f[:-1]), f[:-1]]
+            return [val(R_ADDR) + ofs, sub_size, fmt_list[name_a[1]]]
+
+    if len(name_a) == 3 and val(R_FMT)[0] == '{':
+        ofs1 = val(R_ADDR) + fmt_s * name_a[1]
+        fmt_list = val(R_FMT).split(',')
+        if name_a[2] + 1 > len(fmt_list):
+            return None
+        sub_size = fmt_size(fmt_list[name_a[2]])
+        ofs2 = sum([fmt_size(x) for x in fmt_list[:name_a[2]]])
+        f = re.sub(r'\W', '', fmt_list[name_a[2]])
+        if f[-1].isdigit():
+            return [ofs1 + ofs2, fmt_size(f[:-1]), f[:-1]]
+        return [ofs1 + ofs2, sub_size, fmt_list[name_a[2]]]
+    return None
+
+
+def get_reg_ofs_len(cfg, name):
+    for name_a in split_indexes(name):
+        ret = _get_reg_ofs_len(cfg, name_a)
+        if ret:
+            return ret
+    return None
+
+
+def plot_fmt(cfg, idx):
+    # return: fmt, labels, e.g. 'H1.ffi', ['N', 'a', 'b', 'c']
+    p = cfg['plot']['plots'][idx]
+    items = []
+    for label in p['label'][1:]:
+        ret = get_reg_ofs_len(cfg, label)
+        if not ret:
+            logger.warning(f'plot label not found: {label}')
+            return None, None
+        if len(ret[2]) == 1:
+            ret.append(label)
+        else:
+            ret += [f'{label}[{x}]' for x in range(len(ret[2]))]
+        items.append(ret)
+
+    result = []
+    cur = list(items[0])
+    for nxt in items[1:]:
+        if cur[0] + cur[1] == nxt[0]: # merge continuous items
+            cur[1] += nxt[1]
+            cur[2] += nxt[2]
+            cur += nxt[3:]
+        else:
+            result.append(cur)
+            cur = list(nxt)
+    result.append(cur)
+
+    fmt = p['x_fmt'] + '.' + ''.join([x[2] for x in result])
+    labels = [p['label'][0]] + [l for x in result for l in x[3:]]
+    return fmt, labels
+
+
+def fmt_dtype(fmt):
+    # e.g. 'HfB2' -> struct dtype, a number after type is the field size
+    f = re.sub(r'[\W_]', '', fmt)
+    names, formats, offsets = [], [], []
+    ofs = 0
+    i = 0
+    while i < len(f):
+        if f[i] not in PLOT_DTYPE:
+            i += 1
+            continue
+        names.append(f'f{len(names)}')
+        formats.append(PLOT_DTYPE[f[i]])
+        offsets.append(ofs)
+        if i + 1 < len(f) and f[i+1].isdigit():
+            ofs += int(f[i+1])
+            i += 2
+        else:
+            ofs += np.dtype(PLOT_DTYPE[f[i]]).itemsize
+            i += 1
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': ofs})
+
+
+class PlotDec():
+    # decode dbg_raw frames into columns (x: float64, data: float32 or float64), x counter unwrapped
+
+    def __init__(self, fmt, labels):
+        self.fmt = fmt
+        self.labels = labels
+        x_fmt, grp_fmt = fmt.split('.', 1)
+        self.x_inc = int(x_fmt[1:]) if len(x_fmt) > 1 else None # None: x in each group
+        self.x_dt = np.dtype(PLOT_DTYPE[x_fmt[0]])
+        self.x_mod = 256 ** self.x_dt.itemsize
+        self.grp_dt = fmt_dtype(grp_fmt if self.x_inc != None else x_fmt[0] + grp_fmt)
+        d_names = self.grp_dt.names if self.x_inc != None else self.grp_dt.names[1:]
+        # float32 is exact for 8/16 bit integers and float
+        self.types = 'd' + ''.join(['f' if self.grp_dt[n].itemsize <= 2 or self.grp_dt[n] == np.float32 \
+                                    else 'd' for n in d_names])
+        self.clear()
+
+    def clear(self):
+        self.x_ofs = 0
+        self.last_x = None
+        self.pend = []  # decoded blocks, [[x, d1, d2, ...], ...]
+        self.cnt = 0    # total samples
+        self.hist = []  # recent blocks, at most PLOT_HIST samples
+        self.hist_cnt = 0
+
+    def feed(self, dat):
+        if self.x_inc != None: # x, d1,d2,d3, d1,d2,d3
+            hdr = self.x_dt.itemsize
+            num = max(len(dat) - hdr, 0) // self.grp_dt.itemsize
+            if not num:
+                return
+            cnt_start = int(np.frombuffer(dat, self.x_dt, 1)[0]) + self.x_ofs
+            if self.last_x and cnt_start <= self.last_x:
+                cnt_start += self.x_mod
+                self.x_ofs += self.x_mod
+            grps = np.frombuffer(dat, self.grp_dt, num, hdr)
+            x = cnt_start + self.x_inc * np.arange(num, dtype=np.float64)
+            names = self.grp_dt.names
+
+        else: # x,d1,d2,d3, x,d1,d2,d3
+            num = len(dat) // self.grp_dt.itemsize
+            if not num:
+                return
+            grps = np.frombuffer(dat, self.grp_dt, num)
+            raw = grps[self.grp_dt.names[0]].astype(np.int64)
+            wrap = np.empty(num, dtype=bool)
+            wrap[1:] = raw[1:] <= raw[:-1]
+            wrap[0] = bool(self.last_x) and raw[0] + self.x_ofs <= self.last_x
+            ofs = self.x_ofs + np.cumsum(wrap) * self.x_mod
+            x = (raw + ofs).astype(np.float64)
+            self.x_ofs = int(ofs[-1])
+            names = self.grp_dt.names[1:]
+
+        self.last_x = x[-1]
+        self.cnt += num
+        self.pend.append([x] + [grps[n].astype(np.float32 if t == 'f' else np.float64) \
+                                for n, t in zip(names, self.types[1:])])
+
+    def take(self):
+        # return one contiguous array per channel for all pending blocks
+        if not self.pend:
+            return None
+        cols = [np.concatenate(c) if len(c) > 1 else c[0] for c in zip(*self.pend)]
+        self.pend = []
+        self.hist.append(cols)
+        self.hist_cnt += len(cols[0])
+        while self.hist_cnt - len(self.hist[0][0]) >= PLOT_HIST:
+            self.hist_cnt -= len(self.hist.pop(0)[0])
+        return cols
+
+    def get_hist(self, x0=None, x1=None):
+        if not self.hist:
+            return None
+        cols = [np.concatenate(c) for c in zip(*self.hist)]
+        i0 = 0 if x0 == None else np.searchsorted(cols[0], x0, 'left')
+        i1 = len(cols[0]) if x1 == None else np.searchsorted(cols[0], x1, 'right')
+        return [c[i0:i1] for c in cols]
+
+
+def plot_decimate(sub, idx, cols):
+    # min/max decimate to sub['pps'][idx] points per second, the rest samples are kept for next time
+    # each bucket outputs two points: x: first, last; data: min, max
+    pps = sub['pps'].get(idx)
+    if not pps:
+        return cols
+    now = time.monotonic()
+    dt = now - sub['t'].get(idx, now - PLOT_FLUSH)
+    sub['t'][idx] = now
+    rem = sub['rem'].pop(idx, None)
+    if rem:
+        cols = [np.concatenate([a, b]) for a, b in zip(rem, cols)]
+    r = math.ceil(len(cols[0]) * 2 / max(pps * dt, 1))
+    if r <= 2:
+        return cols
+    num = len(cols[0]) // r * r
+    if num < len(cols[0]):
+        sub['rem'][idx] = [c[num:] for c in cols]
+    if not num:
+        return None
+    out = [cols[0][:num].reshape(-1, r)[:, [0, -1]].reshape(-1)]
+    for c in cols[1:]:
+        d = c[:num].reshape(-1, r)
+        out.append(np.stack([np.fmin.reduce(d, 1), np.fmax.reduce(d, 1)], 1).reshape(-1))
+    return out
+
+
+def plot_dev(dev, cfg_name):
+    # get or create plot decoders for a device
+    # csa['plot'][dev]: {
+    #   'cfg': cfg_name, 'decs': [PlotDec, ...],
+    #   'cals': [CalEngine, ...],   # vectorized cal channels for pages, None if not vectorizable
+    #   'subs': {path: sub},    # pages receive decoded columns
+    #                           # sub: {'port': port, 'pps': {idx: points per second}, 'rem': {}, 't': {}}
+    #   'hold': set()           # (consumer, idx), keep decoders alive and x continuous
+    #   'parsed': cfg           # rebuild after the config file changed
+    # }
+    p = csa['plot'].get(dev)
+    cfg = load_cfg(cfg_name)
+    if p and p['cfg'] == cfg_name and p['parsed'] is cfg:
+        return p
+    decs, cals = [], []
+    for idx in range(len(cfg['plot']['plots'])):
+        fmt, labels = plot_fmt(cfg, idx)
+        decs.append(PlotDec(fmt, labels) if fmt else None)
+        cals.append(cal_engine(cfg['plot']['plots'][idx]) if fmt else None)
+        logger.info(f'{dev}: plot{idx} fmt: {fmt}, labels: {labels}')
+    p = {'cfg': cfg_name, 'decs': decs, 'cals': cals,
+         'subs': p['subs'] if p else {}, 'hold': p['hold'] if p else set(), 'parsed': cfg}
+    csa['plot'][dev] = p
+    return p
+
+
+def plot_rx(src, dst_port, dat):
+    # rx hook, return True if frame consumed
+    if dst_port != PLOT_PORT:
+        return False
+    p = csa['plot'].get(src[0])
+    if not p:
+        return False
+    idx = src[1] & 0xf
+    if idx >= len(p['decs']) or not p['decs'][idx]:
+        return f'/{src[0]}' in p['subs'] # drop like plot.js
+    try:
+        p['decs'][idx].feed(dat)
+    except Exception as err:
+        logger.warning(f'plot_rx: {src}, err: {err}')
+    return True
+
+
+async def plot_flush_service():
+    while True:
+        await asyncio.sleep(PLOT_FLUSH)
+        for dev in list(csa['plot']):
+            p = csa['plot'][dev]
+            for idx, dec in enumerate(p['decs']):
+                cols = dec.take() if dec else None
+                if cols == None:
+                    continue
+                for sink in csa['plot_sinks']:
+                    try:
+                        sink(dev, idx, dec, cols)
+                    except Exception as err:
+                        logger.warning(f'plot sink {sink.__name__}: {dev}: {idx}, err: {err}')
+                cal_cols = []
+                if p['cals'][idx] and p['subs']:
+                    try:
+                        cal_cols = p['cals'][idx].feed(cols)
+                    except Exception as err:
+                        logger.warning(f'plot cal: {dev}: {idx}, err: {err}')
+                        p['cals'][idx] = None
+                for path, sub in list(p['subs'].items()):
+                    d_cols = plot_decimate(sub, idx, cols + cal_cols)
+                    if d_cols == None:
+                        continue
+                    dat = {'src': (dev, 0x40 | idx), 'idx': idx, 'types': dec.types + 'd' * len(cal_cols),
+                           'cols': [c.tobytes() for c in d_cols], 'cal': len(cal_cols)}
+                    ret = await csa['proxy'].sendto(dat, (path, sub['port']))
+                    if ret:
+                        logger.info(f'plot: {ret}, remove subscriber: {path}')
+                        del p['subs'][path]
+            if not p['subs'] and not p['hold']:
+                del csa['plot'][dev]
+
+
+async def plot_service():
+    sock = CDWebSocket(ws_ns, 'plot')
+    while True:
+        dat, src = await sock.recvfrom()
+        logger.debug(f'plot ser: {dat}')
+        path = src[0]
+        dev = path[1:]
+        if not isinstance(dat, dict) or 'action' not in dat:
+            await sock.sendto('err: plot: invalid request', src)
+            continue
+
+        if dat['action'] == 'decode': # push decoded columns to path:port instead of raw frames
+            try:
+                p = plot_dev(dev, dat['cfg'])
+                p['subs'][path] = {'port': dat['port'], 'pps': {}, 'rem': {}, 't': {}}
+                ws_ns.set_drop((path, dat['port']))
+                await sock.sendto([[d.labels, d.types] if d else None for d in p['decs']], src)
+            except Exception as err:
+                logger.error(f'plot decode error: {err}')
+                await sock.sendto(f'err: plot: {err}', src)
+
+        elif dat['action'] == 'clear':
+            try:
+                p = csa['plot'].get(dev)
+                held = p and any([h[1] == dat['idx'] for h in p['hold']])
+                if p and p['decs'][dat['idx']] and not held:
+                    p['decs'][dat['idx']].clear()
+                await sock.sendto('successed', src)
+            except Exception as err:
+                logger.error(f'plot clear error: {err}')
+                await sock.sendto(f'err: plot: {err}', src)
+
+        elif dat['action'] == 'rate': # {'idx', 'pps'}, pps: target points per second, 0: full rate
+            try:
+                p = csa['plot'].get(dev)
+                sub = p['subs'].get(path) if p else None
+                if sub:
+                    idx = int(dat['idx'])
+                    p['decs'][idx] # check range, used as key by the flush service
+                    pps = float(dat['pps'])
+                    if not pps >= 0:
+                        raise ValueError(f'invalid pps: {pps}')
+                    sub['pps'][idx] = pps
+                    sub['rem'].pop(idx, None)
+                    sub['t'].pop(idx, None)
+                await sock.sendto('successed' if sub else 'err: plot: not subscribed', src)
+            except Exception as err:
+                logger.error(f'plot rate error: {err}')
+                await sock.sendto(f'err: plot: {err}', src)
+
+        elif dat['action'] == 'get_raw': # {'idx', 'x0', 'x1', 'cal'}, recent full resolution data
+            try:                          # cal: append cal channels of current config, float64
+                p = csa['plot'].get(dev)
+                dec = p['decs'][dat['idx']] if p else None
+                cols = dec.get_hist(dat.get('x0'), dat.get('x1')) if dec else None
+                cal_cols = []
+                if cols and dat.get('cal'):
+                    cal = cal_engine(load_cfg(p['cfg'])['plot']['plots'][dat['idx']])
+                    cal_cols = cal.feed(cols) if cal else []
+                await sock.sendto({'idx': dat['idx'], 'types': dec.types + 'd' * len(cal_cols),
+                                   'cols': [c.tobytes() for c in cols + cal_cols], 'cal': len(cal_cols)} \
+                                  if cols else None, src)
+            except Exception as err:
+                logger.error(f'plot get_raw error: {err}')
+                await sock.sendto(f'err: plot: {err}', src)
+
+        elif dat['action'] == 'cal': # {'idx', 'cols'}, reload cal of config, calculate for float64 columns
+            try:
+                p = csa['plot'].get(dev)
+                cal = cal_engine(load_cfg(p['cfg'])['plot']['plots'][dat['idx']]) if p else None
+                if p:
+                    p['cals'][dat['idx']] = cal
+                cols = [np.frombuffer(c, np.float64) for c in dat['cols']]
+                await sock.sendto({'idx': dat['idx'], 'cols': [c.tobytes() for c in cal.feed(cols)]} \
+                                  if cal and cols else None, src)
+            except Exception as err:
+                logger.error(f'plot cal error: {err}')
+                await sock.sendto(f'err: plot: {err}', src)
+
+        else:
+            await sock.sendto('err: plot: unknown cmd', src)
+
+
+def plot_init(csa_):
+    global csa
+    csa = csa_
+    csa['plot'] = {}
+    csa['plot_sinks'] = [] # sink(dev, idx, dec, cols), called for each decoded block
+    csa['rx_hooks'].append(plot_rx)
+    ws_ns.set_drop((None, PLOT_PORT)) # raw plot frames
+    csa['async_loop'].create_task(plot_service())
+    csa['async_loop'].create_task(plot_flush_service())
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+#
+# Software License Agreement (MIT License)
+#
+# Author: Duke Fong <d@d-l.io>
+
+import os, re, math, json
+import ast
+import numpy as np
+from cdnet.utils.log import *
+
+CAL_CHUNK = 1000000     # max samples per calculation step of captures
+
+logger = logging.getLogger(f'cdgui.plot_cal')
+
+
+# vectorized form of plot "cal" channels, each expression returns a whole column:
+#   d[n]: channel n, same index as _d[n] of cal_fn in plot.js, the cal channels follow the data channels
+#   running functions keep state between blocks:
+#     iir(x, k): y += (x - y) * k, y starts from 0, e.g. the _f pattern: "iir(d[9], 0.02)"
+#     avg(x, n): average of last n samples
+#     prev(x, n=1): sample n steps before, diff(x): x - prev(x)
+# simple js expressions, e.g. "_d[1].at(-1) - _d[3].at(-1)", are translated automatically,
+# others need a vectorized version in the plot config: "cal_vec": { "name": "expression" }
+
+CAL_FUNCS = {
+    'abs': np.abs, 'sqrt': np.sqrt, 'exp': np.exp, 'log': np.log, 'log10': np.log10,
+    'sin': np.sin, 'cos': np.cos, 'tan': np.tan, 'atan': np.arctan, 'atan2': np.arctan2,
+    'min': np.minimum, 'max': np.maximum, 'clip': np.clip, 'where': np.where, 'floor': np.floor,
+    'pi': np.pi
+}
+CAL_RUNNING = ['iir', 'avg', 'prev', 'diff']
+
+CAL_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load,
+             ast.Subscript, ast.Constant, ast.operator, ast.unaryop, ast.cmpop) + \
+            ((ast.Index,) if hasattr(ast, 'Index') else ())
+
+
+def cal_check(tree):
+    # only allow arithmetic, d[n] and the cal functions
+    for node in ast.walk(tree):
+        if not isinstance(node, CAL_NODES):
+            raise ValueError(f'unsupported syntax: {type(node).__name__}')
+        if isinstance(node, ast.Name) and node.id != 'd' and node.id not in CAL_FUNCS \
+                and node.id not in CAL_RUNNING:
+            raise ValueError(f'unknown name: {node.id}')
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.keywords):
+            raise ValueError('unsupported call')
+        if isinstance(node, ast.Subscript) and (not isinstance(node.value, ast.Name) or node.value.id != 'd'):
+            raise ValueError('only d[n] is subscriptable')
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise ValueError(f'unsupported constant: {node.value!r}')
+
+
+def cal_expr(js, vec=None):
+    # return vectorized expression source, None if js expression can't be translated
+    if vec == None:
+        vec = re.sub(r'_d\[(\d+)\]\.at\(\s*-1\s*\)', r'd[\1]', js.strip())
+        if '_d' in vec or re.search(r'[;{}=]|\breturn\b|\blet\b|\bvar\b', vec):
+            return None
+    try:
+        cal_check(ast.parse(vec.strip(), mode='eval'))
+    except (SyntaxError, ValueError) as err:
+        logger.debug(f'cal_expr: {vec}: {err}')
+        return None
+    return vec.strip()
+
+
+def cal_exprs(plot_cfg):
+    # return [[name, expression], ...] of a plot config, None if any cal channel isn't vectorizable
+    cals = plot_cfg.get('cal') or {}
+    vecs = plot_cfg.get('cal_vec') or {}
+    ret = []
+    for name, js in cals.items():
+        src = cal_expr(js, vecs.get(name))
+        if src == None:
+            logger.info(f'cal channel "{name}" not vectorizable, add it to cal_vec')
+            return None
+        ret.append([name, src])
+    return ret
+
+
+class CalState():
+    # states of running functions of one expression, allocated by call order
+    def __init__(self):
+        self.slots = []
+        self.i = 0
+
+    def slot(self, init):
+        if self.i == len(self.slots):
+            self.slots.append(init)
+        self.i += 1
+        return self.slots[self.i - 1]
+
+
+def _iir(st, x, k):
+    # chunked closed form of y[n] = a * y[n-1] + k * x[n], a = 1 - k:
+    #   y[n] = a^n * (a * y[-1] + k * sum(x[j] / a^j)), chunk size keeps 1 / a^j under 1e4
+    s = st.slot([0.0])
+    x = np.asarray(x, np.float64)
+    y = np.empty_like(x)
+    a = 1.0 - k
+    if not 0 < a < 1:
+        prev = s[0]
+        for n in range(len(x)):
+            prev = a * prev + k * x[n]
+            y[n] = prev
+        s[0] = prev
+        return y
+    size = max(1, min(65536, int(4 * math.log(10) / -math.log(a))))
+    pows = a ** np.arange(size)
+    prev = s[0]
+    for c0 in range(0, len(x), size):
+        xc = x[c0:c0+size]
+        ap = pows[:len(xc)]
+        yc = ap * (a * prev + k * np.cumsum(xc / ap))
+        y[c0:c0+len(xc)] = yc
+        prev = yc[-1]
+    s[0] = prev
+    return y
+
+
+def _avg(st, x, n):
+    n = max(int(n), 1)
+    s = st.slot([np.full(n - 1, np.nan)])
+    xx = np.concatenate([s[0], np.asarray(x, np.float64)])
+    s[0] = xx[len(xx) - (n - 1):]
+    return np.lib.stride_tricks.sliding_window_view(xx, n).mean(1)
+
+
+def _prev(st, x, n=1):
+    n = max(int(n), 1)
+    s = st.slot([np.full(n, np.nan)])
+    xx = np.concatenate([s[0], np.asarray(x, np.float64)])
+    s[0] = xx[len(xx) - n:]
+    return xx[:len(xx) - n]
+
+
+def _diff(st, x):
+    return np.asarray(x, np.float64) - _prev(st, x)
+
+
+class CalEngine():
+    # evaluate cal channels block by block, running functions continue between blocks
+
+    def __init__(self, exprs):
+        self.exprs = exprs
+        self.codes = [compile(src, f'<cal {name}>', 'eval') for name, src in exprs]
+        self.states = [CalState() for _ in exprs]
+        self.nss = []
+        for st in self.states:
+            ns = dict(CAL_FUNCS)
+            ns['iir'] = lambda x, k, st=st: _iir(st, x, k)
+            ns['avg'] = lambda x, n, st=st: _avg(st, x, n)
+            ns['prev'] = lambda x, n=1, st=st: _prev(st, x, n)
+            ns['diff'] = lambda x, st=st: _diff(st, x)
+            self.nss.append(ns)
+
+    def feed(self, cols):
+        # cols: x and data channels, return cal channels (float64)
+        num = len(cols[0])
+        if not num:
+            return [np.empty(0) for _ in self.codes]
+        d = [np.asarray(c, np.float64) for c in cols]
+        ret = []
+        for code, st, ns in zip(self.codes, self.states, self.nss):
+            st.i = 0
+            with np.errstate(all='ignore'):
+                v = eval(code, {'__builtins__': {}}, {**ns, 'd': d})
+            v = np.array(np.broadcast_to(np.asarray(v, np.float64), (num,)))
+            d.append(v)
+            ret.append(v)
+        return ret
+
+
+def cal_engine(plot_cfg):
+    exprs = cal_exprs(plot_cfg)
+    return CalEngine(exprs) if exprs else None
+
+
+class RecCal():
+    # cal channels of a capture (RecStore), cached in cal{n}.bin (float64) and cal.json
+    # the engine stays in memory, so only new samples of a recording capture are calculated
+
+    def __init__(self, store, exprs):
+        self.s = store
+        self.exprs = exprs
+        self.eng = CalEngine(exprs)
+        self.cnt = 0
+        self.maps = None
+        try:
+            with open(os.path.join(self.s.path, 'cal.json')) as f:
+                meta = json.load(f)
+            if meta['exprs'] == exprs and all([self._size(n) == meta['cnt'] * 8 for n in range(len(exprs))]):
+                self.cnt = meta['cnt']
+        except (OSError, ValueError, KeyError):
+            pass
+        self.eng_cnt = 0 # samples fed to the engine, states of the cached part are not saved
+
+    def _name(self, n):
+        return os.path.join(self.s.path, f'cal{n}.bin')
+
+    def _size(self, n):
+        return os.path.getsize(self._name(n)) if os.path.exists(self._name(n)) else 0
+
+    def update(self):
+        if self.cnt == self.s.cnt:
+            return
+        if self.eng_cnt != self.cnt: # cache from last time, restart to rebuild the states
+            self.eng = CalEngine(self.exprs)
+            self.cnt = self.eng_cnt = 0
+        files = [open(self._name(n), 'ab' if self.cnt else 'wb') for n in range(len(self.exprs))]
+        src = self.s.cols()
+        while self.cnt < self.s.cnt:
+            i1 = min(self.s.cnt, self.cnt + CAL_CHUNK)
+            for f, c in zip(files, self.eng.feed([c[self.cnt:i1] for c in src])):
+                f.write(c.tobytes())
+            self.cnt = self.eng_cnt = i1
+        for f in files:
+            f.close()
+        self.maps = None
+        with open(os.path.join(self.s.path, 'cal.json'), 'w') as f:
+            json.dump({'exprs': self.exprs, 'cnt': self.cnt}, f)
+
+    def cols(self):
+        if self.maps == None:
+            self.maps = [np.memmap(self._name(n), '<f8', 'r', shape=(self.cnt,)) if self.cnt else np.empty(0) \
+                         for n in range(len(self.exprs))]
+        return self.maps
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+#
+# Software License Agreement (MIT License)
+#
+# Author: Duke Fong <d@d-l.io>
+
+import asyncio
+import collections
+import numpy as np
+from cd_ws import CDWebSocket
+from web_serve import ws_ns
+from cdnet.utils.log import *
+
+FFT_RATE = 5    # max spectra refresh rate (Hz)
+
+csa = None
+logger = logging.getLogger(f'cdgui.plot_fft')
+
+
+class PlotFft():
+    # streaming welch psd of all data channels, segment: size, hop: size / 2, average of last avg segments
+    # same window and scale as plot_fft.js: remove dc, window: 1 - cos(2 pi i / (N - 1)), |X|^2 / N^2 in dB
+
+    def __init__(self, size=4096, avg=1):
+        self.size = size
+        self.hop = size // 2
+        self.win = 1 - np.cos(2 * np.pi * np.arange(size) / (size - 1))
+        self.pwrs = collections.deque(maxlen=max(avg, 1))
+        self.buf = None     # samples from the start of next segment, shape: (channels, n)
+        self.updated = False
+
+    def feed(self, cols):
+        # every complete segment of the buffer, only the last avg ones, the older would be dropped anyway
+        d = np.stack([c.astype(np.float64) for c in cols])
+        self.buf = d if self.buf is None or self.buf.shape[0] != d.shape[0] else np.concatenate([self.buf, d], 1)
+        if self.buf.shape[1] < self.size:
+            return
+        num = (self.buf.shape[1] - self.size) // self.hop + 1
+        for k in range(max(num - self.pwrs.maxlen, 0), num):
+            seg = self.buf[:, k * self.hop:k * self.hop + self.size]
+            seg = seg - seg.mean(1, keepdims=True)
+            spec = np.fft.rfft(seg * self.win, axis=1)
+            self.pwrs.append((spec.real ** 2 + spec.imag ** 2) / (self.size * self.size))
+        self.buf = self.buf[:, num * self.hop:]
+        self.updated = True
+
+    def take(self):
+        # return spectra in dB (float32) of each channel if updated
+        if not self.updated:
+            return None
+        self.updated = False
+        pwr = np.mean(self.pwrs, 0) if len(self.pwrs) > 1 else self.pwrs[0]
+        return (10 * np.log10(np.maximum(pwr, 1e-24))).astype(np.float32)
+
+
+def fft_sink(dev, idx, dec, cols):
+    f = csa['plot_fft'].get((dev, idx))
+    if f:
+        f['fft'].feed(cols[1:])
+
+
+async def fft_pub_service():
+    while True:
+        await asyncio.sleep(1 / FFT_RATE)
+        for (dev, idx), f in list(csa['plot_fft'].items()):
+            mags = f['fft'].take()
+            if mags is None:
+                continue
+            dat = {'src': (dev, 0x40 | idx), 'idx': idx, 'fft': [m.tobytes() for m in mags]}
+            for path, port in list(f['subs'].items()):
+                ret = await csa['proxy'].sendto(dat, (path, port))
+                if ret:
+                    logger.info(f'fft: {ret}, remove subscriber: {path}')
+                    del f['subs'][path]
+            if not f['subs']:
+                del csa['plot_fft'][(dev, idx)]
+
+
+async def fft_service():
+    sock = CDWebSocket(ws_ns, 'fft')
+    while True:
+        dat, src = await sock.recvfrom()
+        logger.debug(f'fft ser: {dat}')
+        path = src[0]
+        dev = path[1:]
+        key = (dev, dat.get('idx'))
+
+        if dat['action'] == 'start': # {'idx', 'size', 'avg', 'port'}, spectra pushed to path:port
+            if dev not in csa['plot']:
+                await sock.sendto('err: fft: plot not decoded by server', src)
+                continue
+            f = csa['plot_fft'].get(key)
+            size, avg = dat.get('size', 4096), dat.get('avg', 1)
+            if not f or f['fft'].size != size or f['fft'].pwrs.maxlen != avg:
+                f = {'fft': PlotFft(size, avg), 'subs': f['subs'] if f else {}}
+                csa['plot_fft'][key] = f
+            f['subs'][path] = dat['port']
+            ws_ns.set_drop((path, dat['port']))
+            await sock.sendto('successed', src)
+
+        elif dat['action'] == 'stop': # {'idx'}
+            f = csa['plot_fft'].get(key)
+            if f:
+                f['subs'].pop(path, None)
+                if not f['subs']:
+                    del csa['plot_fft'][key]
+            await sock.sendto('successed', src)
+
+        else:
+            await sock.sendto('err: fft: unknown cmd', src)
+
+
+def plot_fft_init(csa_):
+    global csa
+    csa = csa_
+    csa['plot_fft'] = {}    # (dev, idx): {'fft': PlotFft, 'subs': {path: port}}
+    csa['plot_sinks'].append(fft_sink)
+    csa['async_loop'].create_task(fft_service())
+    csa['async_loop'].create_task(fft_pub_service())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+#
+# Software License Agreement (MIT License)
+#
+# Author: Duke Fong <d@d-l.io>
+
+import os, math
+import numpy as np
+
+LOD_FACTOR = 16     # samples per bucket of level 1, buckets per bucket of next levels
+LOD_CHUNK = 65536   # max buckets per build step, limit memory usage
+
+
+def _merge(pairs, r):
+    # merge every r [min, max] pairs into one, the rest keep unmerged
+    if r <= 1:
+        return pairs
+    num = len(pairs) // r * r
+    head = pairs[:num].reshape(-1, r, 2)
+    head = np.stack([np.fmin.reduce(head[:, :, 0], 1), np.fmax.reduce(head[:, :, 1], 1)], 1)
+    return np.concatenate([head, pairs[num:]])
+
+
+class RecLod():
+    # min/max pyramid of a RecStore, level k bucket covers LOD_FACTOR ** k samples
+    # level files: c{n}.l{k}.bin, [min, max] pairs in channel dtype, x channel: [first, last]
+
+    def __init__(self, store):
+        self.s = store
+        self.cnts = [None]  # buckets per level, index 0: raw samples (unused)
+        self.files = {}     # (n, k): file
+        self.maps = {}      # k: [memmap, ...]
+        k = 1
+        while os.path.exists(self._name(0, k)):
+            self.cnts.append(min([self._size(n, k) // (dt.itemsize * 2) for n, dt in enumerate(self.s.dtypes)]))
+            k += 1
+
+    def _name(self, n, k):
+        return os.path.join(self.s.path, f'c{n}.l{k}.bin')
+
+    def _size(self, n, k):
+        return os.path.getsize(self._name(n, k)) if os.path.exists(self._name(n, k)) else 0
+
+    def level(self, k):
+        # memmap of all channels of level k, shape: (cnt, 2)
+        if k not in self.maps or len(self.maps[k][0]) != self.cnts[k]:
+            self.maps[k] = [np.memmap(self._name(n, k), dt, 'r', shape=(self.cnts[k], 2)) \
+                            for n, dt in enumerate(self.s.dtypes)]
+        return self.maps[k]
+
+    def _write(self, k, outs):
+        for n, out in enumerate(outs):
+            if (n, k) not in self.files:
+                self.files[(n, k)] = open(self._name(n, k), 'ab')
+            self.files[(n, k)].write(out.tobytes())
+            self.files[(n, k)].flush()
+
+    def update(self):
+        # build new complete buckets of all levels after the store appended
+        F = LOD_FACTOR
+        k = 1
+        while True:
+            src_cnt = self.s.cnt if k == 1 else self.cnts[k-1]
+            if k >= len(self.cnts):
+                if src_cnt < F:
+                    break
+                self.cnts.append(0)
+            done = self.cnts[k]
+            avail = src_cnt // F
+            while done < avail:
+                b1 = min(avail, done + LOD_CHUNK)
+                a0, a1 = done * F, b1 * F
+                outs = []
+                if k == 1:
+                    for c in self.s.cols():
+                        d = np.asarray(c[a0:a1]).reshape(-1, F)
+                        outs.append(np.stack([np.fmin.reduce(d, 1), np.fmax.reduce(d, 1)], 1))
+                else:
+                    for m in self.level(k-1):
+                        d = np.asarray(m[a0:a1])
+                        outs.append(np.stack([np.fmin.reduce(d[:, 0].reshape(-1, F), 1),
+                                              np.fmax.reduce(d[:, 1].reshape(-1, F), 1)], 1))
+                self._write(k, outs)
+                done = b1
+                self.cnts[k] = done
+            k += 1
+
+    def view(self, i0, i1, width):
+        # about width points for samples [i0, i1), in bounded time:
+        # the coarsest level which still has width points, merged down to width,
+        # then lower levels and raw samples for the tail
+        F = LOD_FACTOR
+        width = max(width, 2)
+        k = 0
+        while k + 1 < len(self.cnts) and 2 * (i1 - i0) / F ** (k+1) >= width:
+            k += 1
+        if k == 0:
+            cols = [np.asarray(c[i0:i1]) for c in self.s.cols()]
+            if i1 - i0 <= width:
+                return 0, cols
+            return 0, [_merge(np.stack([c, c], 1), (i1 - i0) * 2 // width).reshape(-1) for c in cols]
+
+        outs = [[] for _ in self.s.dtypes]
+        pos = i0
+        for lv in range(k, 0, -1):
+            size = F ** lv
+            b0 = pos // size
+            b1 = min(math.ceil(i1 / size), self.cnts[lv])
+            if b1 > b0:
+                for n, m in enumerate(self.level(lv)):
+                    d = np.asarray(m[b0:b1])
+                    if lv == k:
+                        d = _merge(d, (b1 - b0) * 2 // width)
+                    outs[n].append(d.reshape(-1))
+                pos = b1 * size
+            if pos >= i1:
+                break
+        if pos < i1:
+            for n, c in enumerate(self.s.cols()):
+                outs[n].append(np.asarray(c[pos:i1]))
+        return k, [np.concatenate(o) if o else np.empty(0, dt) for o, dt in zip(outs, self.s.dtypes)]
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+#
+# Software License Agreement (MIT License)
+#
+# Author: Duke Fong <d@d-l.io>
+
+import os, json
+import asyncio
+import datetime
+import collections
+import concurrent.futures
+import numpy as np
+from cd_ws import CDWebSocket
+from web_serve import ws_ns
+from cdnet.utils.log import *
+from plugins.plot import plot_dev
+from cd_cfg import load_cfg
+from plugins.plot_cal import cal_exprs, RecCal
+from plugins.plot_lod import RecLod
+
+REC_DIR = 'records'
+REC_QUERY_MAX = 1000000 # max samples per query
+REC_OPEN_MAX = 8        # saved captures kept open for queries
+
+csa = None
+logger = logging.getLogger(f'cdgui.plot_rec')
+
+
+class RecStore():
+    # capture of one plot, one raw file per channel: c0.bin (x), c1.bin, ...
+    # append by file write, read by np.memmap, so the capture size is not limited by memory
+
+    def __init__(self, path, meta=None):
+        self.path = path
+        if meta:
+            os.makedirs(path)
+            with open(os.path.join(path, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+        else:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+        self.meta = meta
+        self.dtypes = [np.dtype('<f8' if t == 'd' else '<f4') for t in meta['types']]
+        self.cnt = min([self._size(n) // dt.itemsize for n, dt in enumerate(self.dtypes)])
+        self.files = None
+        self.maps = None
+        self.lod = RecLod(self)
+
+    def _name(self, n):
+        return os.path.join(self.path, f'c{n}.bin')
+
+    def _size(self, n):
+        return os.path.getsize(self._name(n)) if os.path.exists(self._name(n)) else 0
+
+    def append(self, cols):
+        if not self.files:
+            self.files = [open(self._name(n), 'ab') for n in range(len(self.dtypes))]
+        for f, c, dt in zip(self.files, cols, self.dtypes):
+            f.write(c.astype(dt, copy=False).tobytes())
+            f.flush()
+        self.cnt += len(cols[0])
+        self.lod.update()
+
+    def close(self):
+        for f in self.files or []:
+            f.close()
+        self.files = None
+        self.maps = None
+        self.lod.close()
+
+    def cols(self):
+        # memmap of all channels, remap after appended
+        if not self.maps or len(self.maps[0]) != self.cnt:
+            if self.cnt:
+                self.maps = [np.memmap(self._name(n), dt, 'r', shape=(self.cnt,)) for n, dt in enumerate(self.dtypes)]
+            else:
+                self.maps = [np.empty(0, dt) for dt in self.dtypes]
+        return self.maps
+
+    def x_range(self, x0=None, x1=None):
+        # x is monotonic, return sample index range [i0, i1)
+        x = self.cols()[0]
+        i0 = 0 if x0 == None else int(np.searchsorted(x, x0, 'left'))
+        i1 = self.cnt if x1 == None else int(np.searchsorted(x, x1, 'right'))
+        return i0, max(i0, i1)
+
+    def info(self):
+        x = self.cols()[0]
+        return {**self.meta, 'cnt': self.cnt, 'x0': float(x[0]) if self.cnt else None,
+                'x1': float(x[-1]) if self.cnt else None}
+
+
+def rec_dir(dev, idx):
+    d = dev.replace(':', '-')
+    if d in ['', '.', '..'] or os.path.basename(d) != d or '\\' in d:
+        raise ValueError(f'invalid dev: {dev}')
+    return os.path.join(REC_DIR, d, f'plot{int(idx)}')
+
+
+def rec_open(dev, idx, name):
+    # return recording store or saved capture, the last REC_OPEN_MAX saved captures are kept open
+    s = csa['plot_rec'].get((dev, idx))
+    if s and s.meta['name'] == name:
+        return s
+    path = os.path.join(rec_dir(dev, idx), os.path.basename(name))
+    s = csa['plot_rec_open'].pop(path, None) or RecStore(path)
+    csa['plot_rec_open'][path] = s
+    while len(csa['plot_rec_open']) > REC_OPEN_MAX:
+        old_path, old = csa['plot_rec_open'].popitem(last=False)
+        csa['plot_rec_cal'].pop(old_path, None)
+        csa['plot_rec_writer'].submit(old.close) # after a pending lod build of it
+    return s
+
+
+def rec_list(dev):
+    ret = []
+    for idx in range(16):
+        path = rec_dir(dev, idx)
+        if not os.path.isdir(path):
+            continue
+        for name in sorted(os.listdir(path)):
+            try:
+                info = rec_open(dev, idx, name).info()
+                info['recording'] = (dev, idx) in csa['plot_rec'] and \
+                                    csa['plot_rec'][(dev, idx)].meta['name'] == name
+                ret.append(info)
+            except Exception as err:
+                logger.warning(f'rec_list: {path}/{name}: {err}')
+    return ret
+
+
+async def rec_cal(s):
+    # cal channels of a capture by current config, cached until expressions changed
+    # the update runs in the writer thread, after pending appends of a recording capture
+    exprs = cal_exprs(load_cfg(s.meta['cfg'])['plot']['plots'][s.meta['idx']])
+    if not exprs:
+        return None
+    c = csa['plot_rec_cal'].get(s.path)
+    if not c or c.exprs != exprs:
+        c = RecCal(s, exprs)
+        csa['plot_rec_cal'][s.path] = c
+    await asyncio.get_running_loop().run_in_executor(csa['plot_rec_writer'], c.update)
+    return c
+
+
+def _rec_append(s, cols):
+    try:
+        s.append(cols)
+    except Exception as err:
+        logger.warning(f'rec: {s.path}: {err}')
+
+
+def _rec_close(s):
+    s.close()
+    logger.info(f'rec stop: {s.path}, samples: {s.cnt}')
+
+
+def _rec_lod(s):
+    s.lod.update() # build missing levels of saved capture
+    s.lod.close()  # level files are only read by memmap then
+
+
+def rec_sink(dev, idx, dec, cols):
+    # file writes and lod builds run in the writer thread, in order
+    s = csa['plot_rec'].get((dev, idx))
+    if s:
+        if s.meta['fmt'] != dec.fmt:
+            logger.warning(f'rec: {dev}: plot{idx} fmt changed, skip')
+            return
+        csa['plot_rec_writer'].submit(_rec_append, s, cols)
+
+
+def rec_stop(dev, idx):
+    s = csa['plot_rec'].pop((dev, idx), None)
+    if s:
+        csa['plot_rec_writer'].submit(_rec_close, s)
+    p = csa['plot'].get(dev)
+    if p:
+        p['hold'].discard(('rec', idx))
+
+
+async def rec_service():
+    sock = CDWebSocket(ws_ns, 'rec')
+    while True:
+        dat, src = await sock.recvfrom()
+        logger.debug(f'rec ser: {dat}')
+        dev = dat.get('dev', src[0][1:])
+
+        try:
+            if dat['action'] == 'start': # {'cfg': cfg_name, 'idx': [0, 1 ...]}
+                p = plot_dev(dev, dat['cfg'])
+                name = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+                ret = []
+                for idx in dat['idx']:
+                    dec = p['decs'][idx]
+                    if not dec:
+                        continue
+                    rec_stop(dev, idx)
+                    meta = {'name': name, 'dev': dev, 'idx': idx, 'cfg': dat['cfg'],
+                            'fmt': dec.fmt, 'labels': dec.labels, 'types': dec.types}
+                    csa['plot_rec'][(dev, idx)] = RecStore(os.path.join(rec_dir(dev, idx), name), meta)
+                    p['hold'].add(('rec', idx))
+                    logger.info(f'rec start: {dev}: plot{idx}: {name}')
+                    ret.append(idx)
+                await sock.sendto({'name': name, 'idx': ret}, src)
+
+            elif dat['action'] == 'stop': # {'idx': [0, 1 ...]}
+                for idx in dat['idx']:
+                    rec_stop(dev, idx)
+                await sock.sendto('successed', src)
+
+            elif dat['action'] == 'list':
+                await sock.sendto(rec_list(dev), src)
+
+            elif dat['action'] == 'query': # {'name', 'idx', 'x0', 'x1', 'limit'}, x0 / x1: None for no limit
+                s = rec_open(dev, dat['idx'], dat['name'])
+                i0, i1 = s.x_range(dat.get('x0'), dat.get('x1'))
+                i1 = min(i1, i0 + min(dat.get('limit', REC_QUERY_MAX), REC_QUERY_MAX))
+                cols = [c[i0:i1].tobytes() for c in s.cols()]
+                await sock.sendto({'idx': dat['idx'], 'types': s.meta['types'], 'cols': cols,
+                                   'i0': i0, 'cnt': s.cnt}, src)
+
+            elif dat['action'] == 'view': # {'name', 'idx', 'x0', 'x1', 'width'}, min/max decimated by lod
+                s = rec_open(dev, dat['idx'], dat['name'])
+                if (dev, dat['idx']) not in csa['plot_rec']: # may take seconds, keep the loop running
+                    await asyncio.get_running_loop().run_in_executor(csa['plot_rec_writer'], _rec_lod, s)
+                i0, i1 = s.x_range(dat.get('x0'), dat.get('x1'))
+                level, cols = s.lod.view(i0, i1, dat.get('width', 1000))
+                await sock.sendto({'idx': dat['idx'], 'types': s.meta['types'], 'cols': [c.tobytes() for c in cols],
+                                   'level': level, 'i0': i0, 'i1': i1, 'cnt': s.cnt}, src)
+
+            elif dat['action'] == 'cal': # {'name', 'idx', 'x0', 'x1', 'limit'}, like query, for cal channels
+                s = rec_open(dev, dat['idx'], dat['name'])
+                c = await rec_cal(s)
+                i0, i1 = s.x_range(dat.get('x0'), dat.get('x1'))
+                i1 = min(i1, c.cnt if c else i0, i0 + min(dat.get('limit', REC_QUERY_MAX), REC_QUERY_MAX))
+                await sock.sendto({'idx': dat['idx'], 'names': [e[0] for e in c.exprs] if c else [],
+                                   'cols': [m[i0:i1].tobytes() for m in c.cols()] if c else [],
+                                   'i0': i0, 'cnt': c.cnt if c else 0}, src)
+
+            else:
+                await sock.sendto('err: rec: unknown cmd', src)
+
+        except Exception as err:
+            logger.error(f'rec ser: {dat}, err: {err}')
+            await sock.sendto(f'err: rec: {err}', src)
+
+
+def plot_rec_init(csa_):
+    global csa
+    csa = csa_
+    csa['plot_rec'] = {}    # (dev, idx): RecStore, recording captures
+    csa['plot_rec_cal'] = {} # capture path: RecCal
+    csa['plot_rec_open'] = collections.OrderedDict() # capture path: RecStore, saved captures
+    csa['plot_rec_writer'] = concurrent.futures.ThreadPoolExecutor(1, 'plot_rec')
+    csa['plot_sinks'].append(rec_sink)
+    csa['async_loop'].create_task(rec_service())
@@ -0,0 +1,138 @@
+import struct
+import pytest
+from cdg_helper import RegCodec, RegMap, reg_layout, reg2str, str2reg, _reg2str, _str2reg
+
+
+# fmt, show, values packed by struct (None: raw bytes)
+REG_CASES = [
+    ('[B]', 0, '<B', [200]),
+    ('[B]', 1, '<B', [200]),
+    ('[B]', 2, '<B', [0xa5]),
+    ('[b]', 0, '<b', [-3]),
+    ('[H]', 1, '<H', [0x1234]),
+    ('[h]', 0, '<h', [-1234]),
+    ('[I]', 0, '<I', [0xdeadbeef]),
+    ('[i]', 1, '<i', [-2]),
+    ('[q]', 0, '<q', [-(1 << 40)]),
+    ('[Q]', 1, '<Q', [1 << 63]),
+    ('[f]', 0, '<f', [1.5]),
+    ('[f]', 1, '<f', [-0.125]),
+    ('[d]', 0, '<d', [3.25]),
+    ('[d]', 1, '<d', [1e-3]),
+    ('{H,B2}', 0, '<HBx', [500, 7]),
+    ('{f,f,f}', 0, '<fff', [0.5, -2.0, 100.0]),
+    ('{B2,H}', 1, '<BxH', [1, 0xbeef]),
+]
+
+
+@pytest.mark.parametrize('fmt, show, pack, vals', REG_CASES)
+def test_reg_codec_decode(fmt, show, pack, vals):
+    dat = b'\x55' + struct.pack(pack, *vals) + b'\x66'
+    c = RegCodec(fmt, show)
+    assert c.decode(dat, 1) == _reg2str(dat, 1, fmt, show)
+    assert reg2str(dat, 1, fmt, show) == _reg2str(dat, 1, fmt, show)
+
+
+@pytest.mark.parametrize('fmt, show, pack, vals', REG_CASES)
+def test_reg_codec_round_trip(fmt, show, pack, vals):
+    dat = b'\x55' + struct.pack(pack, *vals) + b'\x66'
+    s, _ = _reg2str(dat, 1, fmt, show)
+    blank = bytes(len(dat))
+    ret = str2reg(blank, 1, fmt, show, s, 0)
+    assert ret == _str2reg(blank, 1, fmt, show, s, 0)
+    assert ret[1:-1] == dat[1:-1]
+    assert reg2str(ret, 1, fmt, show) == (s, len(dat) - 1)
+
+
+def test_reg_codec_array():
+    fmt, show = '[H]', 0
+    dat = struct.pack('<4H', 1, 2, 65535, 40)
+    c = RegCodec(fmt, show)
+    ref, ofs = [], 0
+    for _ in range(4):
+        r, ofs = _reg2str(dat, ofs, fmt, show)
+        ref.append(r)
+    assert c.decode_all(dat, 0, 4) == ref
+    out = bytearray(8)
+    c.encode_all(out, 0, 4, ' '.join(ref))
+    # encode_all takes string item i for element i
+    assert bytes(out) == dat
+    with pytest.raises(struct.error):
+        c.decode_all(dat, 0, 5)
+
+
+def test_reg_codec_text():
+    fmt, show = '[c]', 0
+    dat = 'hi你'.encode() + bytes(3)
+    c = RegCodec(fmt, show)
+    assert c.decode_all(dat, 0, len(dat)) == ['hi你']
+    s = 'ab'
+    out = bytes(4)
+    for i in range(4):
+        ref = _str2reg(out, i, fmt, show, s, i)
+        out = str2reg(out, i, fmt, show, s, i)
+        assert out == ref
+    assert out == b'ab\x00\x00'
+
+
+def test_reg_codec_generic():
+    # field size less than type size, falls back to the legacy walkers
+    fmt, show = '{H1,B}', 0
+    dat = bytes([3, 4, 5])
+    c = RegCodec(fmt, show)
+    assert c.st == None
+    assert c.decode(dat, 0) == _reg2str(dat, 0, fmt, show)
+
+
+def reg_cfg(grps_r, grps_w=()):
+    return {
+        'list': [
+            [0x00, 2, '[H]', 1, 'a', ''],
+            [0x02, 2, '[H]', 1, 'b', ''],
+            [0x04, 4, '[f]', 0, 'c', ''],
+            [0x08, 4, '[I]', 0, 'd', ''],
+            [0x10, 1, '[B]', 0, 'e', ''],
+            [0x10, 1, '[B]', 0, 'e', 'duplicate'],
+        ],
+        'reg_r': list(grps_r),
+        'reg_w': list(grps_w)
+    }
+
+
+def grp_linear(layout, addr, rw):
+    # the scan RegMap replaced
+    for g in layout[rw]:
+        if g[0] <= addr < g[0] + g[1]:
+            return g[:2]
+    return None
+
+
+def test_reg_map_get():
+    m = RegMap(reg_cfg([['a', 'd']]))
+    assert m.get('e')[5] == '' # first one wins
+    assert m.get('x') == None
+    assert m.layout['regs']['c'][:4] == [0x04, 4, '[f]', 0]
+
+
+def test_reg_map_grp():
+    cfg = reg_cfg([['e'], ['a', 'b'], ['c', 'd']], [['d'], ['a']])
+    m = RegMap(cfg)
+    assert m.linear['r'] == None and m.linear['w'] == None
+    for rw in ['r', 'w']:
+        for addr in range(0x14):
+            assert m.grp(addr, rw) == grp_linear(m.layout, addr, rw)
+    assert m.grp(0x04) == [0x04, 8]
+    assert m.grp(0x0c) == None
+
+
+@pytest.mark.parametrize('grps, first', [
+    ([['a', 'd'], ['b', 'c']], [0x00, 12]),
+    ([['b', 'c'], ['a', 'd']], [0x02, 6]),
+])
+def test_reg_map_grp_overlap(grps, first):
+    # overlapping groups keep the config order
+    m = RegMap(reg_cfg(grps))
+    assert m.linear['r'] != None
+    assert m.grp(0x04) == first
+    for addr in range(0x14):
+        assert m.grp(addr) == grp_linear(reg_layout(reg_cfg(grps)), addr, 'r')
@@ -0,0 +1,46 @@
+import struct
+import numpy as np
+import pytest
+
+pytest.importorskip('cdnet')
+from plugins.plot import PlotDec
+
+
+def test_plot_dec_x_inc_wrap():
+    # x once per frame, increment 25 per group
+    dec = PlotDec('H25.hf', ['N', 'a', 'b'])
+    assert dec.types == 'dff'
+    dec.feed(struct.pack('<H', 65500) + struct.pack('<hf', -1, 0.5) + struct.pack('<hf', 2, 1.5))
+    dec.feed(struct.pack('<H', 14) + struct.pack('<hf', 3, 2.5))
+    dec.feed(struct.pack('<H', 39) + struct.pack('<hf', 4, 3.5) + b'\x00') # partial group dropped
+    cols = dec.take()
+    assert cols[0].tolist() == [65500, 65525, 65550, 65575]
+    assert cols[1].tolist() == [-1, 2, 3, 4]
+    assert cols[2].tolist() == [0.5, 1.5, 2.5, 3.5]
+    assert cols[1].dtype == np.float32
+    assert dec.take() == None
+
+
+def test_plot_dec_x_each_wrap():
+    # x in each group, wraps inside a frame and between frames
+    dec = PlotDec('B.I', ['N', 'a'])
+    assert dec.types == 'dd'
+    dec.feed(bytes().join([struct.pack('<BI', x, x * 10) for x in [250, 253, 0, 3, 255, 1]]))
+    dec.feed(struct.pack('<BI', 1, 7))
+    dec.feed(struct.pack('<BI', 9, 8))
+    cols = dec.take()
+    assert cols[0].tolist() == [250, 253, 256, 259, 511, 513, 769, 777]
+    assert cols[1].tolist() == [2500, 2530, 0, 30, 2550, 10, 7, 8]
+    assert cols[1].dtype == np.float64
+
+
+def test_plot_dec_hist():
+    dec = PlotDec('H1.f', ['N', 'a'])
+    for n in range(3):
+        dec.feed(struct.pack('<H', (65534 + n * 2) % 65536) + struct.pack('<ff', n, n + 0.5))
+        dec.take()
+    cols = dec.get_hist(65535, 65537)
+    assert cols[0].tolist() == [65535, 65536, 65537]
+    assert cols[1].tolist() == [0.5, 1, 1.5]
+    dec.clear()
+    assert dec.get_hist() == None
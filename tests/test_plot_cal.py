@@ -0,0 +1,77 @@
+import math
+import numpy as np
+import pytest
+
+pytest.importorskip('cdnet')
+from plugins.plot_cal import CalEngine, cal_expr, cal_exprs
+
+
+# per sample formulas of the js cal channels in configs/cdfoc-v7-sensorless.json
+
+def js_iir(x, k):
+    ret, f = [], 0
+    for v in x:
+        f += (v - f) * k
+        ret.append(f)
+    return ret
+
+
+def js_avg(x, n):
+    ret = []
+    for i in range(len(x)):
+        a = 0
+        for j in range(n):
+            a += x[i-j] if i - j >= 0 else math.nan # at() out of range: undefined
+        ret.append(a / n)
+    return ret
+
+
+def feed_blocks(eng, cols, sizes):
+    outs = []
+    i = 0
+    for size in sizes:
+        outs.append(eng.feed([c[i:i+size] for c in cols]))
+        i += size
+    return [np.concatenate(o) for o in zip(*outs)]
+
+
+@pytest.fixture
+def cols():
+    rng = np.random.default_rng(2)
+    num = 3000
+    return [np.arange(num, dtype=np.float64), rng.standard_normal(num).astype(np.float32),
+            (rng.standard_normal(num) * 100).astype(np.float32)]
+
+
+@pytest.mark.parametrize('k', [0.02, 0.5, 1.0])
+def test_cal_iir(cols, k):
+    eng = CalEngine([['f', f'iir(d[1], {k})']])
+    out = feed_blocks(eng, cols, [1, 10, 2000, 0, 989])[0]
+    assert np.allclose(out, js_iir(cols[1].astype(np.float64), k), rtol=1e-9, atol=1e-12)
+
+
+@pytest.mark.parametrize('n', [1, 5, 64])
+def test_cal_avg(cols, n):
+    eng = CalEngine([['a', f'avg(d[2], {n})']])
+    out = feed_blocks(eng, cols, [3, 1, 500, 2496])[0]
+    ref = js_avg(cols[2].astype(np.float64), n)
+    assert np.allclose(out, ref, equal_nan=True)
+    assert np.isnan(out[:n-1]).all()
+
+
+def test_cal_chain(cols):
+    # cal channels follow the data channels, later ones can use earlier ones
+    eng = CalEngine([['e', 'd[1] - d[2]'], ['f', 'iir(d[3], 0.02)'], ['a', 'avg(d[3], 5)']])
+    out = feed_blocks(eng, cols, [700, 700, 1600])
+    e = cols[1].astype(np.float64) - cols[2]
+    assert np.allclose(out[0], e)
+    assert np.allclose(out[1], js_iir(e, 0.02))
+    assert np.allclose(out[2], js_avg(e, 5), equal_nan=True)
+
+
+def test_cal_expr():
+    assert cal_expr('_d[1].at(-1) - _d[3].at(-1)') == 'd[1] - d[3]'
+    assert cal_expr('let a = 0; return a;') == None
+    assert cal_expr('whatever', 'avg(d[9], 5)') == 'avg(d[9], 5)'
+    assert cal_expr('', '__import__("os")') == None
+    assert cal_exprs({'cal': {'a': '_d[1].at(-1)', 'b': 'return 1;'}}) == None
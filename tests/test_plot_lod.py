@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from plugins.plot_lod import RecLod, LOD_FACTOR
+
+
+class Store():
+    # in-memory RecStore: path, dtypes, cnt and cols() are all RecLod uses
+    def __init__(self, path, cols):
+        self.path = path
+        self.dtypes = [c.dtype for c in cols]
+        self.all = cols
+        self.cnt = 0
+
+    def cols(self):
+        return [c[:self.cnt] for c in self.all]
+
+
+def lod_ref(c, k):
+    # min/max of each complete LOD_FACTOR ** k samples
+    size = LOD_FACTOR ** k
+    d = c[:len(c) // size * size].reshape(-1, size)
+    return np.stack([np.fmin.reduce(d, 1), np.fmax.reduce(d, 1)], 1)
+
+
+@pytest.fixture
+def cols():
+    rng = np.random.default_rng(1)
+    num = LOD_FACTOR ** 3 * 2 + 37
+    y = rng.standard_normal(num).astype(np.float32)
+    y[100:140] = np.nan # lost samples are skipped
+    return [np.arange(num, dtype=np.float64), y, rng.integers(-1000, 1000, num).astype(np.float64)]
+
+
+def check_levels(lod, cols):
+    assert len(lod.cnts) == 4
+    for k in range(1, 4):
+        for c, m in zip(cols, lod.level(k)):
+            ref = lod_ref(c, k)
+            assert m.shape == ref.shape
+            assert np.array_equal(m, ref, equal_nan=True)
+
+
+def test_lod_levels(tmp_path, cols):
+    s = Store(str(tmp_path), cols)
+    s.cnt = len(cols[0])
+    lod = RecLod(s)
+    lod.update()
+    check_levels(lod, cols)
+    lod.close()
+    # levels are loaded from files again
+    lod = RecLod(s)
+    assert lod.cnts == [None] + [len(cols[0]) // LOD_FACTOR ** k for k in range(1, 4)]
+    check_levels(lod, cols)
+
+
+def test_lod_update_incremental(tmp_path, cols):
+    s = Store(str(tmp_path), cols)
+    lod = RecLod(s)
+    for cnt in [5, 300, 4096, 4097, 8000, len(cols[0])]:
+        s.cnt = cnt
+        lod.update()
+    check_levels(lod, cols)
+    lod.close()
+
+
+def test_lod_view(tmp_path, cols):
+    s = Store(str(tmp_path), cols)
+    s.cnt = len(cols[0])
+    lod = RecLod(s)
+    lod.update()
+    for i0, i1, width in [(0, s.cnt, 200), (123, 7000, 300), (5000, 5100, 400), (3, 8000, 20)]:
+        k, out = lod.view(i0, i1, width)
+        if i1 - i0 <= width:
+            assert k == 0 and out[0].tolist() == cols[0][i0:i1].tolist()
+            continue
+        assert 0 < k and len(out[0]) <= width * 4
+        # buckets of level k at both ends may reach out of the range, the envelope keeps the extremes
+        size = LOD_FACTOR ** k
+        assert i0 - size < out[0][0] <= i0 and i1 - 1 <= out[0][-1] < i1 + size
+        for c, o in zip(cols, out):
+            assert np.nanmin(o) <= np.nanmin(c[i0:i1]) and np.nanmax(o) >= np.nanmax(c[i0:i1])
+            assert np.nanmin(o) >= np.nanmin(c[max(i0 - size, 0):i1 + size])
+            assert np.nanmax(o) <= np.nanmax(c[max(i0 - size, 0):i1 + size])
+    lod.close()
@@ -20,15 +20,23 @@ Args:
 
   --quiet   | -q
   --pretend | -p
+  --window  N       # max outstanding requests of pipelined transactions, default: 4,
+                    # each one takes a local port of 0x40 ~ 0x7f
 
   --reg REG_NAME    # read reg if not specify val
   --val REG_VAL
 
   --export MPK_FILE # only print when file path empty
   --import MPK_FILE
+
+  --jobs JOBS_FILE  # export / import multiple devices concurrently, --cfg and --dev are not used
+                    # json5 list: [{"dev": "00:00:01", "cfg": "CFG_FILE", "export" | "import": "MPK_FILE"}, ...]
+                    # jobs run by a pool of workers, each one takes --window local ports,
+                    # e.g. at most 15 jobs at once for window 4, the rest wait for a free worker
 """
 
-import os, sys, _thread
+import os, sys, _thread, threading, queue
+from time import sleep, time
 import json5
 import pprint
 import umsgpack
@@ -41,6 +49,10 @@ from cdnet.utils.cd_args import CdArgs
 from cdnet.dev.cdbus_serial import CDBusSerial
 from cdnet.dispatch import *
 
+PORT_MIN = 0x40     # local ports of request sockets, same range as the web server
+PORT_MAX = 0x7f
+port_next = PORT_MIN
+
 
 csa = {
     'args': None,
@@ -48,11 +60,16 @@ csa = {
     'dev_addr': None,
     'quiet': False,
     'pretend': False,
+    'window': 4,
 
     'logger': None,
-    'sock': None,
+    'sock': None,       # socks[0]
+    'socks': None,      # one socket per pipelined request, by alloc_socks
     
     'cfg': None,
+    'reg_map': None,    # RegMap of cfg
+    'jobs': None,       # device contexts of --jobs, a copy of csa with own dev_addr, cfg, regs ...
+    'job_socks': None,  # sockets of each job worker, set to sock and socks of the running job
 
     # reg_name(.n) : {
     #   fmt:
@@ -66,7 +83,7 @@ csa = {
 
 
 def cdg_cmd_init(doc=None):
-    global reg_name, reg_val, export_file, import_file, sock_dbg
+    global reg_name, reg_val, export_file, import_file, jobs_file, sock_dbg
 
     args = CdArgs()
     csa['args'] = args
@@ -78,15 +95,17 @@ def cdg_cmd_init(doc=None):
 
     csa['quiet'] = args.get("--quiet", "-q") != None
     csa['pretend'] = args.get("--pretend", "-p") != None
+    csa['window'] = max(int(args.get("--window", dft="4"), 0), 1)
 
     reg_name = args.get("--reg")
     reg_val = args.get("--val")         # string value
     export_file = args.get("--export")  # mpk file
     import_file = args.get("--import")
+    jobs_file = args.get("--jobs")
 
-    if args.get("--help", "-h") != None or cfg_file == None:
+    if args.get("--help", "-h") != None or (cfg_file == None and jobs_file == None):
         print(f'{doc}\n{__doc__}' if doc else __doc__)
-        exit(-1 if cfg_file == None else 0)
+        exit(-1 if cfg_file == None and jobs_file == None else 0)
 
     if args.get("--verbose", "-v") != None:
         logger_init(logging.VERBOSE)
@@ -100,18 +119,59 @@ def cdg_cmd_init(doc=None):
     dev = CDBusSerial(tty_str, baud=baud)
 
     CDNetIntf(dev, mac=local_mac)
-    csa['sock'] = CDNetSocket(('', 0x40))
+    if csa['window'] > PORT_MAX - PORT_MIN + 1:
+        print(f'--window: at most {PORT_MAX - PORT_MIN + 1}')
+        exit(-1)
+    csa['socks'] = alloc_socks(csa['window'])
+    csa['sock'] = csa['socks'][0]
     sock_dbg = CDNetSocket(('', 9))
+    _thread.start_new_thread(dbg_echo, ())
+
+    if jobs_file != None:
+        with open(jobs_file) as f:
+            jobs_init(json5.load(f))
+        return
 
     with open(cfg_file) as f:
         csa['cfg'] = json5.load(f)
-    _thread.start_new_thread(dbg_echo, ())
+    csa['reg_map'] = RegMap(csa['cfg']['reg'])
     list_all_reg()
 
     if not csa['quiet']:
         print('Device Info:', cd_read_info(csa['dev_addr']))
 
 
+def alloc_socks(n):
+    # sockets of n unused local ports
+    global port_next
+    if port_next + n - 1 > PORT_MAX:
+        raise Exception(f'out of local ports: 0x{PORT_MIN:02x} ~ 0x{PORT_MAX:02x}')
+    socks = [CDNetSocket(('', port_next + i)) for i in range(n)]
+    port_next += n
+    return socks
+
+
+def jobs_init(jobs):
+    # one context per device, configs shared by file name, workers reuse the socket ports
+    jobs_max = (PORT_MAX + 1 - port_next) // csa['window']
+    if not jobs_max:
+        print(f'no local ports for jobs, --window {csa["window"]} too large')
+        exit(-1)
+    csa['job_socks'] = [alloc_socks(csa['window']) for _ in range(min(len(jobs), jobs_max))]
+    cfgs = {}
+    csa['jobs'] = []
+    for i, job in enumerate(jobs):
+        if job['cfg'] not in cfgs:
+            with open(job['cfg']) as f:
+                cfg = json5.load(f)
+            ctx = {'cfg': cfg, 'reg_map': RegMap(cfg['reg']), 'regs': {}}
+            list_all_reg(ctx)
+            cfgs[job['cfg']] = ctx
+        ctx = {**csa, **cfgs[job['cfg']], 'job': job, 'dev_addr': job['dev'], 'jobs': None,
+               'job_socks': None, 'sock': None, 'socks': None}
+        csa['jobs'].append(ctx)
+
+
 def dbg_echo():
     while True:
         rx = sock_dbg.recvfrom()
@@ -119,41 +179,86 @@ def dbg_echo():
             csa['logger'].info(f'#{rx[1][0][-2:]}  \x1b[0;37m' + rx[0][:-1].decode() + '\x1b[0m')
 
 
-# for unicast only
-def cd_reg_rw(dev_addr, reg_addr, write=None, read=0, timeout=0.8, retry=3):
+# pipelined transactions for unicast, send up to window requests back to back, then collect the replies
+# each request of a batch is sent from its own local port, so a reply is matched to its request by port,
+# a lost frame only makes its own request resent, together with the next batch
+# rx_lens: expected reply length of each request, None for any,
+#          a status only reply (1 byte, error status) is returned as well, the caller checks the status
+# ctx: device context of --jobs, default: csa
+def cd_pipe(dev_addr, port, txs, rx_lens=None, window=None, timeout=0.8, retry=3, ctx=None):
+    ctx = ctx or csa
+    socks = ctx['socks'][:window or ctx['window']]
+    rets = [None] * len(txs)
+    todo = list(range(len(txs)))
+    tries = [0] * len(txs)
+    while todo:
+        batch = todo[:len(socks)]
+        for sock, i in zip(socks, batch):
+            sock.clear()
+            sock.sendto(txs[i], (dev_addr, port))
+        t_end = time() + timeout
+        for sock, i in zip(socks, batch):
+            while True:
+                dat, src = sock.recvfrom(timeout=max(t_end - time(), 0.01))
+                if src and (src[0] != dev_addr or src[1] != port):
+                    if not ctx['quiet']:
+                        ctx['logger'].warning(f'cd_pipe recv wrong src: {src}')
+                    continue
+                if src and (not rx_lens or rx_lens[i] == None or len(dat) == rx_lens[i] or \
+                            (len(dat) == 1 and dat[0] & 0xf)):
+                    rets[i] = dat
+                elif src and not ctx['quiet']:
+                    ctx['logger'].warning(f'cd_pipe bad reply, dev: {dev_addr}, port: {port}, req: {i}: {dat.hex()}')
+                break
+        todo = [i for i in todo if rets[i] == None]
+        lost = [i for i in batch if rets[i] == None]
+        if not lost:
+            continue
+        for i in lost:
+            tries[i] += 1
+        if not ctx['quiet']:
+            ctx['logger'].warning(f'cd_pipe no reply, dev: {dev_addr}, port: {port}, ' \
+                                  f'req: {lost} of {len(txs)}, retry: {max(tries)}')
+        if max(tries) >= retry:
+            raise Exception('reg_rw retry error')
+        sleep(0.05) # drop late replies of this batch
+    return rets
+
+
+def reg_rw_tx(reg_addr, write=None, read=0):
     if write != None:
-        tx_dat = b'\x20'+struct.pack("<H", reg_addr) + write
-    else:
-        tx_dat = b'\x00'+struct.pack("<H", reg_addr) + struct.pack("<B", read)
-    for cnt in range(retry):
-        csa['sock'].clear()
-        csa['sock'].sendto(tx_dat, (dev_addr, 0x5))
-        dat, src = csa['sock'].recvfrom(timeout=timeout)
-        if src:
-            if src[0] == dev_addr and src[1] == 0x5:
-                return dat
-            if not csa['quiet']:
-                csa['logger'].warning(f'cd_reg_rw recv wrong src')
-        elif not csa['quiet']:
-            csa['logger'].warning(f'cd_reg_rw timeout, dev: {dev_addr}')
-    raise Exception('reg_rw retry error')
-    #return None
-
-
-def cd_read_info(dev_addr, timeout=0.8):
-    csa['sock'].clear()
-    csa['sock'].sendto(b'', (dev_addr, 0x1))
-    dat, src = csa['sock'].recvfrom(timeout=timeout)
+        return b'\x20'+struct.pack("<H", reg_addr) + write
+    return b'\x00'+struct.pack("<H", reg_addr) + struct.pack("<B", read)
+
+
+# for unicast only
+def cd_reg_rw(dev_addr, reg_addr, write=None, read=0, timeout=0.8, retry=3, ctx=None):
+    return cd_pipe(dev_addr, 0x5, [reg_rw_tx(reg_addr, write, read)], None, 1, timeout, retry, ctx)[0]
+
+
+# reqs: [[reg_addr, write, read], ...], return replies in order
+def cd_reg_rw_multi(dev_addr, reqs, timeout=0.8, retry=3, ctx=None):
+    txs = [reg_rw_tx(*r) for r in reqs]
+    rx_lens = [None if r[1] != None else r[2] + 1 for r in reqs]
+    return cd_pipe(dev_addr, 0x5, txs, rx_lens, None, timeout, retry, ctx)
+
+
+def cd_read_info(dev_addr, timeout=0.8, ctx=None):
+    ctx = ctx or csa
+    ctx['sock'].clear()
+    ctx['sock'].sendto(b'', (dev_addr, 0x1))
+    dat, src = ctx['sock'].recvfrom(timeout=timeout)
     if src:
         return dat.decode()
-    csa['logger'].warning('read info error')
+    ctx['logger'].warning(f'read info error, dev: {dev_addr}')
     return 'error'
 
 
 
-def list_all_reg():
-    for i in range(len(csa['cfg']['reg']['list'])):
-        r = csa['cfg']['reg']['list'][i]
+def list_all_reg(ctx=None):
+    ctx = ctx or csa
+    for i in range(len(ctx['cfg']['reg']['list'])):
+        r = ctx['cfg']['reg']['list'][i]
         #print(r)
         fmt = r[2]
         show = r[3]
@@ -164,7 +269,7 @@ def list_all_reg():
         fmt_len = fmt_size(fmt)
         if top_len == fmt_len or fmt.startswith('['):
             #print(top_name)
-            csa['regs'][top_name] = {
+            ctx['regs'][top_name] = {
                 'fmt': fmt,
                 'show': show,
                 'addr': top_addr,
@@ -175,7 +280,7 @@ def list_all_reg():
             num = int(top_len / fmt_len)
             for n in range(num):
                 #print(f'{top_name}.{n}')
-                csa['regs'][f'{top_name}.{n}'] = {
+                ctx['regs'][f'{top_name}.{n}'] = {
                     'fmt': fmt,
                     'show': show,
                     'addr': top_addr + fmt_len * n,
@@ -187,81 +292,186 @@ def list_all_reg():
 
 
 
-def get_reg_info(name):
-    for i in range(len(csa['cfg']['reg']['list'])):
-        r = csa['cfg']['reg']['list'][i]
-        if r[4] == name:
-            return r
-    return None
+def get_reg_info(name, ctx=None):
+    return (ctx or csa)['reg_map'].get(name)
 
 
-def get_rw_grp(name, rw='r'):
-    if name not in csa['regs']:
+def get_rw_grp(name, rw='r', ctx=None):
+    ctx = ctx or csa
+    if name not in ctx['regs']:
         return None
-    grps = csa['cfg']['reg'][f'reg_{rw}']
-    addr_len_list = []
-    for i in range(len(grps)):
-        g = grps[i]
-        assert(len(g) == 1 or len(g) == 2)
-        if len(g) == 2:
-            r0 = get_reg_info(g[0])
-            r1 = get_reg_info(g[1])
-            addr_len_list.append([r0[0], r1[0] + r1[1] - r0[0]])
-        elif len(g) == 1:
-            r0 = get_reg_info(g[0])
-            addr_len_list.append([r0[0], r0[1]])
-    for i in range(len(addr_len_list)):
-        if csa['regs'][name]['addr'] >= addr_len_list[i][0] and \
-           csa['regs'][name]['addr'] < addr_len_list[i][0] + addr_len_list[i][1]:
-            return addr_len_list[i]
-    return None
-
-
-def read_reg(name):
-    reg = csa['regs'][name]
-    grp = get_rw_grp(name, 'r')
+    return ctx['reg_map'].grp(ctx['regs'][name]['addr'], rw)
+
+
+# return snap: {grp addr: reply} of the read groups of names, read by one pipelined transaction
+def read_grps(names, ctx=None):
+    ctx = ctx or csa
+    grps = {}
+    for name in names:
+        grp = get_rw_grp(name, 'r', ctx)
+        if grp:
+            grps[grp[0]] = grp
+    grps = sorted(grps.values())
+    rets = cd_reg_rw_multi(ctx['dev_addr'], [[g[0], None, g[1]] for g in grps], ctx=ctx)
+    return {g[0]: r for g, r in zip(grps, rets)}
+
+
+# snap: {grp addr: reply}, read each group only once, e.g. for export
+def read_reg(name, snap=None, ctx=None):
+    ctx = ctx or csa
+    reg = ctx['regs'][name]
+    grp = get_rw_grp(name, 'r', ctx)
     if not grp or not reg:
-        if not csa['quiet']:
+        if not ctx['quiet']:
             print(f'reg: {name} read disabled')
         exit(-1)
-    dat = cd_reg_rw(csa['dev_addr'], grp[0], read=grp[1])
+    if snap != None and grp[0] in snap:
+        dat = snap[grp[0]]
+    else:
+        dat = cd_reg_rw(ctx['dev_addr'], grp[0], read=grp[1], ctx=ctx)
+        if snap != None:
+            snap[grp[0]] = dat
+    if dat[0] & 0xf:
+        raise Exception(f'reg: {name} read error: {dat.hex()}')
+    codec = reg_codec(reg['fmt'], reg['show'])
     if reg['fmt'].startswith('['):
-        ret = []
         join = '' if reg['fmt'][1] == 'c' and reg['show'] == 0 else ' '
-        fmt_len = fmt_size(reg['fmt'])
-        i = 0
-        while i < round(reg['len']/fmt_len):
-            cur_ofs = reg['addr'] - grp[0] + fmt_len * i
-            r_, ofs = reg2str(dat[1:], reg['addr'] - grp[0] + fmt_len * i, reg['fmt'], reg['show'])
-            ret.append(r_)
-            i += round((ofs - cur_ofs) / fmt_len);
-        return join.join(ret)
-    return reg2str(dat[1:], reg['addr'] - grp[0], reg['fmt'], reg['show'])[0]
-
-
-def write_reg(name, str_):
-    reg = csa['regs'][name]
-    grp = get_rw_grp(name, 'w')
+        return join.join(codec.decode_all(dat[1:], reg['addr'] - grp[0], round(reg['len']/codec.size)))
+    return codec.decode(dat[1:], reg['addr'] - grp[0])[0]
+
+
+def write_reg(name, str_, ctx=None):
+    ctx = ctx or csa
+    reg = ctx['regs'][name]
+    grp = get_rw_grp(name, 'w', ctx)
     if not grp or not reg:
-        if not csa['quiet']:
+        if not ctx['quiet']:
             print(f'reg: {name} write disabled')
         exit(-1)
-    dat = cd_reg_rw(csa['dev_addr'], grp[0], read=grp[1])
-    dat = dat[1:]
+    dat = cd_reg_rw(ctx['dev_addr'], grp[0], read=grp[1], ctx=ctx)
+    if dat[0] & 0xf:
+        raise Exception(f'reg: {name} read error: {dat.hex()}')
+    dat = bytearray(dat[1:])
+    codec = reg_codec(reg['fmt'], reg['show'])
     if reg['fmt'].startswith('['):
-        ret = []
-        fmt_len = fmt_size(reg['fmt'])
-        for i in range(round(reg['len']/fmt_len)):
-            dat = str2reg(dat, reg['addr'] - grp[0] + fmt_len * i, reg['fmt'], reg['show'], str_, i)
+        codec.encode_all(dat, reg['addr'] - grp[0], round(reg['len']/codec.size), str_)
     else:
-        dat = str2reg(dat, reg['addr'] - grp[0], reg['fmt'], reg['show'], str_, 0)
-    cd_reg_rw(csa['dev_addr'], grp[0], write=dat)
+        codec.encode(dat, reg['addr'] - grp[0], str_, 0)
+    dat = cd_reg_rw(ctx['dev_addr'], grp[0], write=bytes(dat), ctx=ctx)
+    if dat[0] & 0xf:
+        raise Exception(f'reg: {name} write error: {dat.hex()}')
+
+
+
+def export_regs(export_file, ctx=None):
+    ctx = ctx or csa
+    pre = f'{ctx["dev_addr"]}: ' if ctx is not csa else ''
+    reg_str = {}
+    snap = read_grps(ctx['regs'], ctx)
+    for name in ctx['regs']:
+        if get_rw_grp(name, 'r', ctx) != None:
+            reg_str[name] = read_reg(name, snap, ctx)
+    if not ctx['quiet']:
+        print(f'{pre}read {len(reg_str)} regs by {len(snap)} group reads')
+    if not ctx['quiet'] and not pre:
+        pprint.pp(reg_str)
+    out_data = umsgpack.packb({'version': 'cdgui v1', 'reg': reg_str})
+    if export_file:
+        with open(export_file, 'wb') as f:
+            f.write(out_data)
+    return len(reg_str)
+
+
+def import_regs(import_file, ctx=None):
+    ctx = ctx or csa
+    pre = f'{ctx["dev_addr"]}: ' if ctx is not csa else ''
+    quiet = ctx['quiet']
+    with open(import_file, 'rb') as f:
+        in_file = f.read()
+    in_data = umsgpack.unpackb(in_file)
+    snap = read_grps([name for name in in_data['reg'] if name in ctx['regs']], ctx)
+    w_cnt = 0
+    for name in in_data['reg']:
+        val = in_data['reg'][name]
+        if not quiet:
+            print(f'{pre}  {name}: {val}')
+        if get_rw_grp(name, 'w', ctx) != None:
+            if get_rw_grp(name, 'r', ctx) != None:
+                ori = read_reg(name, snap, ctx)
+                if ori != val:
+                    if not quiet:
+                        print(f'{pre}    + write: {ori} -> {val}')
+                    if not ctx['pretend']:
+                        write_reg(name, val, ctx)
+                        w_cnt += 1
+            else:
+                if not quiet:
+                    print(f'{pre}    + write only: {val}')
+                if not ctx['pretend']:
+                    write_reg(name, val, ctx)
+                    w_cnt += 1
+        else:
+            if get_rw_grp(name, 'r', ctx) != None:
+                ori = read_reg(name, snap, ctx)
+                if ori != val and not quiet:
+                    print(f'{pre}    - write disabled: current: {ori}')
+            elif not quiet:
+                print(f'{pre}    - write & read disabled')
+    return w_cnt
+
+
+def run_job(ctx):
+    job = ctx['job']
+    t = time()
+    ctx['result'] = 'error: aborted' # e.g. exit() of a disabled reg
+    try:
+        ctx['info'] = cd_read_info(ctx['dev_addr'], ctx=ctx)
+        if 'export' in job:
+            ctx['result'] = f'exported {export_regs(job["export"], ctx)} regs'
+        else:
+            ctx['result'] = f'imported, {import_regs(job["import"], ctx)} writes'
+    except Exception as err:
+        ctx['result'] = f'error: {err}'
+    finally:
+        ctx['time'] = time() - t
+
 
+def job_worker(socks, todo):
+    while True:
+        try:
+            ctx = todo.get_nowait()
+        except queue.Empty:
+            return
+        ctx['sock'], ctx['socks'] = socks[0], socks
+        try:
+            run_job(ctx)
+        except SystemExit:
+            pass # result stays 'error: aborted', the worker goes on with next job
+
+
+def run_jobs():
+    # devices run in parallel worker threads, transactions interleave on the bus
+    t = time()
+    todo = queue.Queue()
+    for ctx in csa['jobs']:
+        todo.put(ctx)
+    threads = [threading.Thread(target=job_worker, args=(socks, todo)) for socks in csa['job_socks']]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    print(f'\n{len(csa["jobs"])} devices, total: {time() - t:.2f}s')
+    for ctx in csa['jobs']:
+        print(f'  {ctx["dev_addr"]}: {ctx["job"]["cfg"]}: {ctx["result"]}, {ctx["time"]:.2f}s, info: {ctx.get("info")}')
+    return all([not ctx['result'].startswith('error') for ctx in csa['jobs']])
 
 
 if __name__ == "__main__":
     cdg_cmd_init()
 
+    if jobs_file != None:
+        exit(0 if run_jobs() else -1)
+
     if reg_name != None:
         if reg_val == None:
             print(read_reg(reg_name))
@@ -269,43 +479,8 @@ if __name__ == "__main__":
             write_reg(reg_name, reg_val)
 
     elif export_file != None:
-        reg_str = {}
-        for name in csa['regs']:
-            if get_rw_grp(name, 'r') != None:
-                reg_str[name] = read_reg(name)
-        if not csa['quiet']:
-            pprint.pp(reg_str)
-        out_data = umsgpack.packb({'version': 'cdgui v1', 'reg': reg_str})
-        if export_file:
-            with open(export_file, 'wb') as f:
-                f.write(out_data)
+        export_regs(export_file)
 
     elif import_file != None:
-        with open(import_file, 'rb') as f:
-            in_file = f.read()
-        in_data = umsgpack.unpackb(in_file)
-        for name in in_data['reg']:
-            val = in_data['reg'][name]
-            if not csa['quiet']:
-                print(f'  {name}: {val}')
-            if get_rw_grp(name, 'w') != None:
-                if get_rw_grp(name, 'r') != None:
-                    ori = read_reg(name)
-                    if ori != val:
-                        if not csa['quiet']:
-                            print(f'    + write: {ori} -> {val}')
-                        if not csa['pretend']:
-                            write_reg(name, val)
-                else:
-                    if not csa['quiet']:
-                        print(f'    + write only: {val}')
-                    if not csa['pretend']:
-                        write_reg(name, val)
-            else:
-                if get_rw_grp(name, 'r') != None:
-                    ori = read_reg(name)
-                    if ori != val and not csa['quiet']:
-                        print(f'    - write disabled: current: {ori}')
-                elif not csa['quiet']:
-                    print(f'    - write & read disabled')
+        import_regs(import_file)
 
@@ -5,6 +5,7 @@
 # Author: Duke Fong <d@d-l.io>
 
 import re, struct, math
+import functools, bisect
 
 
 def readable_float(num, double=False):
@@ -78,29 +79,201 @@ def val2hex(val, fixed=4, prefix=False, upper=False, float_=False):
     return sign + str_
 
 
-def fmt_size(fmt):
+# type: struct code, size, hex digits
+REG_TYPES = {
+    'c': ('b', 1, 2), 'b': ('b', 1, 2), 'B': ('B', 1, 2), 'h': ('h', 2, 4), 'H': ('H', 2, 4),
+    'i': ('i', 4, 8), 'I': ('I', 4, 8), 'q': ('q', 8, 16), 'Q': ('Q', 8, 16), 'f': ('f', 4, 8), 'd': ('d', 8, 16)
+}
+
+
+@functools.lru_cache(maxsize=None)
+def fmt_fields(fmt):
+    # e.g. '{H,B2}' -> (('H', 2), ('B', 2)), a number after type is the field size
     f = re.sub(r'[\W_]', '', fmt) # remove non-word chars
-    len_ = 0;
+    ret = []
     i = 0
     while i < len(f):
         fnext = f[i+1] if i < len(f) - 1 else ''
-        if fnext.isdigit(): # e.g. '{H,B2}'
-            len_ += int(fnext)
+        if fnext.isdigit():
+            ret.append((f[i], int(fnext)))
             i += 2
             continue
-        if f[i] == 'c' or f[i] == 'b' or f[i] == 'B':
-            len_ += 1
-        elif f[i] == 'h' or f[i] == 'H':
-            len_ += 2
-        elif f[i] == 'i' or f[i] == 'I' or f[i] == 'f':
-            len_ += 4
-        elif f[i] == 'q' or f[i] == 'Q' or f[i] == 'd':
-            len_ += 8
+        if f[i] in REG_TYPES:
+            ret.append((f[i], REG_TYPES[f[i]][1]))
         i += 1
-    return len_;
+    return tuple(ret)
+
+
+@functools.lru_cache(maxsize=None)
+def fmt_size(fmt):
+    return sum([n for _, n in fmt_fields(fmt)])
+
+
+class RegCodec():
+    # compiled reg2str / str2reg of a fmt and show pair, get by reg_codec()
+    # irregular fmts (unknown type, field size less than type size, text mixed with numbers) use the generic version
+
+    def __init__(self, fmt, show):
+        self.fmt = fmt
+        self.show = show
+        self.fields = fmt_fields(fmt)
+        self.size = sum([n for _, n in self.fields])
+        self.text = show != 1 and self.fields == (('c', 1),) # utf-8 string
+        known = all([t in REG_TYPES for t, _ in self.fields])
+        self.st = None
+        if known and (show == 1 or 'c' not in [t for t, _ in self.fields]) and \
+                all([n >= REG_TYPES[t][1] for t, n in self.fields]):
+            self.st = struct.Struct('<' + ''.join([REG_TYPES[t][0] + 'x' * (n - REG_TYPES[t][1]) \
+                                                   for t, n in self.fields]))
+            self.strs = [self._str_fn(t) for t, _ in self.fields]
+        self.packs = None
+        if known:
+            ofs = 0
+            self.packs = []
+            for t, n in self.fields:
+                self.packs.append((t, ofs, struct.Struct('<' + REG_TYPES[t][0]), self._val_fn(t)))
+                ofs += n
+
+    def _str_fn(self, t):
+        code, _, digits = REG_TYPES[t]
+        if self.show == 1:
+            return (lambda v: val2hex(v, digits, True, False, True)) if t in 'fd' else (lambda v: val2hex(v, digits, True))
+        if t == 'B' and self.show == 2:
+            return lambda v: f'{v:02x}'
+        if t == 'f':
+            return readable_float
+        if t == 'd':
+            return lambda v: readable_float(v, True)
+        return str
+
+    def _val_fn(self, t):
+        if t in 'fd':
+            return hex2float if self.show == 1 else float
+        return lambda s: int(s, 0)
+
+    def decode(self, dat, ofs):
+        # same as reg2str
+        if not self.st:
+            return _reg2str(dat, ofs, self.fmt, self.show)
+        vals = self.st.unpack(dat[ofs:ofs+self.size])
+        return ' '.join([f(v) for f, v in zip(self.strs, vals)]), ofs + self.size
+
+    def decode_all(self, dat, ofs, num):
+        # decode an array register, return strings of num elements, or [str] for text
+        if self.st:
+            d = dat[ofs:ofs+self.size*num]
+            if len(d) != self.size * num:
+                raise struct.error(f'reg data too short: {len(d)} < {self.size * num}')
+            return [' '.join([f(v) for f, v in zip(self.strs, vals)]) for vals in self.st.iter_unpack(d)]
+        if self.text:
+            try:
+                return [bytes(dat[ofs:ofs+num]).replace(b'\x00', b'').decode()]
+            except UnicodeDecodeError:
+                pass
+        ret = []
+        i = 0
+        while i < num:
+            cur_ofs = ofs + self.size * i
+            r_, ofs_ = _reg2str(dat, cur_ofs, self.fmt, self.show)
+            ret.append(r_)
+            i += round((ofs_ - cur_ofs) / self.size)
+        return ret
+
+    def encode(self, dat, ofs, str_, s_idx):
+        # same as str2reg, but modify bytearray dat in place
+        if self.packs == None:
+            dat[:] = _str2reg(dat, ofs, self.fmt, self.show, str_, s_idx)
+            return
+        str_a = str_.split(' ')
+        for t, f_ofs, st, val in self.packs:
+            o = ofs + f_ofs
+            if t == 'c' and self.show != 1:
+                str_b = str_.encode()
+                dat[o:o+1] = bytes([str_b[s_idx]]) if s_idx < len(str_b) else b'\x00'
+            elif t == 'B' and self.show == 2:
+                dat[o:o+1] = hex2dat(str_a[s_idx])[0:1]
+            else:
+                dat[o:o+st.size] = st.pack(val(str_a[s_idx]))
+            s_idx += 1
+
+    def encode_all(self, dat, ofs, num, str_):
+        # array register, element i takes string item i
+        for i in range(num):
+            self.encode(dat, ofs + self.size * i, str_, i)
+
+
+@functools.lru_cache(maxsize=None)
+def reg_codec(fmt, show):
+    return RegCodec(fmt, show)
 
 
 def reg2str(dat, ofs, fmt, show):
+    return reg_codec(fmt, show).decode(dat, ofs)
+
+
+def str2reg(dat, ofs, fmt, show, str_, s_idx):
+    dat = bytearray(dat)
+    reg_codec(fmt, show).encode(dat, ofs, str_, s_idx)
+    return bytes(dat)
+
+
+def reg_layout(cfg_reg):
+    # precompiled layout of a config 'reg' section, plain data (msgpack / json), shared by server and tools:
+    #   'regs': name -> [addr, len, fmt, show, struct format or None, element size, element num]
+    #   'r' / 'w': [[addr, len, first name, last name], ...] of reg_r / reg_w groups, config order
+    regs = {}
+    for r in cfg_reg['list']:
+        if r[4] in regs:
+            continue # first one wins, same as a linear scan
+        c = reg_codec(r[2], r[3])
+        regs[r[4]] = [r[0], r[1], r[2], r[3], c.st.format if c.st else None, c.size, r[1] // c.size if c.size else 0]
+    ret = {'regs': regs}
+    for rw in ['r', 'w']:
+        ret[rw] = []
+        for g in cfg_reg.get(f'reg_{rw}', []):
+            assert(len(g) == 1 or len(g) == 2)
+            r0, r1 = regs[g[0]], regs[g[-1]]
+            ret[rw].append([r0[0], r1[0] + r1[1] - r0[0], g[0], g[-1]])
+    return ret
+
+
+class RegMap():
+    # index of a config 'reg' section, built once:
+    #   items: name -> reg list item, e.g. [addr, len, fmt, show, name, desc]
+    #   grps: 'r' / 'w' -> [addr, len] of reg_r / reg_w groups, sorted by address for bisect
+
+    def __init__(self, cfg_reg, layout=None):
+        self.items = {}
+        for r in cfg_reg['list']:
+            self.items.setdefault(r[4], r)
+        self.layout = layout or reg_layout(cfg_reg)
+        self.grps = {}
+        self.starts = {}
+        self.linear = {}    # groups overlap, use list order like before
+        for rw in ['r', 'w']:
+            grps = [g[:2] for g in self.layout[rw]]
+            s_grps = sorted(grps)
+            self.linear[rw] = grps if any([a[0] + a[1] > b[0] for a, b in zip(s_grps, s_grps[1:])]) else None
+            self.grps[rw] = s_grps
+            self.starts[rw] = [g[0] for g in s_grps]
+
+    def get(self, name):
+        return self.items.get(name)
+
+    def grp(self, addr, rw='r'):
+        # return [addr, len] of the group which contains addr, None if not found
+        if self.linear[rw] != None:
+            for g in self.linear[rw]:
+                if g[0] <= addr < g[0] + g[1]:
+                    return g
+            return None
+        i = bisect.bisect_right(self.starts[rw], addr) - 1
+        if i >= 0 and addr < self.grps[rw][i][0] + self.grps[rw][i][1]:
+            return self.grps[rw][i]
+        return None
+
+
+def _reg2str(dat, ofs, fmt, show):
     ret = ''
     f = re.sub(r'[\W_]', '', fmt) # remove non-word chars
     i = 0
@@ -188,7 +361,7 @@ def reg2str(dat, ofs, fmt, show):
     return ret, ofs
 
 
-def str2reg(dat, ofs, fmt, show, str_, s_idx):
+def _str2reg(dat, ofs, fmt, show, str_, s_idx):
     dat = bytearray(dat)
     f = re.sub(r'[\W_]', '', fmt) # remove non-word chars
     str_a = str_.split(' ')
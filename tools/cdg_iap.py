@@ -13,7 +13,15 @@ Args:
   --size       SIZE # only needed when read from mcu
   --flash-only      # do not reboot
   --enter-bl        # enter bootloader only
-  --verify     TYPE # write verify types: read, crc, none (default: read)
+  --verify     TYPE # write verify types: read, crc, none (default: read, crc for --delta)
+  --adaptive        # tune block size and batch packets while writing,
+                    # within iap cfg "blk_max" (default and limit: max block of a cdbus frame)
+                    # and "batch_max" (default: 8, or 1 if the cfg has no batch_pkts)
+  --delta           # only erase and write sectors whose crc differs
+  --sector     SIZE # erase sector size for --delta and --mcast, default: iap cfg "sector", required
+  --mcast      ADDR # write all --devs at once by multicast address, e.g. 00:00:ff or a group set by
+                    # bus_cfg_filter_m, then check each device by sector crc and rewrite bad sectors by unicast
+  --devs       LIST # device addresses for --mcast, e.g. 00:00:01,00:00:02
 
 Examples:
 
@@ -30,11 +38,17 @@ More args refers to:
 import sys, os
 import struct
 import re
-from time import sleep
+from time import sleep, time
 from intelhex import IntelHex
 from cdg_cmd import *
 from cdnet.dev.cdbus_serial import modbus_crc
 
+CDBUS_DAT_MAX = 253     # max data length of a cdbus frame
+CDNET_HDR_MAX = 7       # cdnet l1 header with net addresses and ports (l0: 2)
+# max flash write block: frame data - cdnet header - cmd and addr, 8 bytes aligned
+IAP_BLK_MAX = (CDBUS_DAT_MAX - CDNET_HDR_MAX - 5) & ~7
+IAP_BATCH_MAX = 8
+
 
 def compare_dat(a, b):
     if len(a) != len(b):
@@ -46,22 +60,35 @@ def compare_dat(a, b):
 
 
 def cdg_iap_init():
-    global addr, size, in_file, out_file, flash_only, enter_bl, verify
+    global addr, size, in_file, out_file, flash_only, enter_bl, verify, adaptive, delta, sector, mcast, devs
     addr = int(csa['args'].get("--addr", dft="0x0800c000"), 0)
     size = int(csa['args'].get("--size", dft="0"), 0)
     in_file = csa['args'].get("--in-file")
     out_file = csa['args'].get("--out-file")
     flash_only = csa['args'].get("--flash-only") != None
     enter_bl = csa['args'].get("--enter-bl") != None
-    verify = csa['args'].get("--verify", dft="read")
+    adaptive = csa['args'].get("--adaptive") != None
+    delta = csa['args'].get("--delta") != None
+    verify = csa['args'].get("--verify", dft="crc" if delta else "read") # read back costs as much as a rewrite
+    sector = csa['args'].get("--sector")
+    sector = int(sector, 0) if sector else csa['cfg']['iap'].get('sector')
+    mcast = csa['args'].get("--mcast")
+    devs = [d.strip() for d in csa['args'].get("--devs", dft="").split(',') if d.strip()]
+    if mcast and not devs:
+        print('--mcast needs --devs')
+        exit(-1)
+    if (delta or mcast) and not sector:
+        print('--delta and --mcast need the erase sector size, by --sector or iap cfg "sector"')
+        exit(-1)
 
     if not in_file and not out_file and not enter_bl:
         print(__doc__)
         exit(-1)
 
 
-def _read_flash(addr, _len):
-    csa['sock'].sendto(b'\x00' + struct.pack("<IB", addr, _len), (csa['dev_addr'], 8))
+# dev: target address, default: csa['dev_addr']
+def _read_flash(addr, _len, dev=None):
+    csa['sock'].sendto(b'\x00' + struct.pack("<IB", addr, _len), (dev or csa['dev_addr'], 8))
     ret, _ = csa['sock'].recvfrom(1)
     print(f'  {addr:08x}: ' + ret.hex() if ret else ret)
     if not ret or (ret[0] & 0xf) != 0 or len(ret[1:]) != _len:
@@ -69,22 +96,22 @@ def _read_flash(addr, _len):
         exit(-1)
     return ret[1:]
 
-def _write_flash(addr, dat, not_reply):
+def _write_flash(addr, dat, not_reply, dev=None):
     if not_reply:
-        csa['sock'].sendto(b'\xa0' + struct.pack("<I", addr) + dat, (csa['dev_addr'], 8))
+        csa['sock'].sendto(b'\xa0' + struct.pack("<I", addr) + dat, (dev or csa['dev_addr'], 8))
     else:
-        csa['sock'].sendto(b'\x20' + struct.pack("<I", addr) + dat, (csa['dev_addr'], 8))
+        csa['sock'].sendto(b'\x20' + struct.pack("<I", addr) + dat, (dev or csa['dev_addr'], 8))
 
-def _erase_flash(addr, _len):
-    csa['sock'].sendto(b'\x2f' + struct.pack("<II", addr, _len), (csa['dev_addr'], 8))
+def _erase_flash(addr, _len, dev=None):
+    csa['sock'].sendto(b'\x2f' + struct.pack("<II", addr, _len), (dev or csa['dev_addr'], 8))
     ret, _ = csa['sock'].recvfrom(60)
     print('  erase ret: ' + ret.hex() if ret else ret)
     if not ret or (ret[0] & 0xf) != 0:
         print('erase flash error')
         exit(-1)
 
-def _crc_flash(addr, _len):
-    csa['sock'].sendto(b'\x10' + struct.pack("<II", addr, _len), (csa['dev_addr'], 8))
+def _crc_flash(addr, _len, dev=None):
+    csa['sock'].sendto(b'\x10' + struct.pack("<II", addr, _len), (dev or csa['dev_addr'], 8))
     ret, _ = csa['sock'].recvfrom(3)
     print('read crc ret: ' + ret.hex() if ret else ret)
     if not ret or (ret[0] & 0xf) != 0:
@@ -94,18 +121,39 @@ def _crc_flash(addr, _len):
     return crc_val
 
 
-def read_flash(addr, _len, blk_size=128):
-    cur = addr
-    ret = b''
-    while True:
-        size = min(blk_size, _len-(cur-addr))
-        if size == 0:
-            break
-        ret += _read_flash(cur, size)
-        cur += size
-    return ret
+def read_flash(addr, _len, blk_size=128, out=None, dev=None, chunk=64):
+    # pipelined read by cd_pipe, chunk blocks per step for progress,
+    # a lost block makes cd_pipe resend only its batch (--window blocks)
+    # out: file to stream into, otherwise return the data in a preallocated buffer
+    buf = None if out else bytearray(_len)
+    t = time()
+    cur = 0
+    while cur < _len:
+        blks = []
+        while cur < _len and len(blks) < chunk:
+            size = min(blk_size, _len - cur)
+            blks.append([addr + cur, size])
+            cur += size
+        txs = [b'\x00' + struct.pack("<IB", a, n) for a, n in blks]
+        try:
+            rets = cd_pipe(dev or csa['dev_addr'], 8, txs, [n + 1 for _, n in blks], timeout=1)
+        except Exception as err:
+            print(f'\nread flash error @{blks[0][0]:08x}: {err}')
+            exit(-1)
+        for (a, n), r in zip(blks, rets):
+            if (r[0] & 0xf) != 0:
+                print(f'\nread flash error @{a:08x}: ' + r.hex())
+                exit(-1)
+            if out:
+                out.write(r[1:])
+            else:
+                buf[a-addr:a-addr+n] = r[1:]
+        dt = max(time() - t, 1e-6)
+        print(f'\r  read {cur}/{_len}, {cur / dt / 1024:.2f} KB/s  ', end='')
+    print()
+    return buf
 
-def write_flash(addr, dat, blk_size=128, group_size=0):
+def write_flash(addr, dat, blk_size=128, group_size=0, dev=None):
     cur = addr
     pend_ret_max = 2 if group_size else 1
     pend_ret = 0
@@ -120,7 +168,7 @@ def write_flash(addr, dat, blk_size=128, group_size=0):
                 size = min(blk_size, len(dat)-(cur-addr))
                 wdat = dat[cur-addr:cur-addr+size]
                 print(f'  i: {i}, reply: {not not_reply}, pend: {pend_ret}, cur: {addr:08x}, size: {size}')
-                _write_flash(cur, wdat, not_reply)
+                _write_flash(cur, wdat, not_reply, dev)
                 cur += size
             pend_ret += 1
         elif pend_ret:
@@ -137,20 +185,272 @@ def write_flash(addr, dat, blk_size=128, group_size=0):
     return 0
 
 
-def _enter_bl():
+class IapTuner():
+    # adapt block size and batch packets of flash writes:
+    # measure throughput of every few acked groups, grow batch / blk_size in turn while throughput improves,
+    # step back and stop growing that one if it got worse,
+    # on write error go back to the last good setting and stop growing, or halve both if there is none
+
+    EPOCH = 8   # acked groups per measurement
+
+    def __init__(self, blk, batch, blk_max, batch_max, blk_min=32):
+        self.blk, self.batch = blk, max(batch, 1)
+        self.blk_max, self.batch_max = max(blk_max, blk), max(batch_max, self.batch)
+        self.blk_min = min(blk_min, blk)
+        self.grow = 'batch'     # next to grow, None: done
+        self.last = None        # (throughput, blk, batch) before last grow
+        self.good = None        # (blk, batch) of last error free measurement
+        self.cnt = 0
+        self.bytes = 0
+        self.t = None
+        self.total = 0          # acked bytes, including restarted parts
+        self.done = 0           # bytes of finished segments
+        self.t_start = None
+        self.errs = 0
+
+    def start(self):
+        self.t = self.t_start = time()
+
+    def ok(self, nbytes):
+        self.cnt += 1
+        self.bytes += nbytes
+        self.total += nbytes
+        if self.cnt < self.EPOCH:
+            return
+        now = time()
+        tp = self.bytes / max(now - self.t, 1e-6)
+        self.cnt, self.bytes, self.t = 0, 0, now
+        self.good = (self.blk, self.batch)
+        if self.last and tp < self.last[0]: # worse, step back
+            _, self.blk, self.batch = self.last
+            self.grow = 'blk' if self.grow == 'batch' else None
+            self.last = None
+            return
+        self.last = (tp, self.blk, self.batch)
+        while self.grow:
+            if self.grow == 'batch' and self.batch < self.batch_max:
+                self.batch += 1
+                break
+            if self.grow == 'blk' and self.blk < self.blk_max:
+                self.blk = min(self.blk * 2, self.blk_max)
+                break
+            self.grow = 'blk' if self.grow == 'batch' else None
+
+    def err(self):
+        self.errs += 1
+        if self.good and self.good != (self.blk, self.batch):
+            self.blk, self.batch = self.good
+        else:
+            self.blk = max(self.blk // 2, self.blk_min)
+            self.batch = max(self.batch // 2, 1)
+        self.good = None
+        self.blk_max, self.batch_max = self.blk, self.batch # don't grow into errors again
+        self.grow = None
+        self.last = None
+        self.cnt, self.bytes, self.t = 0, 0, time()
+
+    def report(self):
+        dt = time() - self.t_start
+        return f'{self.done} bytes in {dt:.2f}s, {self.done / max(dt, 1e-6) / 1024:.2f} KB/s ' \
+               f'(sent: {self.total}), blk_size: {self.blk}, batch_pkts: {self.batch}, errors: {self.errs}'
+
+
+def _write_grps(addr, dat, tuner):
+    # same as write_flash, but the group size and block size follow the tuner, return False on error
+    cur = addr
+    pend = []   # bytes of groups waiting for reply
     while True:
-        info_str = cd_read_info(csa['dev_addr'], timeout=0.1)
+        if len(pend) < 2 and cur - addr < len(dat):
+            blk_size, group_size = tuner.blk, tuner.batch
+            nbytes = 0
+            for i in range(group_size):
+                if cur - addr >= len(dat):
+                    break
+                not_reply = i + 1 < group_size and cur - addr + blk_size < len(dat)
+                size = min(blk_size, len(dat)-(cur-addr))
+                _write_flash(cur, dat[cur-addr:cur-addr+size], not_reply)
+                cur += size
+                nbytes += size
+            pend.append(nbytes)
+        elif pend:
+            ret, _ = csa['sock'].recvfrom(1)
+            if not ret or (ret[0] & 0xf) != 0:
+                print(f'  write ret err @{cur:08x}: ' + ret.hex() if ret else ret)
+                return False
+            tuner.ok(pend.pop(0))
+            print(f'\r  write {cur - addr}/{len(dat)}, blk_size: {tuner.blk}, batch: {tuner.batch}  ', end='')
+        else:
+            print()
+            return True
+
+
+def write_flash_adaptive(addr, dat, tuner, retry=3):
+    # flash can't be rewritten without erase, so restart the segment after an error
+    for cnt in range(retry):
+        csa['sock'].clear()
+        if _write_grps(addr, dat, tuner):
+            tuner.done += len(dat)
+            return 0
+        tuner.err()
+        print(f'  re-erase and restart, blk_size: {tuner.blk}, batch_pkts: {tuner.batch}')
+        sleep(0.1)
+        csa['sock'].clear()
+        _erase_flash(addr, len(dat))
+    print('write flash error')
+    exit(-1)
+
+
+def crc_flash_multi(ranges, dev=None):
+    # crc of [[addr, len], ...] by pipelined requests
+    txs = [b'\x10' + struct.pack("<II", a, n) for a, n in ranges]
+    rets = cd_pipe(dev or csa['dev_addr'], 8, txs, [3] * len(txs), timeout=3)
+    for r in rets:
+        if (r[0] & 0xf) != 0:
+            print('read crc error: ' + r.hex())
+            exit(-1)
+    return [struct.unpack("<H", r[1:3])[0] for r in rets]
+
+
+def delta_flash(addr, dat, sector, write_fn, dev=None):
+    # compare crc of each sector, erase and rewrite the runs of changed sectors, then check the whole crc
+    # a run covers whole sectors, the parts out of the image are read from the device before erase
+    ranges = []
+    cur = addr
+    while cur < addr + len(dat):
+        end = min((cur // sector + 1) * sector, addr + len(dat))
+        ranges.append([cur, end - cur])
+        cur = end
+    crcs = crc_flash_multi(ranges, dev)
+    runs = []
+    for (a, n), crc in zip(ranges, crcs):
+        if crc == modbus_crc(dat[a-addr:a-addr+n]):
+            continue
+        s0 = a // sector * sector
+        if runs and runs[-1][1] == s0:
+            runs[-1][1] = s0 + sector
+        else:
+            runs.append([s0, s0 + sector])
+    end = addr + len(dat)
+    changed = sum([s1 - s0 for s0, s1 in runs])
+    print(f'delta: {len(ranges)} sectors, changed: {changed} bytes in {len(runs)} runs')
+    for s0, s1 in runs:
+        print(f'  update {s1 - s0} bytes @{s0:08x}')
+        buf = bytearray(s1 - s0)
+        if s0 < addr:
+            buf[:addr-s0] = read_flash(s0, addr - s0, dev=dev)
+        if end < s1:
+            buf[end-s0:] = read_flash(end, s1 - end, dev=dev)
+        buf[max(addr, s0)-s0:min(end, s1)-s0] = dat[max(addr, s0)-addr:min(end, s1)-addr]
+        _erase_flash(s0, s1 - s0, dev)
+        write_fn(s0, bytes(buf))
+    crc = modbus_crc(dat)
+    rcrc = crc_flash_multi([[addr, len(dat)]], dev)[0]
+    if crc != rcrc:
+        print(f'delta: crc err: {rcrc:04x} != {crc:04x}')
+        exit(-1)
+    print('delta: whole crc ok')
+    return changed
+
+
+def load_segs(in_file, addr):
+    # return [[addr, dat], ...] of .bin or .hex file
+    if in_file.lower().endswith('.bin'):
+        with open(in_file, 'rb') as f:
+            return [[addr, f.read()]]
+    dat = []
+    ih = IntelHex()
+    try:
+        ih.loadhex(in_file)
+        segs = ih.segments()
+        csa['logger'].info(f'parse ihex file, segments: {[list(map(hex, l)) for l in segs]} (end addr inclusive)')
+        for seg in segs:
+            s = [seg[0], ih.tobinstr(seg[0], size=seg[1]-seg[0])]
+            dat.append(s)
+    except Exception as err:
+        csa['logger'].error(f'parse ihex file error: {err}')
+        exit(-1)
+    return dat
+
+
+def _wait_replies(devs, timeout):
+    # collect one ok reply from each of devs, return devs not replied in time
+    wait = set(devs)
+    t_end = time() + timeout
+    while wait and time() < t_end:
+        ret, src = csa['sock'].recvfrom(timeout=max(t_end - time(), 0.01))
+        if src and src[0] in wait and ret and (ret[0] & 0xf) == 0:
+            wait.discard(src[0])
+    return wait
+
+
+def mcast_erase(addr, _len, devs, mcast):
+    csa['sock'].clear()
+    csa['sock'].sendto(b'\x2f' + struct.pack("<II", addr, _len), (mcast, 8))
+    for dev in _wait_replies(devs, 60):
+        print(f'  {dev}: no erase reply, erase by unicast')
+        _erase_flash(addr, _len, dev)
+
+
+def mcast_write(addr, dat, devs, mcast, blk_size=128, group_size=0):
+    # no reply writes to the multicast address, the last packet of each group asks all devices to reply,
+    # as flow control, lost packets are found by the crc check afterwards
+    cur = addr
+    lost = set()
+    group_size = max(group_size, 1)
+    csa['sock'].clear()
+    while cur - addr < len(dat):
+        for i in range(group_size):
+            if cur - addr >= len(dat):
+                break
+            not_reply = i + 1 < group_size and cur - addr + blk_size < len(dat)
+            size = min(blk_size, len(dat)-(cur-addr))
+            _write_flash(cur, dat[cur-addr:cur-addr+size], not_reply, mcast)
+            cur += size
+        missed = _wait_replies(devs, 1)
+        if missed - lost:
+            print(f'\n  no write reply @{cur:08x}: {sorted(missed - lost)}')
+        lost |= missed
+        print(f'\r  mcast write {cur - addr}/{len(dat)}  ', end='')
+    print()
+    return lost
+
+
+def mcast_flash(segs, devs, mcast, sector, blk_size, batch_pkts):
+    # write all devices at once, then fix each device by per sector crc and unicast rewrite
+    t = time()
+    for a, d in segs:
+        print(f'mcast erase {len(d)} bytes @{a:08x}')
+        mcast_erase(a, len(d), devs, mcast)
+    for a, d in segs:
+        print(f'mcast write {len(d)} bytes @{a:08x}')
+        mcast_write(a, d, devs, mcast, blk_size, batch_pkts)
+    print(f'mcast done in {time() - t:.2f}s, check devices ...')
+    ret = {}
+    for dev in devs:
+        fixed = 0
+        for a, d in segs:
+            fixed += delta_flash(a, d, sector, lambda a_, d_: write_flash(a_, d_, blk_size, batch_pkts, dev), dev)
+        ret[dev] = fixed
+    for dev in devs:
+        print(f'  {dev}: ' + (f'rewrote {ret[dev]} bytes' if ret[dev] else 'ok'))
+    print(f'total: {time() - t:.2f}s')
+
+
+def _enter_bl(dev=None):
+    dev = dev or csa['dev_addr']
+    while True:
+        info_str = cd_read_info(dev, timeout=0.1)
         print('waiting (bl) in info string ...')
         print(f'info: {info_str}')
         if '(bl)' in info_str:
             if 'keep_bl' in csa['cfg']['iap']:
-                cd_reg_rw(csa['dev_addr'], csa['cfg']['iap']['keep_bl'], write=b'\x01', timeout=0.2)
+                cd_reg_rw(dev, csa['cfg']['iap']['keep_bl'], write=b'\x01', timeout=0.2)
                 print('keeped in bl mode')
             break
         elif info_str != 'error':
             print('do reboot before flash ...')
             try:
-                cd_reg_rw(csa['dev_addr'], csa['cfg']['iap']['reboot'], write=b'\x01', timeout=0.2, retry=1)
+                cd_reg_rw(dev, csa['cfg']['iap']['reboot'], write=b'\x01', timeout=0.2, retry=1)
             except Exception as err:
                 pass
 
@@ -165,16 +465,43 @@ if __name__ == "__main__":
         batch_pkts = csa['cfg']['iap']['batch_pkts']
     if 'blk_size' in csa['cfg']['iap']:
         blk_size = csa['cfg']['iap']['blk_size']
+    blk_size = min(blk_size, IAP_BLK_MAX)
     print(f'iap: blk_size: {blk_size}, batch_pkts: {batch_pkts}')
+    tuner = None
+    if adaptive:
+        blk_max = min(csa['cfg']['iap'].get('blk_max', IAP_BLK_MAX), IAP_BLK_MAX)
+        batch_max = csa['cfg']['iap'].get('batch_max', IAP_BATCH_MAX if batch_pkts else 1)
+        tuner = IapTuner(blk_size, batch_pkts, blk_max, batch_max)
+        print(f'iap adaptive: blk_max: {tuner.blk_max}, batch_max: {tuner.batch_max}')
+
+    def write_seg(a, d):
+        if tuner:
+            write_flash_adaptive(a, d, tuner)
+        else:
+            write_flash(a, d, blk_size, batch_pkts)
 
     if enter_bl:
         _enter_bl()
 
     elif out_file:
         print('read %d bytes @%08x to file' % (size, addr), out_file)
-        ret = read_flash(addr, size, blk_size)
         with open(out_file, 'wb') as f:
-            f.write(ret)
+            read_flash(addr, size, blk_size, f)
+
+    elif in_file and mcast:
+        segs = load_segs(in_file, addr)
+        if not flash_only:
+            for dev in devs:
+                _enter_bl(dev)
+        mcast_flash(segs, devs, mcast, sector, blk_size, batch_pkts)
+        if not flash_only:
+            print('do reboot after flash ...')
+            for dev in devs:
+                try:
+                    cd_reg_rw(dev, csa['cfg']['iap']['reboot'], write=b'\x02', timeout=0.2, retry=1)
+                except Exception as err:
+                    pass
+        print('flash succeed.')
 
     elif in_file:
         if not flash_only:
@@ -184,8 +511,15 @@ if __name__ == "__main__":
             with open(in_file, 'rb') as f:
                 dat = f.read()
             print('write %d bytes @%08x from file' % (len(dat), addr), in_file)
-            _erase_flash(addr, len(dat))
-            write_flash(addr, dat, blk_size, batch_pkts)
+            if tuner:
+                tuner.start()
+            if delta:
+                delta_flash(addr, dat, sector, write_seg)
+            else:
+                _erase_flash(addr, len(dat))
+                write_seg(addr, dat)
+            if tuner:
+                print(f'write: {tuner.report()}')
             if verify == 'read':
                 rdat = read_flash(addr, len(dat), blk_size)
                 ret = compare_dat(dat, rdat)
@@ -207,26 +541,25 @@ if __name__ == "__main__":
                 print('succeeded without check')
 
         elif in_file.lower().endswith('.hex'):
-            dat = []
-            ih = IntelHex()
-            try:
-                ih.loadhex(in_file)
-                segs = ih.segments()
-                csa['logger'].info(f'parse ihex file, segments: {[list(map(hex, l)) for l in segs]} (end addr inclusive)')
-                for seg in segs:
-                    s = [seg[0], ih.tobinstr(seg[0], size=seg[1]-seg[0])]
-                    dat.append(s)
-            except Exception as err:
-                csa['logger'].error(f'parse ihex file error: {err}')
-                exit(-1)
-
-            for i in range(len(dat)):
-                print(f'flash_erase... addr: {dat[i][0]:08x}, len: {len(dat[i][1])}')
-                _erase_flash(dat[i][0], len(dat[i][1]))
-
-            for i in range(len(dat)):
-                print(f'write {len(dat[i][1])} bytes @{dat[i][0]:08x} from file', in_file)
-                write_flash(dat[i][0], dat[i][1], blk_size, batch_pkts)
+            dat = load_segs(in_file, addr)
+
+            if tuner:
+                tuner.start()
+            if delta:
+                # a sector shared by segments keeps the other one, delta_flash reads it back before erase
+                for i in range(len(dat)):
+                    print(f'seg {i}: {len(dat[i][1])} bytes @{dat[i][0]:08x}')
+                    delta_flash(dat[i][0], dat[i][1], sector, write_seg)
+            else:
+                for i in range(len(dat)):
+                    print(f'flash_erase... addr: {dat[i][0]:08x}, len: {len(dat[i][1])}')
+                    _erase_flash(dat[i][0], len(dat[i][1]))
+
+                for i in range(len(dat)):
+                    print(f'write {len(dat[i][1])} bytes @{dat[i][0]:08x} from file', in_file)
+                    write_seg(dat[i][0], dat[i][1])
+            if tuner:
+                print(f'write: {tuner.report()}')
 
             for i in range(len(dat)):
                 if verify == 'read':
@@ -5,18 +5,99 @@
 # Author: Duke Fong <d@d-l.io>
 #
 
-import os
+import os, re
 import asyncio
 import mimetypes
+import gzip, hashlib
 import umsgpack
 import logging
 import websockets
 from websockets.server import serve
 from http import HTTPStatus
-from cd_ws import CDWebSocket, CDWebSocketNS
+from cd_ws import CDWebSocket, CDWebSocketNS, CDWebSocketConn
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ZIP_MIN = 1024      # min file size to precompress
+ZIP_TYPES = ('text/', 'application/javascript', 'application/json', 'application/wasm', 'image/svg+xml')
 
 ws_ns = CDWebSocketNS('server')
 logger = logging.getLogger(f'cdgui.web')
+mime = mimetypes.MimeTypes()
+mime.add_type('text/javascript', '.js')
+mime.add_type('application/wasm', '.wasm')
+
+server_root = os.path.join(os.getcwd(), 'html')
+static_files = {}   # full_path: {'mtime', 'size', 'etag', 'type', 'body', 'gzip', 'br', 'deps'}
+
+MOD_HTML_RE = re.compile(rb'<script\s[^>]*type=["\']module["\'][^>]*\ssrc=["\']([^"\']+)["\']')
+MOD_JS_RE = re.compile(rb'(?:^|[;\s])(?:import|export)\s*(?:[\w*{}\s,$]*?\sfrom\s*)?["\']([^"\']+)["\']')
+
+
+def module_deps(full_path, body):
+    # static es module imports of a js or html file, as full paths inside server_root
+    rex = MOD_HTML_RE if full_path.endswith('.html') else MOD_JS_RE
+    deps = []
+    for m in rex.finditer(body):
+        url = m.group(1).decode(errors='ignore').split('?')[0]
+        if url.startswith('/'):
+            dep = os.path.realpath(os.path.join(server_root, url[1:]))
+        elif url.startswith('.'):
+            dep = os.path.realpath(os.path.join(os.path.dirname(full_path), url))
+        else:
+            continue
+        if os.path.commonpath((server_root, dep)) == server_root and dep not in deps:
+            deps.append(dep)
+    return deps
+
+
+def module_preload(full_path):
+    # all modules imported by a page, the graph follows file changes by static_load
+    ret = []
+    pend = list(static_files[full_path]['deps'])
+    while pend:
+        dep = pend.pop(0)
+        f = static_load(dep)
+        if not f or dep in ret:
+            continue
+        ret.append(dep)
+        pend += f['deps']
+    return ret
+
+
+def static_load(full_path):
+    # load file to cache if it changed, with precompressed variants, return None if not exists
+    try:
+        st = os.stat(full_path)
+    except OSError:
+        static_files.pop(full_path, None)
+        return None
+    f = static_files.get(full_path)
+    if f and f['mtime'] == st.st_mtime_ns and f['size'] == st.st_size:
+        return f
+    with open(full_path, 'rb') as fp:
+        body = fp.read()
+    f = {'mtime': st.st_mtime_ns, 'size': st.st_size, 'body': body,
+         'etag': f'"{hashlib.sha1(body).hexdigest()[:16]}"',
+         'type': mime.guess_type(full_path)[0] or 'application/octet-stream', 'gzip': None, 'br': None}
+    f['deps'] = module_deps(full_path, body) if f['type'] in ('text/html', 'text/javascript') else []
+    if len(body) >= ZIP_MIN and f['type'].startswith(ZIP_TYPES):
+        z = gzip.compress(body, 9, mtime=0)
+        f['gzip'] = z if len(z) < len(body) else None
+        if brotli:
+            z = brotli.compress(body)
+            f['br'] = z if len(z) < len(body) else None
+    static_files[full_path] = f
+    return f
+
+
+def static_preload():
+    for root, dirs, files in os.walk(server_root):
+        for name in files:
+            static_load(os.path.join(root, name))
+    logger.info(f'static files preloaded: {len(static_files)}, brotli: {bool(brotli)}')
 
 
 async def http_file_server(path, request):
@@ -29,32 +110,47 @@ async def http_file_server(path, request):
         ('Server', 'asyncio'),
         ('Connection', 'close'),
     ]
-    server_root = os.path.join(os.getcwd(), 'html')
     full_path = os.path.realpath(os.path.join(server_root, path[1:]))
     log_str = f'GET {path}'
 
     # Validate the path
-    if os.path.commonpath((server_root, full_path)) != server_root or \
-            not os.path.exists(full_path) or not os.path.isfile(full_path):
+    f = None
+    if os.path.commonpath((server_root, full_path)) == server_root and os.path.isfile(full_path):
+        f = static_load(full_path)
+    if not f:
         logger.warning(f'{log_str} 404 NOT FOUND')
         return HTTPStatus.NOT_FOUND, response_headers, b'404 NOT FOUND'
 
+    # always revalidate, unchanged files cost a 304 only
+    response_headers += [('ETag', f['etag']), ('Cache-Control', 'no-cache'), ('Vary', 'Accept-Encoding')]
+    if f['type'] == 'text/html' and f['deps']:
+        # fetch the whole module tree in parallel instead of level by level
+        links = [f'</{os.path.relpath(dep, server_root).replace(os.sep, "/")}>; rel=modulepreload' for dep in module_preload(full_path)]
+        response_headers.append(('Link', ', '.join(links)))
+    if f['etag'] in [t.strip() for t in request.get('If-None-Match', '').split(',')]:
+        logger.debug(f'{log_str} 304 NOT MODIFIED')
+        return HTTPStatus.NOT_MODIFIED, response_headers, b''
+
     logger.info(f'{log_str} 200 OK')
-    with open(full_path, 'rb') as f:
-        body = f.read()
+    body = f['body']
+    accept = [e.split(';')[0].strip() for e in request.get('Accept-Encoding', '').split(',')]
+    for enc in ('br', 'gzip'):
+        if f[enc] and enc in accept:
+            body = f[enc]
+            response_headers.append(('Content-Encoding', enc))
+            break
     response_headers.append(('Content-Length', str(len(body))))
-    response_headers.append(('Content-Type', mimetypes.MimeTypes().guess_type(full_path)[0] or \
-            'application/octet-stream'))
+    response_headers.append(('Content-Type', f['type']))
     return HTTPStatus.OK, response_headers, body
 
 
 async def ws_handler(ws, path):
+    logger.info(f'ws: connect, path: {path}')
+    if path in ws_ns.connections:
+        logger.warning(f'ws: only allow one connection for: {path}')
+        return
+    conn = ws_ns.connections[path] = CDWebSocketConn(ws)
     try:
-        logger.info(f'ws: connect, path: {path}')
-        if path in ws_ns.connections:
-            logger.warning(f'ws: only allow one connection for: {path}')
-            return
-        ws_ns.connections[path] = ws
         while True:
             msg_ = await ws.recv()
             msg = umsgpack.unpackb(msg_)
@@ -69,11 +165,30 @@ async def ws_handler(ws, path):
     #except:
     #    pass
     
-    del ws_ns.connections[path]
-    logger.info(f'ws: disconnect, path: {path}')
+    finally:
+        conn.close()
+        del ws_ns.connections[path]
+        logger.info(f'ws: disconnect, path: {path}, {conn.stat()}')
+
+
+async def ws_stat_service():
+    sock = CDWebSocket(ws_ns, 'ws')
+    while True:
+        dat, src = await sock.recvfrom()
+        
+        if dat['action'] == 'stat': # {path: {'depth', 'depth_drop', 'drops', 'sent'}}
+            await sock.sendto(ws_ns.stat(), src)
+        
+        elif dat['action'] == 'policy': # {'port', 'drop'}, send policy of a port of the page
+            ws_ns.set_drop((src[0], dat['port']), dat['drop'])
+            await sock.sendto('successed', src)
+        
+        else:
+            await sock.sendto('err: ws: unknown cmd', src)
 
 
 async def start_web(addr='localhost', port=8910):                                                     
+    static_preload()
+    asyncio.create_task(ws_stat_service())
     server = await serve(ws_handler, addr, port, process_request=http_file_server)
     await server.wait_closed()
-